@@ -0,0 +1,1860 @@
+import argparse
+import asyncio
+import collections
+import datetime
+import difflib
+import functools
+import itertools
+import json
+import math
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.request
+import wave
+from concurrent import futures
+
+import grpc
+import numpy as np
+from google.cloud import speech
+
+import stt_app.main as stt
+from stt_app.main import (
+    API_STREAM_LIMIT,
+    AUDIO_ENCODERS,
+    AsyncSessionManager,
+    AudioArchive,
+    BatchTranscriber,
+    AudioRingBuffer,
+    CaptureBuffer,
+    BRIDGING_WINDOW,
+    CHUNK_SIZE,
+    EncoderStats,
+    FinalMerger,
+    FileAudioSource,
+    InterimView,
+    KeywordSpotter,
+    REQUEST_MAX_BYTES,
+    RESAMPLE_ZERO_CROSSINGS,
+    RequestCoalescer,
+    Resampler,
+    ResumableMicrophoneStream,
+    SAMPLE_RATE,
+    SerialThread,
+    SessionManager,
+    SharedAudioSource,
+    SpeechClientPool,
+    STREAMING_LIMIT,
+    StreamTimeMap,
+    SyntheticAudioSource,
+    TranscriptJournal,
+    VoiceActivityDetector,
+    create_speech_client,
+    enable_metrics,
+    unavailable_encoders,
+)
+
+CHUNK_MS = CHUNK_SIZE * 1000 / SAMPLE_RATE
+ALLOCATION_WINDOW = 60  # seconds of audio traced for allocation counts
+FAILURES = []
+
+
+def check(passed, message):
+    """Record a failed expectation; the run then exits non-zero."""
+    if not passed:
+        print(f"FAIL: {message}")
+        FAILURES.append(message)
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not values:
+        return float("nan")
+    return values[min(len(values) - 1, max(0, math.ceil(pct / 100 * len(values)) - 1))]
+
+
+def print_latencies(name, values):
+    values = sorted(values)
+    print(f"{name}: n={len(values)} " + " ".join(
+        f"p{pct}={percentile(values, pct) * 1000:.1f}ms" for pct in (50, 90, 99)))
+
+
+class ScriptedResult:
+    """A response FakeSpeechServer sends once `end_ms` of audio has arrived."""
+
+    def __init__(self, end_ms, transcript, is_final=False, stability=0.0, delay_ms=0,
+                 words=()):
+        self.end_ms = end_ms
+        self.transcript = transcript
+        self.is_final = is_final
+        self.stability = stability
+        self.delay_ms = delay_ms
+        self.words = words  # (word, start_ms, end_ms) time offsets
+
+
+class FakeSpeechServer:
+    """Local stand-in for the Speech StreamingRecognize API.
+
+    Each stream replays the script in a loop, shifting result_end_time by
+    `period` ms on every pass, and answers as soon as enough audio has been
+    received to cover the next entry. Like the real API it aborts a stream
+    with OUT_OF_RANGE once more than `stream_limit` ms of audio was sent.
+    Audio duration is counted as LINEAR16 at the configured sample rate.
+    Streams beyond `max_streams` at a time fail with RESOURCE_EXHAUSTED, as
+    they do past the API's concurrency quota. Each request costs
+    `request_cost_ms` plus `audio_cost` ms per ms of audio it carries, so
+    many small requests fall behind where fewer large ones keep up.
+    """
+
+    SERVICE = "google.cloud.speech.v1.Speech"
+
+    def __init__(self, script=None, period=None, port=0,
+                 stream_limit=API_STREAM_LIMIT, max_workers=64, max_streams=None,
+                 request_cost_ms=0, audio_cost=0.0):
+        self.script = script or self.default_script()
+        self.period = period or self.script[-1].end_ms
+        self.stream_limit = stream_limit
+        self.request_cost_ms = request_cost_ms
+        self.audio_cost = audio_cost
+
+        self._server = grpc.server(futures.ThreadPoolExecutor(max_workers=max_workers),
+                                   maximum_concurrent_rpcs=max_streams)
+        handler = grpc.method_handlers_generic_handler(self.SERVICE, {
+            "StreamingRecognize": grpc.stream_stream_rpc_method_handler(
+                self._streaming_recognize,
+                request_deserializer=speech.StreamingRecognizeRequest.deserialize,
+                response_serializer=speech.StreamingRecognizeResponse.serialize,
+            ),
+        })
+        self._server.add_generic_rpc_handlers((handler,))
+        self.port = self._server.add_insecure_port(f"localhost:{port}")
+        self.endpoint = f"localhost:{self.port}"
+
+    @staticmethod
+    def default_script(words="the quick brown fox jumps over the lazy dog",
+                       word_ms=300, pause_ms=700, delay_ms=100, final_delay_ms=250):
+        """One utterance with an interim result per word, then its final."""
+        words = words.split()
+        script = []
+        for i in range(1, len(words) + 1):
+            script.append(ScriptedResult(
+                i * word_ms, " ".join(words[:i]),
+                stability=round(i / len(words) * 0.9, 2), delay_ms=delay_ms))
+        script.append(ScriptedResult(
+            len(words) * word_ms + pause_ms, " ".join(words),
+            is_final=True, stability=1.0, delay_ms=final_delay_ms,
+            words=[(word, i * word_ms, (i + 1) * word_ms) for i, word in enumerate(words)]))
+        return script
+
+    def start(self):
+        self._server.start()
+        return self
+
+    def stop(self, grace=None):
+        self._server.stop(grace)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, type, value, traceback):
+        self.stop()
+
+    def _response(self, entry, end_ms):
+        shift = end_ms - entry.end_ms
+        alternative = speech.SpeechRecognitionAlternative(
+            transcript=entry.transcript,
+            confidence=0.9 if entry.is_final else 0.0,
+            words=[speech.WordInfo(word=word,
+                                   start_time=datetime.timedelta(milliseconds=start + shift),
+                                   end_time=datetime.timedelta(milliseconds=end + shift))
+                   for word, start, end in entry.words],
+        )
+        return speech.StreamingRecognizeResponse(results=[
+            speech.StreamingRecognitionResult(
+                alternatives=[alternative],
+                is_final=entry.is_final,
+                stability=entry.stability,
+                result_end_time=datetime.timedelta(milliseconds=end_ms),
+            ),
+        ])
+
+    def _streaming_recognize(self, requests, context):
+        rate = SAMPLE_RATE
+        audio_bytes = 0
+        index = 0
+        cycle = 0
+
+        for request in requests:
+            if "streaming_config" in request:
+                rate = request.streaming_config.config.sample_rate_hertz or rate
+                continue
+
+            audio_ms = len(request.audio_content) * 1000 / 2 / rate
+            cost_ms = self.request_cost_ms + self.audio_cost * audio_ms
+            if cost_ms:
+                time.sleep(cost_ms / 1000)
+            audio_bytes += len(request.audio_content)
+            received_ms = audio_bytes * 1000 / 2 / rate
+            if received_ms > self.stream_limit:
+                context.abort(
+                    grpc.StatusCode.OUT_OF_RANGE,
+                    "Exceeded maximum allowed stream duration of "
+                    f"{self.stream_limit // 1000} seconds.")
+
+            while True:
+                entry = self.script[index]
+                end_ms = entry.end_ms + cycle * self.period
+                if end_ms > received_ms:
+                    break
+                if entry.delay_ms:
+                    time.sleep(entry.delay_ms / 1000)
+                yield self._response(entry, end_ms)
+
+                index += 1
+                if index == len(self.script):
+                    index = 0
+                    cycle += 1
+
+
+class TimedMicrophoneStream(ResumableMicrophoneStream):
+    """Records when each chunk was captured, for end-to-end latencies."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.capture_times = []
+
+    def _fill_buffer(self, in_data):
+        if in_data is not None:
+            self.capture_times.append(time.perf_counter())
+        super()._fill_buffer(in_data)
+
+    def capture_time(self, end_ms):
+        """When the chunk holding the audio at `end_ms` was captured."""
+        index = min(len(self.capture_times) - 1, max(0, math.ceil(end_ms / CHUNK_MS) - 1))
+        return self.capture_times[index]
+
+
+def bench_ringbuffer(args):
+    """Simulate stream restarts and check the bridging history stays flat."""
+    history = AudioRingBuffer(SAMPLE_RATE * BRIDGING_WINDOW // 1000)
+    chunk = bytes(CHUNK_SIZE * 2)
+    chunks_per_stream = STREAMING_LIMIT * SAMPLE_RATE // 1000 // CHUNK_SIZE
+
+    usage = [0] * args.restarts
+    tracemalloc.start()
+    for restart in range(args.restarts):
+        for _ in range(chunks_per_stream):
+            history.write(chunk)
+        stream_start = history.write_pos
+        # Replay the last few seconds as the generator does after a restart.
+        bridge = history.view(stream_start - 5 * SAMPLE_RATE, stream_start)
+        b"".join(bridge)
+        del bridge
+        usage[restart] = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    print(f"restarts: {args.restarts}")
+    print(f"traced memory after first restart: {usage[0]} bytes")
+    print(f"traced memory range: {min(usage)} - {max(usage)} bytes")
+    print(f"growth over run: {usage[-1] - usage[0]} bytes")
+    # A few bytes come and go as the positions outgrow their ints; a kept
+    # chunk would show up as a whole chunk.
+    check(usage[-1] - usage[0] < CHUNK_SIZE * 2, "the bridging history grew across restarts")
+    check(max(usage) - min(usage) <= CHUNK_SIZE * 2,
+          "a restart left more than a chunk of memory behind")
+
+    # Edge cases on a ten-sample buffer whose samples hold their positions.
+    def samples(start, end):
+        return np.arange(start, end, dtype="<u2").tobytes()
+
+    small = AudioRingBuffer(10)
+    for start in range(0, 21, 3):
+        small.write(samples(start, start + 3))
+    views = small.view(small.write_pos - 10, small.write_pos)
+    check(len(views) == 2 and b"".join(views) == samples(11, 21),
+          "a view across the wraparound does not read back the last ten samples")
+    check(b"".join(small.view(0, 15)) == samples(11, 15),
+          "a view reaching past the oldest sample is not clipped to it")
+    small.write(samples(21, 46))
+    check(small.oldest == 36 and b"".join(small.view(0, 46)) == samples(36, 46),
+          "a write larger than the buffer does not keep just its tail")
+    small.skip(4)
+    check(b"".join(small.view(46, 50)) == bytes(8) and small.write_pos == 50,
+          "skipped samples do not read back as silence")
+    check(small.view(50, 60) == [], "a view past the newest sample is not empty")
+
+
+def bench_source(args):
+    """Pull a headless audio source through the stream generator."""
+    if args.file:
+        source = FileAudioSource(args.file, SAMPLE_RATE, CHUNK_SIZE, speed=args.speed)
+    else:
+        source = SyntheticAudioSource(SAMPLE_RATE, CHUNK_SIZE, kind=args.kind,
+                                      duration=args.duration, speed=args.speed)
+
+    vad = VoiceActivityDetector(SAMPLE_RATE) if args.vad else None
+
+    audio_bytes = 0
+    started = time.perf_counter()
+    with ResumableMicrophoneStream(SAMPLE_RATE, CHUNK_SIZE, source, vad) as stream:
+        for data in stream.generator():
+            audio_bytes += len(data)
+    elapsed = time.perf_counter() - started
+
+    audio_seconds = stream.audio_history.write_pos / SAMPLE_RATE
+    print(f"audio: {audio_seconds:.1f} s in {elapsed:.2f} s "
+          f"({audio_seconds / elapsed:.1f}x real time)")
+    if vad is not None:
+        print(f"sent: {audio_bytes / 2 / SAMPLE_RATE:.1f} s, "
+              f"suppressed: {vad.suppressed_seconds:.1f} s")
+
+
+def bench_encoding(args):
+    """Compare upstream bitrate and CPU cost of the audio encodings."""
+    chunks = []
+    source = SyntheticAudioSource(SAMPLE_RATE, CHUNK_SIZE, kind=args.kind, speed=0)
+    for _ in range(int(args.duration * SAMPLE_RATE / CHUNK_SIZE)):
+        chunks.append(source._read_chunk())
+
+    unavailable = unavailable_encoders()
+    for encoding in args.encodings or AUDIO_ENCODERS:
+        if encoding in unavailable:
+            print(f"{encoding}: skipped, {unavailable[encoding]}")
+            continue
+        stats = EncoderStats()
+        encoder = AUDIO_ENCODERS[encoding](SAMPLE_RATE, stats)
+        for _ in encoder.encode_stream(iter(chunks)):
+            pass
+        print(f"{encoding}: {stats.bytes_out * 8 / args.duration / 1000:.1f} kbit/s, "
+              f"{stats.ratio:.1f}:1, "
+              f"{stats.cpu_seconds / args.duration * 1000:.2f} ms CPU per audio second")
+
+
+def first_response_time(client, streaming_config):
+    started = time.perf_counter()
+    requests = iter([speech.StreamingRecognizeRequest(audio_content=bytes(CHUNK_SIZE * 2))])
+    for _ in client.streaming_recognize(streaming_config, requests):
+        return time.perf_counter() - started
+
+
+def bench_client(args):
+    """Time from starting a session to its first response, cold vs pooled."""
+    streaming_config = speech.StreamingRecognitionConfig(
+        config=speech.RecognitionConfig(
+            encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
+            sample_rate_hertz=SAMPLE_RATE,
+            language_code="en-US",
+        ),
+        interim_results=True,
+    )
+    script = [ScriptedResult(CHUNK_MS, "hello")]
+
+    with FakeSpeechServer(script) as server:
+        endpoint = args.endpoint or server.endpoint
+        cold = []
+        for _ in range(args.sessions):
+            started = time.perf_counter()
+            client = create_speech_client(endpoint)
+            first_response_time(client, streaming_config)
+            cold.append(time.perf_counter() - started)
+            client.transport.close()
+
+        pool = SpeechClientPool(endpoint)
+        pool.warm()
+        time.sleep(args.warmup)
+        pooled = []
+        for _ in range(args.sessions):
+            started = time.perf_counter()
+            client = pool.acquire()
+            first_response_time(client, streaming_config)
+            pooled.append(time.perf_counter() - started)
+            pool.release(client)
+        pool.close()
+
+    print_latencies("click-to-first-response, new client", cold)
+    print_latencies("click-to-first-response, pooled client", pooled)
+
+
+def run_timed_stream(client, streaming_config, args, results):
+    source = SyntheticAudioSource(SAMPLE_RATE, CHUNK_SIZE, kind="noise",
+                                  duration=args.duration, speed=args.speed)
+    interim, final = [], []
+    with TimedMicrophoneStream(SAMPLE_RATE, CHUNK_SIZE, source) as stream:
+        requests = (
+            speech.StreamingRecognizeRequest(audio_content=content)
+            for content in stream.generator()
+        )
+        for response in client.streaming_recognize(streaming_config, requests):
+            received = time.perf_counter()
+            for result in response.results:
+                end_ms = result.result_end_time.total_seconds() * 1000
+                latency = received - stream.capture_time(end_ms)
+                (final if result.is_final else interim).append(latency)
+    results.append((interim, final))
+
+
+def bench_streaming(args):
+    """Run concurrent streams against the local fake Speech server."""
+    script = FakeSpeechServer.default_script(
+        delay_ms=args.interim_delay, final_delay_ms=args.final_delay)
+    streaming_config = speech.StreamingRecognitionConfig(
+        config=speech.RecognitionConfig(
+            encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
+            sample_rate_hertz=SAMPLE_RATE,
+            language_code="en-US",
+        ),
+        interim_results=True,
+    )
+
+    with FakeSpeechServer(script, max_workers=args.streams + 4) as server:
+        client = create_speech_client(server.endpoint)
+        results = []
+        threads = [
+            threading.Thread(target=run_timed_stream,
+                             args=(client, streaming_config, args, results))
+            for _ in range(args.streams)
+        ]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        client.transport.close()
+
+    interim = [latency for stream, _ in results for latency in stream]
+    final = [latency for _, stream in results for latency in stream]
+    audio_seconds = args.streams * args.duration
+    print(f"streams: {args.streams}, {audio_seconds:.0f} s of audio in {elapsed:.2f} s "
+          f"({audio_seconds / elapsed:.1f}x real time)")
+    print(f"responses: {len(interim) + len(final)} "
+          f"({(len(interim) + len(final)) / elapsed:.0f}/s)")
+    print_latencies("capture-to-interim", interim)
+    print_latencies("capture-to-final", final)
+
+
+class CountingUpdates:
+    """Stands in for the UI update queue of one session."""
+
+    def __init__(self):
+        self.finals = 0
+        self.interims = 0
+
+    def post_text(self, text):
+        pass
+
+    def post_final(self, text, start_ms, end_ms, restart):
+        self.finals += 1
+
+    def post_interim(self, text, stable=0):
+        self.interims += 1
+
+
+def bench_sessions(args):
+    """Run concurrent meeting sessions through the session manager."""
+    script = FakeSpeechServer.default_script()
+    with FakeSpeechServer(script, max_workers=2 * args.sessions + 4) as server:
+        if args.engine == "asyncio":
+            pool = None
+            manager = AsyncSessionManager(server.endpoint, max_sessions=args.sessions)
+        else:
+            pool = SpeechClientPool(server.endpoint)
+            manager = SessionManager(pool, max_sessions=args.sessions)
+        shared = SyntheticAudioSource(SAMPLE_RATE, CHUNK_SIZE, kind="noise",
+                                      duration=args.duration, speed=args.speed)
+        if args.shared:
+            shared = SharedAudioSource(shared)
+
+        updates = [CountingUpdates() for _ in range(args.sessions)]
+        started = time.perf_counter()
+        cpu_started = time.process_time()
+        for index in range(args.sessions):
+            if args.shared:
+                source = shared.handle()
+            else:
+                source = SyntheticAudioSource(SAMPLE_RATE, CHUNK_SIZE, kind="noise",
+                                              duration=args.duration, speed=args.speed,
+                                              seed=index)
+            manager.start_session(f"room {index}", updates[index], source=source,
+                                  vad=False)
+
+        backlog = 0
+        threads = 0
+        while manager.sessions:
+            backlog = max([backlog] + [s["backlog"] for s in manager.status()])
+            threads = max(threads, sum(
+                not thread.name.startswith("ThreadPoolExecutor")
+                for thread in threading.enumerate()))
+            time.sleep(0.05)
+        elapsed = time.perf_counter() - started
+        cpu = time.process_time() - cpu_started
+        if pool is None:
+            manager.close()
+        else:
+            pool.close()
+
+    audio_seconds = args.sessions * args.duration
+    print(f"sessions: {args.sessions}{' sharing one source' if args.shared else ''}, "
+          f"{audio_seconds:.0f} s of audio in {elapsed:.2f} s")
+    print(f"CPU: {cpu:.2f} s ({cpu / elapsed * 100:.0f}% of one core), "
+          f"{cpu / audio_seconds * 1000:.2f} ms per audio second")
+    print(f"finals: {sum(u.finals for u in updates)}, "
+          f"interims: {sum(u.interims for u in updates)}")
+    print(f"max capture backlog: {backlog} chunks ({backlog * CHUNK_MS:.0f} ms)")
+    print(f"peak threads: {threads} (not counting the fake server's workers)")
+
+
+class TimedJournal(TranscriptJournal):
+    """Records how long each record waited to become durable."""
+
+    def __init__(self, *args, **kwargs):
+        self.durable_after = []
+        super().__init__(*args, **kwargs)
+
+    def _commit(self, batch):
+        super()._commit(batch)
+        committed = time.perf_counter()
+        self.durable_after.extend(committed - record["appended"] for record in batch)
+
+
+def bench_journal(args):
+    """Append final results to the journal, then recover it after a torn write."""
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "journal.jsonl")
+        journal = TimedJournal(path, flush_interval=args.interval)
+        append_times = []
+        record = {"meeting": "bench", "session": 1, "restart": 0, "start_ms": 0,
+                  "end_ms": 0, "transcript": "the quick brown fox jumps over the lazy dog",
+                  "confidence": 0.9}
+        pause = 1 / args.rate if args.rate else 0
+        started = time.perf_counter()
+        for index in range(args.records):
+            before = time.perf_counter()
+            journal.append(dict(record, end_ms=index * 100, appended=before))
+            append_times.append(time.perf_counter() - before)
+            if pause:
+                time.sleep(pause)
+        journal.flush()
+        elapsed = time.perf_counter() - started
+        journal.close()
+
+        print(f"records: {args.records} in {elapsed:.2f} s "
+              f"({args.records / elapsed:.0f}/s), {journal.syncs} fsyncs, "
+              f"{os.path.getsize(path) / 1024:.0f} KiB")
+        print_latencies("append() on the recognizer thread", append_times)
+        print_latencies("durability window (append to fsync)", journal.durable_after)
+
+        intact = os.path.getsize(path)
+        with open(path, "ab") as f:
+            f.write(b'{"meeting": "bench", "transcr')
+        started = time.perf_counter()
+        recovered = TranscriptJournal.recover(path, repair=True)
+        elapsed = time.perf_counter() - started
+        print(f"recovered {len(recovered)} of {args.records} records after a torn "
+              f"write in {elapsed * 1000:.1f} ms")
+        check(len(recovered) == args.records, "records before the torn write were lost")
+        check(os.path.getsize(path) == intact, "repair did not cut the torn record off")
+
+        # A record appended after the repair follows the intact ones; a
+        # whole line that does not parse ends the journal as a torn one does.
+        with open(path, "ab") as f:
+            f.write(json.dumps(dict(record, end_ms=-1)).encode() + b"\n")
+            f.write(b'{"meeting": "bench"}}\n')
+        recovered = TranscriptJournal.recover(path)
+        check(len(recovered) == args.records + 1 and recovered[-1]["end_ms"] == -1,
+              "a record appended after the repair was not recovered")
+        transcripts = TranscriptJournal.rebuild(recovered)
+        store, sessions = transcripts.get("bench", (None, None))
+        check(store is not None and len(store) == args.records + 1 and sessions == [(1, None)],
+              "the recovered session was not rebuilt from every record")
+        check(TranscriptJournal.rebuild(recovered + [{"session": 1, "finished": 0}]) == {},
+              "a finished session was rebuilt")
+
+
+def bench_archive(args):
+    """Archive captured audio, then read random spans back by meeting time."""
+    source = SyntheticAudioSource(SAMPLE_RATE, CHUNK_SIZE, kind="noise", speed=0)
+    chunks = [source._read_chunk() for _ in range(50)]
+    total = int(args.minutes * 60 * SAMPLE_RATE / CHUNK_SIZE)
+
+    with tempfile.TemporaryDirectory() as directory:
+        archive = AudioArchive(directory, SAMPLE_RATE, segment_seconds=args.segment)
+        write_times = []
+        position = 0
+        started = time.perf_counter()
+        for index in range(total):
+            if index == total // 2:
+                position += SAMPLE_RATE  # a second the capture lost
+            before = time.perf_counter()
+            archive.write(position, chunks[index % len(chunks)])
+            write_times.append(time.perf_counter() - before)
+            position += CHUNK_SIZE
+        archive.close()
+        elapsed = time.perf_counter() - started
+
+        audio_seconds = total * CHUNK_SIZE / SAMPLE_RATE
+        print(f"archived {audio_seconds / 60:.0f} min in {elapsed:.2f} s "
+              f"({audio_seconds / elapsed:.0f}x real time), "
+              f"{len(os.listdir(directory)) - 2} segment files")
+        print_latencies("write() on the capture path", write_times)
+
+        archive = AudioArchive.open(directory)
+        read_times = []
+        end_ms = position * 1000 // SAMPLE_RATE
+        for _ in range(args.reads):
+            start_ms = random.randrange(0, end_ms - 10000)
+            before = time.perf_counter()
+            data = archive.read(start_ms, start_ms + 10000)
+            read_times.append(time.perf_counter() - before)
+        print_latencies("read() of a 10 s span", read_times)
+        archive.close()
+
+
+def bench_batch(args):
+    """Batch-transcribe recorded meetings with growing worker pools."""
+    script = FakeSpeechServer.default_script(delay_ms=0, final_delay_ms=args.final_delay)
+    with tempfile.TemporaryDirectory() as directory:
+        source = SyntheticAudioSource(SAMPLE_RATE, CHUNK_SIZE, kind="noise", speed=0)
+        minute = b"".join(source._read_chunk() for _ in range(60 * SAMPLE_RATE // CHUNK_SIZE))
+        for index in range(args.files):
+            with wave.open(os.path.join(directory, f"meeting-{index:03d}.wav"), "wb") as f:
+                f.setnchannels(1)
+                f.setsampwidth(2)
+                f.setframerate(SAMPLE_RATE)
+                for _ in range(int(args.minutes)):
+                    f.writeframes(minute)
+
+        with FakeSpeechServer(script, max_workers=args.cap + 4,
+                              max_streams=args.cap) as server:
+            client = create_speech_client(server.endpoint)
+            for workers in args.workers:
+                output = os.path.join(directory, f"output-{workers}")
+                transcriber = BatchTranscriber(client, output, workers=workers)
+                started = time.perf_counter()
+                transcriber.run(transcriber.find_files(directory))
+                elapsed = time.perf_counter() - started
+                print(f"workers: {workers:3d}  {transcriber.files_done / elapsed * 60:6.1f} files/min, "
+                      f"{transcriber.audio_seconds / elapsed:6.0f}x real time, "
+                      f"{transcriber.retried} retries over the cap of {args.cap}")
+            client.transport.close()
+
+
+class StalledClient:
+    """A Speech client whose network stops after a stream's first request.
+
+    The stream goes on once `resume` is set. It also stands in for the
+    client pool, handing out itself.
+    """
+
+    def __init__(self):
+        self.resume = threading.Event()
+
+    def acquire(self):
+        return self
+
+    def release(self, client):
+        pass
+
+    def streaming_recognize(self, config, requests):
+        next(requests)
+        self.resume.wait()
+        for request in requests:
+            pass
+        return iter(())
+
+
+def bench_overload(args):
+    """Stall the stream reader and compare the capture overload policies."""
+    # Each policy on a buffer of four 100-sample chunks, fed ten: speech
+    # chunks hold their number plus one, the odd ones are silent.
+    def chunk(number):
+        return np.full(100, number + 1 if number % 2 == 0 else 0, dtype="<i2").tobytes()
+
+    kept = {"drop_oldest": [6, 7, 8, 9], "drop_silence": [4, 6, 8, 9]}
+    for policy in CaptureBuffer.POLICIES:
+        buff = CaptureBuffer(SAMPLE_RATE, 800, policy, is_speech=any)
+        for number in range(10):
+            buff.put(chunk(number))
+        buff.put(None)
+        read = []
+        for data, position, arrived in iter(lambda: buff.get(block=False), None):
+            read.append(position // 100)
+            check(data == chunk(position // 100),
+                  f"{policy} read back chunk {position // 100} altered")
+        check(buff.max_bytes <= 800, f"{policy} queued {buff.max_bytes} bytes, over its 800")
+        check(buff.captured == 1000 and buff.dropped_samples == 1000 - 100 * len(read),
+              f"{policy} lost track of the capture clock")
+        if policy in kept:
+            check(read == kept[policy], f"{policy} kept chunks {read}")
+        else:
+            check(buff.downsampled_chunks and len(read) > 4 and read == sorted(read),
+                  f"{policy} kept chunks {read} after {buff.downsampled_chunks} downsampled")
+
+    noise = SyntheticAudioSource(SAMPLE_RATE, CHUNK_SIZE, kind="noise", speed=0)
+    with tempfile.TemporaryDirectory() as directory:
+        # A meeting that alternates a second of speech with a second of silence.
+        path = os.path.join(directory, "meeting.pcm")
+        with open(path, "wb") as f:
+            for second in range(int(args.duration)):
+                for _ in range(SAMPLE_RATE // CHUNK_SIZE):
+                    chunk = noise._read_chunk()
+                    f.write(chunk if second % 2 == 0 else bytes(len(chunk)))
+
+        capture_buffer = stt.CAPTURE_BUFFER
+        for policy in ("unbounded",) + CaptureBuffer.POLICIES:
+            if policy == "unbounded":
+                stt.CAPTURE_BUFFER = 10 ** 9
+            source = FileAudioSource(path, SAMPLE_RATE, CHUNK_SIZE, speed=args.speed)
+            stream = ResumableMicrophoneStream(
+                SAMPLE_RATE, CHUNK_SIZE, source=source,
+                policy="drop_oldest" if policy == "unbounded" else policy)
+            stt.CAPTURE_BUFFER = capture_buffer
+
+            tracemalloc.start()
+            with stream:
+                time.sleep(args.stall / args.speed)
+                resumed = time.perf_counter()
+                catch_up = None
+                largest = 0
+                while not stream.closed:
+                    for start, data in stream.read_runs():
+                        largest = max(largest, len(data))
+                    if catch_up is None and stream._buff.lag_ms <= 2 * CHUNK_MS:
+                        catch_up = time.perf_counter() - resumed
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            buff = stream._buff
+            print(f"{policy:>12}: queued up to {buff.max_bytes / 1024:7.0f} KiB "
+                  f"({buff.max_lag_ms / 1000:5.1f} s behind), traced peak "
+                  f"{peak / 1024 / 1024:5.1f} MiB, caught up in "
+                  f"{(catch_up or 0) * 1000:6.1f} ms, largest run {largest / 1024:6.0f} KiB, "
+                  f"dropped {buff.dropped_samples / SAMPLE_RATE:5.1f} s, "
+                  f"downsampled {buff.downsampled_chunks} chunks")
+            if policy != "unbounded":
+                check(buff.max_bytes <= buff.capacity,
+                      f"{policy} queued {buff.max_bytes} bytes, over its {buff.capacity}")
+                if args.stall * 1000 > stt.CAPTURE_BUFFER:
+                    check(buff.dropped_samples, f"{policy} dropped nothing in a long stall")
+
+    # Now the network stalls instead of the reader: the audio has to back up
+    # into the capture buffer rather than into the recognizer's queue.
+    client = StalledClient()
+    manager = SessionManager(client)
+    source = SyntheticAudioSource(SAMPLE_RATE, CHUNK_SIZE, kind="noise",
+                                  duration=args.duration, speed=args.speed)
+    manager.start_session("stalled network", CountingUpdates(), source=source, vad=False)
+    session = next(iter(manager.sessions.values()))
+    time.sleep(args.stall / args.speed)
+    buff = session.stream._buff
+    queued_ms = session._current.backlog_ms
+    print(f"{'network':>12}: recognizer queue {queued_ms / 1000:5.1f} s, capture buffer "
+          f"{buff.lag_ms / 1000:5.1f} s behind, dropped "
+          f"{buff.dropped_samples / SAMPLE_RATE:5.1f} s ({stt.CAPTURE_POLICY})")
+    check(queued_ms <= stt.CAPTURE_BUFFER + manager.fair_share * CHUNK_MS,
+          f"the recognizer queued {queued_ms:.0f} ms while the network stalled")
+    if args.stall * 1000 > 2 * stt.CAPTURE_BUFFER:
+        check(buff.dropped_samples, "the capture buffer dropped nothing while the network stalled")
+    session.stop()
+    client.resume.set()
+    while manager.sessions:
+        time.sleep(0.05)
+
+
+def bench_requests(args):
+    """Compare request packing: per-run joins against the coalescer."""
+    source = SyntheticAudioSource(SAMPLE_RATE, CHUNK_SIZE, kind="noise", speed=0)
+    chunks = [source._read_chunk() for _ in range(50)]
+    rng = random.Random(1)
+    runs = []
+    total = int(args.minutes * 600)
+    while total > 0:
+        # The reader drains whatever is queued, from one chunk to a backlog.
+        count = min(total, rng.choice((1, 1, 1, 2, 3, 10, 40)))
+        runs.append([chunks[(total - i) % len(chunks)] for i in range(count)])
+        total -= count
+    audio_seconds = args.minutes * 60
+
+    def pack(name, payloads):
+        count = largest = over = 0
+        started = time.process_time()
+        for data in payloads():
+            count += 1
+            largest = max(largest, len(data))
+            over += len(data) > REQUEST_MAX_BYTES
+        elapsed = time.process_time() - started
+        # Snapshots around a fixed window of audio whose payloads are kept,
+        # so every buffer packing allocated for them is still traced.
+        window = []
+        window_bytes = 0
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        for data in payloads():
+            window.append(data)
+            window_bytes += len(data)
+            if window_bytes >= ALLOCATION_WINDOW * SAMPLE_RATE * 2:
+                break
+        after = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        grown = [stat for stat in after.compare_to(before, "lineno") if stat.count_diff > 0]
+        blocks = sum(stat.count_diff for stat in grown)
+        size = sum(stat.size_diff for stat in grown)
+        window_seconds = window_bytes / 2 / SAMPLE_RATE
+        print(f"{name:>15}: {count / audio_seconds:5.1f} payloads/s of audio, largest "
+              f"{largest / 1024:4.0f} KiB, {blocks / window_seconds:5.1f} allocations/s "
+              f"({size / window_seconds / 1024:4.0f} KiB/s), "
+              f"{elapsed * 1000:5.0f} ms CPU, {over} over the API limit")
+        return over
+
+    def coalesced():
+        coalescer = RequestCoalescer(SAMPLE_RATE, adaptive=False)
+        for run in runs:
+            for data, end in coalescer.add(run, None):
+                yield data
+            if coalescer.due():
+                yield coalescer.cut()[0]
+
+    pack("per-run join", lambda: (b"".join(run) for run in runs))
+    check(pack("coalescer", coalesced) == 0, "no coalesced payload exceeds the API limit")
+
+    # Live sessions capture short chunks, so how they are packed decides how
+    # many requests the server pays its per-request cost for.
+    script = FakeSpeechServer.default_script(delay_ms=0, final_delay_ms=0)
+    chunk_size = SAMPLE_RATE * args.chunk_ms // 1000
+    modes = {
+        "drain": functools.partial(RequestCoalescer, min_ms=0, max_ms=0),
+        "fixed": functools.partial(RequestCoalescer, adaptive=False),
+        "adaptive": RequestCoalescer,
+    }
+    coalescers = []
+    rates = {}
+    with FakeSpeechServer(script, max_workers=2 * args.sessions + 4,
+                          request_cost_ms=args.request_cost,
+                          audio_cost=args.audio_cost) as server:
+        for mode, factory in modes.items():
+            def counted(rate):
+                coalescer = factory(rate)
+                coalescers.append(coalescer)
+                return coalescer
+
+            coalescers.clear()
+            stt.RequestCoalescer = counted
+            metrics = enable_metrics()
+            started = time.perf_counter()
+            run_sessions(server, args.sessions, args.duration, args.speed, chunk_size)
+            elapsed = time.perf_counter() - started
+            stt.RequestCoalescer = RequestCoalescer
+            stt.METRICS = None
+
+            requests = sum(coalescer.requests for coalescer in coalescers)
+            rates[mode] = requests / elapsed
+            interim = metrics.latencies["interim"]
+            targets = sorted(coalescer.target_ms for coalescer in coalescers)
+            print(f"{mode:>15}: {rates[mode]:6.1f} requests/s, interim "
+                  f"p50={interim.percentile(50) / 1000:.1f}ms "
+                  f"p99={interim.percentile(99) / 1000:.1f}ms, "
+                  f"median target {targets[len(targets) // 2]:.0f} ms")
+    check(rates["fixed"] < rates["drain"] and rates["adaptive"] <= rates["fixed"] * 1.05,
+          "coalescing sends fewer requests than draining each chunk")
+
+
+class ClockAudioSource(SyntheticAudioSource):
+    """Audio whose every sample holds its 10 ms block number, in uneven chunks."""
+
+    BLOCK = SAMPLE_RATE // 100
+
+    def __init__(self, duration, speed, seed=None):
+        super().__init__(SAMPLE_RATE, CHUNK_SIZE, kind="silence", duration=duration,
+                         speed=speed, seed=seed)
+        self._rng = random.Random(seed)
+        self._position = 0
+        self._total = int(duration * SAMPLE_RATE)
+
+    def _read_chunk(self):
+        size = min(self._rng.randint(CHUNK_SIZE // 2, CHUNK_SIZE * 3 // 2),
+                   self._total - self._position)
+        if size <= 0:
+            return b""
+        positions = np.arange(self._position, self._position + size)
+        self._position += size
+        return (positions // self.BLOCK).astype("<u2").tobytes()
+
+
+class ClockRecognizer:
+    """Stands in for a SpeechClient that sends a final every `every` ms of audio.
+
+    Each final ends with the last sample received and carries that sample's
+    value as its transcript, so the session's placement can be checked.
+    """
+
+    def __init__(self, every):
+        self.every = every * SAMPLE_RATE // 1000
+
+    def acquire(self):
+        return self
+
+    def release(self, client):
+        pass
+
+    def streaming_recognize(self, config, requests):
+        received = 0
+        due = self.every
+        for request in requests:
+            pcm = np.frombuffer(request.audio_content, dtype="<u2")
+            received += len(pcm)
+            if received < due or not len(pcm):
+                continue
+            due += self.every
+            yield speech.StreamingRecognizeResponse(results=[
+                speech.StreamingRecognitionResult(
+                    alternatives=[speech.SpeechRecognitionAlternative(
+                        transcript=str(int(pcm[-1])), confidence=1.0)],
+                    is_final=True,
+                    result_end_time=datetime.timedelta(seconds=received / SAMPLE_RATE),
+                )
+            ])
+
+
+class ClockCheck(CountingUpdates):
+    """Checks each final's end against the block number it names."""
+
+    def __init__(self):
+        super().__init__()
+        self.errors = collections.defaultdict(list)
+
+    def post_final(self, text, start_ms, end_ms, restart):
+        super().post_final(text, start_ms, end_ms, restart)
+        # Block numbers wrap at 2**16, every 655 s; take the nearest.
+        block = int(text)
+        block += round((end_ms / 10 - block) / 65536) * 65536
+        # The final's last sample lies in that block, so its end is within it.
+        error = end_ms - min(max(end_ms, block * 10), block * 10 + 10)
+        self.errors[int(end_ms // 3600000)].append(error)
+
+
+def bench_timeline(args):
+    """Place finals over hours of audio and check they never drift."""
+    # A stream that replays 100 ms from capture sample 1000, sends 50 ms
+    # more straight on, then resumes at 10000 after the VAD held silence back.
+    time_map = StreamTimeMap(SAMPLE_RATE)
+    check(time_map.to_capture(500) == 0, "an empty time map placed a result")
+    time_map.add(1000, 1600)
+    time_map.add(2600, 800)
+    time_map.add(10000, 1600)
+    check(len(time_map._sent_at) == 2, "contiguous runs were not recorded as one")
+    for sent_ms, expected in ((0, 1000), (100, 2600), (150, 3400), (160, 10160),
+                              (250, 11600)):
+        check(time_map.to_capture(sent_ms) == expected,
+              f"{sent_ms} ms into the stream mapped to {time_map.to_capture(sent_ms)}, "
+              f"not capture sample {expected}")
+    check(time_map.to_capture_ms(150) == 3400 * 1000 // SAMPLE_RATE,
+          "to_capture_ms disagrees with to_capture")
+
+    limit, overlap = stt.STREAMING_LIMIT, stt.STREAM_OVERLAP
+    stt.STREAMING_LIMIT, stt.STREAM_OVERLAP = args.limit * 1000, args.overlap * 1000
+    manager = SessionManager(ClockRecognizer(args.every), max_sessions=args.sessions)
+    checks = []
+    started = time.perf_counter()
+    for index in range(args.sessions):
+        checks.append(ClockCheck())
+        source = ClockAudioSource(args.hours * 3600, args.speed, seed=index)
+        manager.start_session(f"room {index}", checks[-1], source=source, vad=False)
+    while manager.sessions:
+        time.sleep(0.1)
+    elapsed = time.perf_counter() - started
+    stt.STREAMING_LIMIT, stt.STREAM_OVERLAP = limit, overlap
+
+    print(f"{args.sessions * args.hours:.1f} h of audio in {elapsed:.0f} s, a stream "
+          f"restart every {args.limit} s")
+    for hour in sorted({hour for clock in checks for hour in clock.errors}):
+        errors = [error for clock in checks for error in clock.errors[hour]]
+        print(f"hour {hour + 1:3d}: {len(errors):5d} finals, error "
+              f"min {min(errors):+d} ms, max {max(errors):+d} ms")
+        check(not any(errors), f"finals drifted off the capture clock in hour {hour + 1}")
+    check(all(clock.errors for clock in checks), "a session placed no finals")
+
+
+def bench_keywords(args):
+    """Time keyword matching per response with a large phrase list."""
+    rng = random.Random(1)
+    vocabulary = ["".join(rng.choice("abcdefghijklmnopqrstuvwxyz")
+                          for _ in range(rng.randint(2, 9))) for _ in range(args.vocabulary)]
+    phrases = {}
+    while len(phrases) < args.keywords:
+        phrases[" ".join(rng.sample(vocabulary, rng.randint(1, 3)))] = "alert"
+
+    # Utterances grow a word or two per interim result; now and then the
+    # recognizer revises the last word.
+    responses = []
+    for _ in range(args.utterances):
+        words = []
+        for _ in range(rng.randint(10, 40)):
+            words.append(rng.choice(vocabulary))
+            if rng.random() < 0.2:
+                words[-1] = rng.choice(vocabulary)
+            if rng.random() < 0.7:
+                responses.append((" ".join(words), False))
+        responses.append((" ".join(words).capitalize() + ".", True))
+
+    class Session:
+        name = "bench"
+
+    spotter = KeywordSpotter(phrases)
+    pattern = re.compile(r"\b(?:" + "|".join(
+        re.escape(phrase) for phrase in sorted(phrases, key=len, reverse=True)) + r")\b", re.I)
+
+    def incremental():
+        scanner = spotter.scanner(Session())
+        return lambda text, is_final: len(scanner.feed(text, is_final))
+
+    def rescan():
+        def feed(text, is_final):
+            return len(spotter.scanner(Session()).feed(text, is_final))
+        return feed
+
+    def regex():
+        return lambda text, is_final: len(pattern.findall(text))
+
+    # Edge cases on a small list: a phrase growing over interims, a revision,
+    # whole words only, and a phrase the recognizer split over two finals.
+    small = KeywordSpotter({"red alert": "alarm", "stop": "halt"})
+    scanner = small.scanner(Session())
+    expected = [
+        ("we are on red", False, []),
+        ("we are on red alert", False, ["red alert"]),
+        ("we are on red alerts", False, []),
+        ("we are on red alert", False, []),
+        ("We are on Red Alert. Stopping", True, ["red alert"]),
+        ("we are on red", True, []),
+        ("alert now stop", False, ["red alert", "stop"]),
+    ]
+    for text, is_final, phrases in expected:
+        found = scanner.feed(text, is_final)
+        check([match.phrase for match in found] == phrases,
+              f"{text!r} matched {[match.phrase for match in found]}, not {phrases}")
+    check(found[0].start == 0 and found[0].end == len("alert"),
+          "a phrase split over two results was not placed at the start of the second")
+
+    print(f"{args.keywords} keywords, {len(responses)} responses, "
+          f"{sum(len(text.split()) for text, _ in responses) / len(responses):.0f} words each")
+    for name, make in (("incremental", incremental), ("full rescan", rescan),
+                       ("regex", regex)):
+        feed = make()
+        times = []
+        matches = 0
+        for text, is_final in responses:
+            before = time.perf_counter()
+            matches += feed(text, is_final)
+            times.append(time.perf_counter() - before)
+        times.sort()
+        print(f"{name:>12}: " + " ".join(
+            f"p{pct}={percentile(times, pct) * 1e6:.1f}us" for pct in (50, 90, 99))
+            + f", {len(times) / sum(times):.0f} responses/s, {matches} matches reported")
+
+
+class RecordingText:
+    """Stands in for a Tk Text widget: keeps its text and counts the calls made.
+
+    Only the index forms the transcript views use are understood.
+    """
+
+    def __init__(self, widget=None):
+        self.widget = widget
+        self.content = ""
+        self.calls = collections.Counter()
+        self.chars = 0  # characters inserted or deleted
+
+    def _offset(self, index):
+        if index == "end":
+            return len(self.content)
+        if index == "end-1c":
+            return len(self.content)
+        if index.startswith("1.0+"):
+            return int(index[4:-1])
+        assert index == "1.0", index
+        return 0
+
+    def _forward(self, name, *args):
+        self.calls[name] += 1
+        if self.widget is not None:
+            getattr(self.widget, name)(*args)
+
+    def tag_configure(self, *args, **kwargs):
+        if self.widget is not None:
+            self.widget.tag_configure(*args, **kwargs)
+
+    def insert(self, index, *chars_and_tags):
+        self._forward("insert", index, *chars_and_tags)
+        offset = self._offset(index)
+        text = "".join(chars_and_tags[0::2])
+        self.content = self.content[:offset] + text + self.content[offset:]
+        self.chars += len(text)
+
+    def delete(self, first, last):
+        self._forward("delete", first, last)
+        first, last = self._offset(first), self._offset(last)
+        self.chars += last - first
+        self.content = self.content[:first] + self.content[last:]
+
+    def replace(self, first, last, *chars_and_tags):
+        self._forward("replace", first, last, *chars_and_tags)
+        first, last = self._offset(first), self._offset(last)
+        text = "".join(chars_and_tags[0::2])
+        self.chars += last - first + len(text)
+        self.content = self.content[:first] + text + self.content[last:]
+
+
+def fast_talker(rng, seconds, words_per_second, interims_per_second):
+    """Interim hypotheses of a fast talker as (hypothesis, stable) pairs."""
+    vocabulary = "the a to of and we this that next quarter budget plan team " \
+                 "revenue growth customer product launch review meeting action".split()
+    words = []
+    responses = []
+    for step in range(int(seconds * interims_per_second)):
+        for _ in range(rng.randint(0, round(2 * words_per_second / interims_per_second))):
+            words.append(rng.choice(vocabulary))
+        if words and rng.random() < 0.3:
+            words[-1] = rng.choice(vocabulary)  # the recognizer changed its mind
+        if len(words) > 2 and rng.random() < 0.1:
+            words[-2] = rng.choice(vocabulary)
+        if len(words) > 60:
+            words = words[-10:]  # a final result ended the utterance
+        hypothesis = " ".join(words)
+        responses.append((hypothesis, len(" ".join(words[:-3]))))
+    return responses
+
+
+def bench_interim(args):
+    """Count Tk operations for the live interim result of a fast talker."""
+    responses = fast_talker(random.Random(1), args.duration, args.words, args.rate)
+    root = None
+    try:
+        import tkinter
+        root = tkinter.Tk()
+        root.withdraw()
+    except Exception as e:
+        print(f"no Tk display ({e}); counting operations only")
+
+    def redraw(text):
+        def show(hypothesis, stable):
+            text.delete("1.0", "end")
+            text.insert("end", hypothesis)
+        return show
+
+    def incremental(text):
+        return InterimView(text).show
+
+    print(f"{len(responses)} interim results over {args.duration:.0f} s, "
+          f"{args.words:.1f} words/s")
+    # A recognizer that never reports stability leaves the boundary at 0.
+    unrated = [(hypothesis, 0) for hypothesis, stable in responses]
+    rewritten = {}
+    for name, make, results in (("full redraw", redraw, responses),
+                                ("incremental", incremental, responses),
+                                ("stability 0", incremental, unrated)):
+        widget = tkinter.Text(root) if root is not None else None
+        text = RecordingText(widget)
+        show = make(text)
+        started = time.perf_counter()
+        for hypothesis, stable in results:
+            show(hypothesis, stable)
+            assert text.content == hypothesis
+            if widget is not None:
+                widget.update_idletasks()
+        elapsed = time.perf_counter() - started
+        operations = sum(text.calls.values())
+        rewritten[name] = text.chars
+        print(f"{name:>12}: {operations / args.duration:6.1f} Tk operations/s, "
+              f"{text.chars / args.duration:7.0f} characters rewritten/s"
+              + (f", {elapsed / len(responses) * 1e6:.0f} us per update in Tk"
+                 if widget is not None else ""))
+    # With nothing to retag, only the changed tails are rewritten.
+    check(rewritten["stability 0"] <= rewritten["incremental"],
+          "stability 0 rewrote more than the updates with a stable prefix")
+    if root is not None:
+        root.destroy()
+
+
+def run_sessions(server, sessions, duration, speed, chunk_size=CHUNK_SIZE):
+    """Run sessions of synthetic audio to completion; return the CPU seconds used."""
+    pool = SpeechClientPool(server.endpoint)
+    manager = SessionManager(pool, max_sessions=sessions)
+    cpu_started = time.process_time()
+    for index in range(sessions):
+        source = SyntheticAudioSource(SAMPLE_RATE, chunk_size, kind="noise",
+                                      duration=duration, speed=speed, seed=index)
+        manager.start_session(f"room {index}", CountingUpdates(), source=source, vad=False)
+    while manager.sessions:
+        time.sleep(0.05)
+    cpu = time.process_time() - cpu_started
+    pool.close()
+    return cpu
+
+
+def _process_cpu(pid):
+    """User plus system CPU seconds used so far by process `pid`."""
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+async def _stream_client(url, audio, frame_ms, results):
+    """Send `audio` paced in real time and collect the finals' latencies."""
+    from websockets.asyncio.client import connect
+    from websockets.exceptions import ConnectionClosedError, InvalidStatus
+
+    frame = SAMPLE_RATE * frame_ms // 1000 * 2
+    try:
+        async with connect(url, max_queue=None) as websocket:
+            started = time.perf_counter()
+
+            async def receive():
+                async for message in websocket:
+                    event = json.loads(message)
+                    if event["type"] == "final":
+                        results["latencies"].append(
+                            time.perf_counter() - started - event["end_ms"] / 1000)
+
+            receiver = asyncio.create_task(receive())
+            for index, offset in enumerate(range(0, len(audio), frame)):
+                await websocket.send(audio[offset:offset + frame])
+                await asyncio.sleep(max(0.0, started + (index + 1) * frame_ms / 1000
+                                        - time.perf_counter()))
+            await websocket.send("end")
+            await receiver
+    except (InvalidStatus, ConnectionClosedError):
+        results["rejected"] += 1
+
+
+def bench_server(args):
+    """Load the headless server with real-time client streams."""
+    with socket.socket() as probe:
+        probe.bind(("localhost", 0))
+        port = probe.getsockname()[1]
+    rng = np.random.default_rng(1)
+    audio = rng.normal(0, 3000, int(args.duration * SAMPLE_RATE)).astype("<i2").tobytes()
+
+    script = FakeSpeechServer.default_script()
+    with FakeSpeechServer(script, max_workers=2 * max(args.streams) + 8) as speech_server:
+        # The server gets a core to itself; the clients and the stand-in
+        # recognizer run here, on the others.
+        server = subprocess.Popen(
+            [sys.executable, "cli.py", "serve", "--port", str(port), "--no-journal",
+             "--endpoint", speech_server.endpoint,
+             "--max-streams", str(args.max_streams)],
+            stdout=subprocess.DEVNULL,
+            preexec_fn=lambda: os.sched_setaffinity(0, {args.core}))
+        try:
+            deadline = time.monotonic() + 30
+            while True:
+                try:
+                    urllib.request.urlopen(f"http://localhost:{port}/status").read()
+                    break
+                except OSError:
+                    if time.monotonic() > deadline or server.poll() is not None:
+                        raise RuntimeError("the server did not start")
+                    time.sleep(0.1)
+
+            capacity = []
+            for count in args.streams:
+                results = {"latencies": [], "rejected": 0}
+                url = f"ws://localhost:{port}/stream?vad=0"
+                cpu_started = _process_cpu(server.pid)
+                started = time.perf_counter()
+
+                async def run_clients():
+                    await asyncio.gather(*(
+                        _stream_client(url + f"&name=client{index}", audio,
+                                       args.frame, results)
+                        for index in range(count)))
+
+                asyncio.run(run_clients())
+                elapsed = time.perf_counter() - started
+                cpu = _process_cpu(server.pid) - cpu_started
+                served = count - results["rejected"]
+                latencies = sorted(results["latencies"])
+                print(f"{count:4} streams: server CPU {cpu / elapsed * 100:5.1f}% of its core, "
+                      f"final latency p50 {percentile(latencies, 50) * 1000:6.0f} ms "
+                      f"p99 {percentile(latencies, 99) * 1000:6.0f} ms, "
+                      f"{results['rejected']} rejected")
+                if served and cpu:
+                    capacity.append((served, served * elapsed / cpu))
+        finally:
+            server.terminate()
+            server.wait()
+
+    if capacity:
+        # The busiest run spreads the server's fixed cost over the most streams.
+        served, streams_per_core = max(capacity)
+        print(f"about {streams_per_core:.0f} real-time streams per core, "
+              f"from the CPU of {served} streams served at once")
+
+
+def bench_resample(args):
+    """Convert native device formats to 16 kHz mono, in real-time factors."""
+    for spec in args.formats:
+        rate, channels = (int(part) for part in spec.split("x"))
+        frames = rate * args.chunk // 1000
+        count = int(args.duration * 1000 / args.chunk)
+        rng = np.random.default_rng(1)
+        chunks = [rng.normal(0, 3000, frames * channels).astype("<i2").tobytes()
+                  for _ in range(50)]
+
+        resampler = Resampler(rate, SAMPLE_RATE, channels)
+        times = []
+        started = time.process_time()
+        for index in range(count):
+            chunk_started = time.perf_counter()
+            resampler.process(chunks[index % len(chunks)])
+            times.append(time.perf_counter() - chunk_started)
+        cpu = time.process_time() - started
+
+        # Chunk boundaries must not show: streaming equals one pass.
+        pcm = b"".join(chunks)
+        streamed = Resampler(rate, SAMPLE_RATE, channels)
+        seamless = b"".join(streamed.process(chunk) for chunk in chunks) == \
+            Resampler(rate, SAMPLE_RATE, channels).process(pcm)
+        check(seamless, f"{spec}: chunk boundaries changed the output")
+        # So must chunks of a few frames, and empty ones.
+        frame = 2 * channels
+        sizes = itertools.cycle((0, 1, 2, 3, 5, 7, 11))
+        offsets = [0]
+        while offsets[-1] < rate // 5:
+            offsets.append(offsets[-1] + next(sizes))
+        tiny = Resampler(rate, SAMPLE_RATE, channels)
+        check(b"".join(tiny.process(pcm[a * frame:b * frame])
+                       for a, b in zip(offsets, offsets[1:])) ==
+              Resampler(rate, SAMPLE_RATE, channels).process(pcm[:offsets[-1] * frame]),
+              f"{spec}: chunks of a few frames changed the output")
+
+        # Quality on tones: a 1 kHz one should pass unchanged and one above
+        # 8 kHz should not fold back into the speech band.
+        t = np.arange(rate * 2) / rate
+        passed = _resampled_tone(rate, channels, 1000, t)
+        reference = 8000 * np.sin(2 * np.pi * 1000 * np.arange(len(passed)) / SAMPLE_RATE)
+        error = (passed - reference)[200:-200]
+        snr = 10 * np.log10(np.mean(reference ** 2) / max(np.mean(error ** 2), 1e-12))
+        # Only the filter's last few samples may be held back.
+        missing = len(t) * SAMPLE_RATE // rate - len(passed)
+        check(0 <= missing <= RESAMPLE_ZERO_CROSSINGS * max(1, SAMPLE_RATE // rate) + 1,
+              f"{spec}: {len(t) / rate:.0f} s came out {missing} samples short")
+        check(snr > 60, f"{spec}: a 1 kHz tone came through at {snr:.1f} dB SNR")
+        line = (f"{rate:>6} Hz x{channels}: RTF {args.duration / cpu:7.0f}x, "
+                f"chunk p99 {percentile(sorted(times), 99) * 1e6:5.0f} us, "
+                f"seamless {seamless}, 1 kHz SNR {snr:5.1f} dB")
+        if rate > SAMPLE_RATE:
+            high = min(0.45 * rate, 9500)
+            folded = _resampled_tone(rate, channels, high, t)[200:-200]
+            level = 20 * np.log10(np.std(folded) / 5657 + 1e-9)
+            line += f", {high / 1000:.1f} kHz at {level:5.1f} dB"
+            check(level < -60, f"{spec}: a {high:.0f} Hz tone folded back at {level:.1f} dB")
+        print(line)
+
+
+def _resampled_tone(rate, channels, frequency, t):
+    tone = 8000 * np.sin(2 * np.pi * frequency * t)
+    pcm = np.repeat(tone[:, None], channels, axis=1).astype("<i2").tobytes()
+    return np.frombuffer(Resampler(rate, SAMPLE_RATE, channels).process(pcm), "<i2").astype(float)
+
+
+_STARTUP_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+import stt_app.main as stt
+if sys.argv[1] == "eager":
+    # What start-up did before: everything loaded ahead of the window.
+    stt.preload()
+    stt.list_input_devices()
+result = {}
+try:
+    root = stt.Tk()
+except stt.TclError:
+    # No display: stop the clock where the window would be created.
+    result["window"] = time.perf_counter() - started
+    stt.preload()
+    stt.list_input_devices()
+    result["ready"] = time.perf_counter() - started
+    result["display"] = 0
+else:
+    gui = stt.GUI(root)
+    root.update()
+    result["window"] = time.perf_counter() - started
+    if sys.argv[1] == "lazy":
+        gui.load_backends()
+    else:
+        gui.ready.set()
+    while not gui.ready.is_set():
+        root.update()
+        time.sleep(0.005)
+    result["ready"] = time.perf_counter() - started
+    result["display"] = 1
+    root.destroy()
+print(json.dumps(result))
+"""
+
+
+def bench_startup(args):
+    """Profile the module's imports and time start-up to the window and to ready."""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [os.path.dirname(os.path.abspath(__file__))] + env.get("PYTHONPATH", "").split(os.pathsep))
+
+    # -X importtime lines are "self | cumulative | name", the name indented
+    # two spaces per level of nesting and printed after its own imports.
+    with tempfile.TemporaryDirectory() as directory:
+        profile = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c",
+             "import stt_app.main as stt; stt.preload()"],
+            cwd=directory, env=env, capture_output=True, text=True, check=True).stderr
+    direct, preloaded, total = [], [], 0
+    for line in profile.splitlines():
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        cumulative, name = int(fields[1]) / 1000, fields[2][1:]
+        depth = (len(name) - len(name.lstrip())) // 2
+        if total:
+            if depth == 0:
+                preloaded.append((cumulative, name.strip()))
+        elif name == "stt_app.main":
+            total = cumulative
+        elif depth == 0:
+            direct = []  # those were another top-level import's
+        elif depth == 1:
+            direct.append((cumulative, name.strip()))
+
+    print(f"import stt_app.main: {total:.0f} ms, heaviest of its imports:")
+    for cumulative, name in sorted(direct, reverse=True)[:args.top]:
+        print(f"  {cumulative:7.1f} ms  {name}")
+    print(f"preload(): {sum(c for c, _ in preloaded):.0f} ms, heaviest of its imports:")
+    for cumulative, name in sorted(preloaded, reverse=True)[:args.top]:
+        print(f"  {cumulative:7.1f} ms  {name}")
+
+    for mode in ("eager", "lazy"):
+        runs = collections.defaultdict(list)
+        for _ in range(args.runs):
+            with tempfile.TemporaryDirectory() as directory:
+                output = subprocess.run(
+                    [sys.executable, "-c", _STARTUP_SCRIPT, mode], cwd=directory,
+                    env=env, capture_output=True, text=True, check=True).stdout
+            for stage, seconds in json.loads(output.splitlines()[-1]).items():
+                runs[stage].append(seconds)
+        print(f"{mode:>5}: time to window p50 {percentile(sorted(runs['window']), 50) * 1000:4.0f} ms, "
+              f"to ready p50 {percentile(sorted(runs['ready']), 50) * 1000:4.0f} ms")
+    if not all(runs["display"]):
+        print("no display: the window was not created; time to window stops where it would be")
+
+
+class TriggerRecorder:
+    """Stands in for the session manager and timestamps every trigger."""
+
+    def __init__(self):
+        self.received = {}
+
+    def trigger(self, trigger, note=""):
+        self.received[int(note)] = time.perf_counter()
+
+
+class PollingSerialThread(threading.Thread):
+    """The reader SerialThread replaced: poll in_waiting every 200 ms."""
+
+    def __init__(self, ser_handle, sessions):
+        super().__init__(daemon=True)
+        self.ser_handle = ser_handle
+        self.sessions = sessions
+        self.event = threading.Event()
+        self.reads = 0
+
+    def stop(self):
+        self.event.set()
+
+    def run(self):
+        while not self.event.is_set():
+            self.reads += 1
+            if self.ser_handle.in_waiting:
+                for line in self.ser_handle.readline(self.ser_handle.in_waiting).splitlines():
+                    command, _, note = line.decode().partition(" ")
+                    self.sessions.trigger(command.lower(), note)
+            time.sleep(0.2)
+
+
+def bench_serial(args):
+    """Time button triggers from a pty stand-in for the serial device."""
+    import serial
+
+    for reader_class in (PollingSerialThread, SerialThread):
+        master, slave = os.openpty()
+        handle = serial.Serial(os.ttyname(slave), 9600)
+        recorder = TriggerRecorder()
+        reader = reader_class(handle, recorder)
+        reader.start()
+
+        # Idle first: how often does the reader wake with nothing to do?
+        time.sleep(args.idle)
+        idle_reads = reader.reads
+
+        rng = random.Random(1)
+        sent = {}
+        for index in range(args.triggers):
+            time.sleep(rng.uniform(0.05, 0.15))
+            line = f"MARK {index}\n".encode()
+            sent[index] = time.perf_counter()
+            if args.split and index % 2:
+                # Button boards flush lines in pieces now and then.
+                os.write(master, line[:3])
+                time.sleep(0.002)
+                os.write(master, line[3:])
+            else:
+                os.write(master, line)
+        time.sleep(0.5)
+
+        reader.stop()
+        reader.join(timeout=1)
+        handle.close()
+        os.close(master)
+        os.close(slave)
+
+        latencies = sorted(recorder.received[index] - sent[index]
+                           for index in sent if index in recorder.received)
+        print(f"{reader_class.__name__:>19}: {idle_reads / args.idle:4.1f} wakeups/s idle, "
+              f"{len(latencies)}/{args.triggers} triggers, latency p50 "
+              f"{percentile(latencies, 50) * 1000:6.2f} ms p99 "
+              f"{percentile(latencies, 99) * 1000:6.2f} ms")
+
+
+def _synthetic_streams(rng, args):
+    """A meeting's words and the overlapping recognizer streams that heard them.
+
+    Returns (words, streams): words as (word, start_ms, end_ms), and for each
+    stream its finals as (start_ms, end_ms, transcript, word_starts), with
+    the word time offsets a recognizer reports. Each stream starts
+    `overlap` ms before the previous one ends. At a seam a stream may cut a
+    word short or miss it, and in its first `overlap` ms, before it has any
+    context, it may mishear a word.
+    """
+    vocabulary = [f"w{index}" for index in range(args.vocabulary)]
+    words = []
+    now = 0
+    while now < args.minutes * 60000:
+        length = rng.randint(150, 600)
+        words.append((rng.choice(vocabulary), now, now + length))
+        now += length + rng.choice((20, 40, 80, 300, 900))
+
+    streams = []
+    start = 0
+    while start < now:
+        end = start + args.stream
+        heard = []
+        for word, word_start, word_end in words:
+            if word_end <= start or word_start >= end:
+                continue
+            if word_start < start or word_end > end:
+                # Cut by the seam: lost, or only its first letters heard.
+                if rng.random() < 0.5:
+                    continue
+                word = word[:rng.randint(1, len(word))]
+            elif word_start < start + args.overlap:
+                if rng.random() < args.errors:
+                    word = rng.choice(vocabulary)
+            # A stream reports no time outside the audio it was sent.
+            heard.append((word, max(start, word_start), min(end, word_end)))
+
+        finals = []
+        while heard:
+            count = rng.randint(3, 12)
+            utterance, heard = heard[:count], heard[count:]
+            final_end = min(end, utterance[-1][2] + rng.randint(-50, 50))
+            word_starts = [word_start for _, word_start, _ in utterance]
+            finals.append((word_starts[0], final_end,
+                           " " + " ".join(word for word, _, _ in utterance), word_starts))
+        streams.append(finals)
+        start = end - args.overlap
+    return words, streams
+
+
+def bench_stitch(args):
+    """Stitch synthetic overlapping streams; count repeated and lost words."""
+    # Alignment edge cases: nothing in common, an empty tail, a clean overlap.
+    for tail, words, expected in ((["a", "b"], ["c", "d"], (0, 0)),
+                                  ([], ["a"], (0, 0)),
+                                  (["x", "a", "b"], ["a", "b", "c"], (2, 4))):
+        check(stt._align_overlap(tail, words) == expected,
+              f"aligning {tail} with {words} gave {stt._align_overlap(tail, words)}")
+    segments = []
+    merger = FinalMerger(lambda index, *segment: segments.append(segment[2]))
+    merger.add(0, 0, 2000, " one two three four")
+    merger.finish(0)
+    # In a newer stream, a final repeating the end of the transcript is
+    # dropped; one starting before the seam, but with no words in common
+    # and none begun before it, is kept whole.
+    merger.add(1, 1000, 1900, " three four", word_starts=[1000, 1500])
+    merger.add(1, 1900, 2600, " five six", word_starts=[2100, 2300])
+    check(segments == [" one two three four", " five six"],
+          f"stitching edge cases gave {segments}")
+
+    rng = random.Random(1)
+    words, streams = _synthetic_streams(rng, args)
+    truth = [word for word, _, _ in words]
+
+    def appended():
+        # What the GUI did first: every final as it comes.
+        for index, finals in enumerate(streams):
+            for start_ms, end_ms, transcript, _ in finals:
+                yield start_ms, end_ms, transcript
+
+    def by_end_time():
+        # Whole finals ending before the transcript does are dropped.
+        last_end = 0
+        for index, finals in enumerate(streams):
+            for start_ms, end_ms, transcript, _ in finals:
+                if end_ms > last_end:
+                    yield last_end, end_ms, transcript
+                    last_end = end_ms
+
+    def stitched():
+        segments = []
+        merger = FinalMerger(lambda index, *segment: segments.append(segment[:3]))
+        for index, finals in enumerate(streams):
+            for start_ms, end_ms, transcript, word_starts in finals:
+                merger.add(index, start_ms, end_ms, transcript, word_starts=word_starts)
+                yield from segments
+                segments.clear()
+            merger.finish(index)
+
+    lost_words = {}
+    for name, segments in (("appended", appended), ("by end time", by_end_time),
+                           ("stitched", stitched)):
+        started = time.process_time()
+        output = list(segments())
+        cpu = time.process_time() - started
+        backwards = sum(end < start for start, end, _ in output) + sum(
+            b[0] < a[1] for a, b in zip(output, output[1:]))
+        said = " ".join(transcript for _, _, transcript in output).split()
+        extra = lost = 0
+        for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(
+                None, truth, said, autojunk=False).get_opcodes():
+            if tag in ("replace", "delete"):
+                lost += i2 - i1
+            if tag in ("replace", "insert"):
+                extra += j2 - j1
+        lost_words[name] = lost
+        print(f"{name:>12}: {extra:5} extra words, {lost:5} lost words, "
+              f"{backwards:4} times out of order, "
+              f"{cpu / len(streams) * 1e6:7.1f} us CPU per stream")
+    print(f"{len(truth)} words over {len(streams)} streams, {len(streams) - 1} seams")
+    check(lost_words["stitched"] <= lost_words["appended"],
+          "stitching loses no more words than appending every final")
+
+
+def bench_metrics(args):
+    """Trace chunk latencies through live sessions and show what is exported."""
+    with FakeSpeechServer(max_workers=2 * args.sessions + 4) as server:
+        cpu_off = run_sessions(server, args.sessions, args.duration, args.speed)
+        metrics = enable_metrics()
+        cpu_on = run_sessions(server, args.sessions, args.duration, args.speed)
+        stt.METRICS = None
+
+    print(metrics.render())
+    audio_seconds = args.sessions * args.duration
+    print(f"CPU per audio second: {cpu_off / audio_seconds * 1000:.2f} ms with metrics off, "
+          f"{cpu_on / audio_seconds * 1000:.2f} ms with metrics on")
+
+
+def fake_server(args):
+    """Serve the fake Speech API until interrupted, for STT_SPEECH_ENDPOINT or --endpoint."""
+    with FakeSpeechServer(port=args.port, max_streams=args.max_streams) as server:
+        print(f"Fake Speech API on {server.endpoint}; Ctrl+C to stop")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Speech-To-Text pipeline benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    ringbuffer = commands.add_parser("ringbuffer", help=bench_ringbuffer.__doc__)
+    ringbuffer.add_argument("--restarts", type=int, default=500)
+    ringbuffer.set_defaults(func=bench_ringbuffer)
+
+    source = commands.add_parser("source", help=bench_source.__doc__)
+    source.add_argument("--file", help="WAV or raw PCM file, 16 kHz mono")
+    source.add_argument("--kind", choices=SyntheticAudioSource.KINDS, default="tone")
+    source.add_argument("--duration", type=float, default=60.0)
+    source.add_argument("--speed", type=float, default=50.0,
+                        help="multiple of real time, 0 for unpaced")
+    source.add_argument("--vad", action="store_true", help="gate silence")
+    source.set_defaults(func=bench_source)
+
+    encoding = commands.add_parser("encoding", help=bench_encoding.__doc__)
+    encoding.add_argument("--only", dest="encodings", action="append",
+                          choices=list(AUDIO_ENCODERS))
+    encoding.add_argument("--kind", choices=SyntheticAudioSource.KINDS, default="noise")
+    encoding.add_argument("--duration", type=float, default=60.0)
+    encoding.set_defaults(func=bench_encoding)
+
+    client = commands.add_parser("client", help=bench_client.__doc__)
+    client.add_argument("--sessions", type=int, default=20)
+    client.add_argument("--warmup", type=float, default=1.0,
+                        help="seconds the pool gets to connect")
+    client.add_argument("--endpoint", help="host:port of another plaintext stand-in")
+    client.set_defaults(func=bench_client)
+
+    streaming = commands.add_parser("streaming", help=bench_streaming.__doc__)
+    streaming.add_argument("--streams", type=int, default=1)
+    streaming.add_argument("--duration", type=float, default=30.0,
+                           help="seconds of audio per stream")
+    streaming.add_argument("--speed", type=float, default=1.0,
+                           help="multiple of real time")
+    streaming.add_argument("--interim-delay", type=int, default=100, help="ms")
+    streaming.add_argument("--final-delay", type=int, default=250, help="ms")
+    streaming.set_defaults(func=bench_streaming)
+
+    sessions = commands.add_parser("sessions", help=bench_sessions.__doc__)
+    sessions.add_argument("--sessions", type=int, default=8)
+    sessions.add_argument("--duration", type=float, default=30.0,
+                          help="seconds of audio per session")
+    sessions.add_argument("--speed", type=float, default=1.0,
+                          help="multiple of real time")
+    sessions.add_argument("--shared", action="store_true",
+                          help="all sessions capture the same source")
+    sessions.add_argument("--engine", choices=("threads", "asyncio"), default="threads")
+    sessions.set_defaults(func=bench_sessions)
+
+    journal = commands.add_parser("journal", help=bench_journal.__doc__)
+    journal.add_argument("--records", type=int, default=20000)
+    journal.add_argument("--rate", type=float, default=0,
+                         help="records per second, 0 for as fast as possible")
+    journal.add_argument("--interval", type=int, default=200, help="flush interval, ms")
+    journal.set_defaults(func=bench_journal)
+
+    archive = commands.add_parser("archive", help=bench_archive.__doc__)
+    archive.add_argument("--minutes", type=float, default=60.0)
+    archive.add_argument("--segment", type=int, default=600, help="seconds per segment")
+    archive.add_argument("--reads", type=int, default=1000)
+    archive.set_defaults(func=bench_archive)
+
+    batch = commands.add_parser("batch", help=bench_batch.__doc__)
+    batch.add_argument("--files", type=int, default=16)
+    batch.add_argument("--minutes", type=float, default=10.0, help="length of each file")
+    batch.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    batch.add_argument("--cap", type=int, default=8,
+                       help="streams the fake server accepts at a time")
+    batch.add_argument("--final-delay", type=int, default=20, help="ms per final result")
+    batch.set_defaults(func=bench_batch)
+
+    overload = commands.add_parser("overload", help=bench_overload.__doc__)
+    overload.add_argument("--duration", type=float, default=120.0,
+                          help="seconds of audio")
+    overload.add_argument("--stall", type=float, default=60.0,
+                          help="seconds of audio the reader stalls for")
+    overload.add_argument("--speed", type=float, default=20.0, help="multiple of real time")
+    overload.set_defaults(func=bench_overload)
+
+    requests = commands.add_parser("requests", help=bench_requests.__doc__)
+    requests.add_argument("--minutes", type=float, default=60.0,
+                          help="audio packed offline")
+    requests.add_argument("--sessions", type=int, default=4)
+    requests.add_argument("--duration", type=float, default=20.0,
+                          help="seconds of audio per live session")
+    requests.add_argument("--speed", type=float, default=1.0, help="multiple of real time")
+    requests.add_argument("--chunk-ms", type=int, default=20,
+                          help="ms of audio per captured chunk in live sessions")
+    requests.add_argument("--request-cost", type=float, default=15.0,
+                          help="ms the fake server spends on each request")
+    requests.add_argument("--audio-cost", type=float, default=0.1,
+                          help="ms the fake server spends per ms of audio")
+    requests.set_defaults(func=bench_requests)
+
+    timeline = commands.add_parser("timeline", help=bench_timeline.__doc__)
+    timeline.add_argument("--hours", type=float, default=4.0, help="audio per session")
+    timeline.add_argument("--sessions", type=int, default=2)
+    timeline.add_argument("--speed", type=float, default=400.0, help="multiple of real time")
+    timeline.add_argument("--limit", type=int, default=60,
+                          help="seconds each recognizer stream lasts")
+    timeline.add_argument("--overlap", type=int, default=10, help="seconds")
+    timeline.add_argument("--every", type=int, default=3000,
+                          help="ms of stream audio between finals")
+    timeline.set_defaults(func=bench_timeline)
+
+    keywords = commands.add_parser("keywords", help=bench_keywords.__doc__)
+    keywords.add_argument("--keywords", type=int, default=1000)
+    keywords.add_argument("--vocabulary", type=int, default=5000, help="distinct words")
+    keywords.add_argument("--utterances", type=int, default=2000)
+    keywords.set_defaults(func=bench_keywords)
+
+    interim = commands.add_parser("interim", help=bench_interim.__doc__)
+    interim.add_argument("--duration", type=float, default=600.0, help="seconds of speech")
+    interim.add_argument("--words", type=float, default=4.0, help="words per second")
+    interim.add_argument("--rate", type=float, default=10.0, help="interim results per second")
+    interim.set_defaults(func=bench_interim)
+
+    server = commands.add_parser("server", help=bench_server.__doc__)
+    server.add_argument("--streams", type=int, nargs="+", default=[1, 8, 32, 64, 96],
+                        help="concurrent clients, one run each")
+    server.add_argument("--duration", type=float, default=20.0,
+                        help="seconds of audio per client")
+    server.add_argument("--frame", type=int, default=100, help="ms of audio per message")
+    server.add_argument("--max-streams", type=int, default=64)
+    server.add_argument("--core", type=int, default=0, help="CPU the server is pinned to")
+    server.set_defaults(func=bench_server)
+
+    resample = commands.add_parser("resample", help=bench_resample.__doc__)
+    resample.add_argument("--formats", nargs="+",
+                          default=["48000x1", "48000x2", "44100x2", "48000x8", "16000x2"],
+                          help="native device formats, as RATExCHANNELS")
+    resample.add_argument("--duration", type=float, default=600.0, help="seconds of audio")
+    resample.add_argument("--chunk", type=int, default=100, help="ms per device buffer")
+    resample.set_defaults(func=bench_resample)
+
+    startup = commands.add_parser("startup", help=bench_startup.__doc__)
+    startup.add_argument("--runs", type=int, default=5, help="fresh processes per mode")
+    startup.add_argument("--top", type=int, default=12, help="imports listed")
+    startup.set_defaults(func=bench_startup)
+
+    serial_cmd = commands.add_parser("serial", help=bench_serial.__doc__)
+    serial_cmd.add_argument("--triggers", type=int, default=200)
+    serial_cmd.add_argument("--idle", type=float, default=2.0,
+                            help="seconds without triggers first")
+    serial_cmd.add_argument("--split", action="store_true",
+                            help="write every other line in two pieces")
+    serial_cmd.set_defaults(func=bench_serial)
+
+    stitch = commands.add_parser("stitch", help=bench_stitch.__doc__)
+    stitch.add_argument("--minutes", type=float, default=240.0, help="meeting length")
+    stitch.add_argument("--stream", type=int, default=240000,
+                        help="audio per recognizer stream, in ms")
+    stitch.add_argument("--overlap", type=int, default=5000, help="ms")
+    stitch.add_argument("--errors", type=float, default=0.1,
+                        help="chance a stream mishears a word in the overlap")
+    stitch.add_argument("--vocabulary", type=int, default=2000, help="distinct words")
+    stitch.set_defaults(func=bench_stitch)
+
+    metrics = commands.add_parser("metrics", help=bench_metrics.__doc__)
+    metrics.add_argument("--sessions", type=int, default=4)
+    metrics.add_argument("--duration", type=float, default=20.0)
+    metrics.add_argument("--speed", type=float, default=2.0, help="multiple of real time")
+    metrics.set_defaults(func=bench_metrics)
+
+    fake = commands.add_parser("fake-server", help=fake_server.__doc__)
+    fake.add_argument("--port", type=int, default=0, help="0 picks a free one")
+    fake.add_argument("--max-streams", type=int, help="streams served at once")
+    fake.set_defaults(func=fake_server)
+
+    args = parser.parse_args()
+    args.func(args)
+    if FAILURES:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,87 @@
-from stt_app.main import main
+import argparse
+import asyncio
+import time
+
+from stt_app.main import (
+    BATCH_WORKERS,
+    JOURNAL_PATH,
+    KEYWORDS_FILE,
+    SERVER_MAX_STREAMS,
+    SERVER_PORT,
+    BatchTranscriber,
+    KeywordSpotter,
+    TranscriptJournal,
+    TranscriptionServer,
+    available_encoders,
+    create_speech_client,
+    main,
+)
+
+
+def batch(args):
+    """Transcribe a directory of recorded meetings without the GUI."""
+    transcriber = BatchTranscriber(
+        create_speech_client(args.endpoint), args.output,
+        workers=args.workers, encoding=args.encoding)
+    paths = transcriber.find_files(args.directory)
+
+    started = time.perf_counter()
+    transcriber.run(paths)
+    minutes = (time.perf_counter() - started) / 60
+
+    print(f'{transcriber.files_done} of {len(paths)} files transcribed, '
+          f'{transcriber.files_failed} failed, in {minutes:.1f} min')
+    if minutes:
+        print(f'{transcriber.files_done / minutes:.1f} files/min, '
+              f'{transcriber.audio_seconds / 60 / minutes:.1f} audio min/min, '
+              f'{transcriber.retried} retries over quota')
+
+
+def serve(args):
+    """Transcribe audio streamed by network clients, without the GUI."""
+    journal = None if args.no_journal else TranscriptJournal(args.journal)
+    keywords = KeywordSpotter.load(KEYWORDS_FILE) if KEYWORDS_FILE else None
+    server = TranscriptionServer(args.host, args.port, args.endpoint,
+                                 max_streams=args.max_streams, journal=journal,
+                                 keywords=keywords)
+    try:
+        asyncio.run(server.run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if journal is not None:
+            journal.close()
+
+
+def cli():
+    parser = argparse.ArgumentParser(description="Speech-To-Text Application")
+    commands = parser.add_subparsers(dest="command")
+
+    batch_cmd = commands.add_parser("batch", help=batch.__doc__)
+    batch_cmd.add_argument("directory", help="folder of 16 kHz mono WAV/FLAC files")
+    batch_cmd.add_argument("--output", default="./output/transcripts",
+                           help="folder for the <name>.jsonl transcripts")
+    batch_cmd.add_argument("--workers", type=int, default=BATCH_WORKERS)
+    batch_cmd.add_argument("--encoding", choices=available_encoders(), default="LINEAR16")
+    batch_cmd.add_argument("--endpoint", help="host:port of a plaintext stand-in, e.g. bench.py fake-server")
+    batch_cmd.set_defaults(func=batch)
+
+    serve_cmd = commands.add_parser("serve", help=serve.__doc__)
+    serve_cmd.add_argument("--host", default="localhost")
+    serve_cmd.add_argument("--port", type=int, default=SERVER_PORT)
+    serve_cmd.add_argument("--max-streams", type=int, default=SERVER_MAX_STREAMS)
+    serve_cmd.add_argument("--journal", default=JOURNAL_PATH,
+                           help="file the final results are journaled to")
+    serve_cmd.add_argument("--no-journal", action="store_true")
+    serve_cmd.add_argument("--endpoint", help="host:port of a plaintext stand-in, e.g. bench.py fake-server")
+    serve_cmd.set_defaults(func=serve)
+
+    args = parser.parse_args()
+    if args.command is None:
+        main()
+    else:
+        args.func(args)
+
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    cli()
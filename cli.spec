@@ -10,7 +10,14 @@ a = Analysis(['cli.py'],
              datas=[
                ('roots.pem', 'grpc/_cython/_credentials/'),
              ],
-             hiddenimports=[],
+             # stt_app.main imports these on first use, out of sight of the analysis.
+             hiddenimports=[
+               'google.api_core.exceptions',
+               'google.cloud.speech',
+               'google.cloud.speech_v1.services.speech.transports',
+               'grpc',
+               'pyaudio',
+             ],
              hookspath=[],
              runtime_hooks=[],
              excludes=[],
@@ -3,135 +3,3527 @@ import tkinter as tk
 
 import threading
 import time
+import asyncio
 import random
 
+import bisect
+import collections
+import http.server
+import importlib
+import itertools
+import json
+import math
+import mmap
 import os
+import re
+import struct
+import urllib.parse
+from array import array
+from concurrent import futures
 
-from google.cloud import speech
-import pyaudio
+import numpy as np
 from six.moves import queue
 
+
+class _LazyModule:
+    """Stands in for a module, importing it when an attribute is first used."""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def load(self):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+
+# The Speech, gRPC and PyAudio stacks take most of the start-up time, so the
+# window is painted before they are imported; see preload().
+exceptions = _LazyModule("google.api_core.exceptions")
+speech = _LazyModule("google.cloud.speech")
+grpc = _LazyModule("grpc")
+pyaudio = _LazyModule("pyaudio")
+
 # Audio recording parameters
 STREAMING_LIMIT = 240000  # 4 minutes
 SAMPLE_RATE = 16000
 CHUNK_SIZE = int(SAMPLE_RATE / 10)  # 100ms
+STREAM_OVERLAP = 5000  # the next stream runs alongside the expiring one, in ms
+STREAM_RETRY_DELAY = 1000  # least time between replacing failed streams, in ms
+BRIDGING_WINDOW = 30000  # audio kept for replay at stream restart, in ms
+API_STREAM_LIMIT = 305000  # longest stream the Speech API accepts, in ms
+UI_FRAME_INTERVAL = 50  # ms between transcript redraws, caps them at 20/s
+TRANSCRIPT_WINDOW = 200  # transcript lines kept in the Text widget at once
+INTERIM_STABILITY = 0.8  # interim results at least this stable are drawn as settled
+VAD_FRAME = 20  # voice activity analysis frame, in ms
+VAD_HANGOVER = 500  # audio still sent after speech stops, in ms
+VAD_PREROLL = 300  # audio sent ahead of detected speech, in ms
+VAD_KEEPALIVE = 5000  # longest silence before a chunk is sent anyway, in ms
+CLIENT_POOL_SIZE = 2  # SpeechClients connected ahead of the first session
+CLIENT_IDLE_TIMEOUT = 600  # seconds an unused pooled client stays open
+MAX_SESSIONS = 8  # meetings transcribed at the same time
+SESSION_FAIR_SHARE = 5  # chunks a session may process before the next one's turn
+JOURNAL_FLUSH_INTERVAL = 200  # longest a final result waits to be fsynced, in ms
+JOURNAL_PATH = "./transcripts.jsonl"
+SHUTDOWN_TIMEOUT = 10000  # longest closing the window waits for the last finals, in ms
+ARCHIVE_SEGMENT = 600  # seconds of audio per archive segment file
+ARCHIVE_DIR = "./archive"
+CAPTURE_BUFFER = 10000  # captured audio that may wait for the reader, in ms
+CAPTURE_POLICY = "drop_silence"  # what makes room once it is full; see CaptureBuffer
+CAPTURE_LAG_WARNING = 2000  # reader lag counted as falling behind, in ms
+REQUEST_DURATION = 100  # audio per streaming request when the link keeps up, in ms
+REQUEST_MAX_DURATION = 400  # longest a request grows to on slow round trips, in ms
+REQUEST_MAX_BYTES = 25600  # API limit on the audio in one streaming request
+EXIT_KEYWORDS = {"exit": "exit", "quit": "exit"}  # phrases that end a session
+STITCH_WINDOW = 32  # words at the end of the transcript a new stream is aligned with
+CAPTURE_NATIVE_FORMAT = True  # open devices at their own rate and channels and convert here
+CAPTURE_MAX_CHANNELS = 8  # channels captured from an array mic before the downmix
+RESAMPLE_ZERO_CROSSINGS = 16  # resampling filter half-width, in output-rate samples
+SERIAL_MAX_LINE = 256  # longest trigger line kept from a serial device, in bytes
+SERIAL_TRIGGERS = {"START": "start", "STOP": "stop", "MARK": "mark"}  # line -> trigger
+SERVER_PORT = 8765  # where the headless server listens for client streams
+SERVER_MAX_STREAMS = 64  # client streams the headless server serves at once
+SERVER_MAX_BACKLOG = 2000  # client audio accepted ahead of the recognizer, in ms
+BATCH_WORKERS = 4  # windows of recorded meetings transcribed at the same time
+
+
+os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "./gcp.json"
+# host:port of a local stand-in for the Speech API, e.g. `python bench.py fake-server`
+SPEECH_ENDPOINT = os.environ.get("STT_SPEECH_ENDPOINT")
+# "threads" for SessionManager, "asyncio" for AsyncSessionManager
+ENGINE = os.environ.get("STT_ENGINE", "threads")
+# Latency metrics are collected only when one of these is set; see enable_metrics()
+METRICS_PORT = os.environ.get("STT_METRICS_PORT")
+METRICS_FILE = os.environ.get("STT_METRICS_FILE")
+METRICS = None
+# JSON object of extra {"phrase": "action"} keywords, e.g. {"action item": "bookmark"}
+KEYWORDS_FILE = os.environ.get("STT_KEYWORDS_FILE")
+# Serial port of the push-to-talk/mute buttons, e.g. /dev/ttyUSB0 or COM3; see SerialThread
+SERIAL_PORT = os.environ.get("STT_SERIAL_PORT")
+
+
+def preload():
+    """Import the Speech, gRPC and PyAudio stacks now rather than on first use.
+
+    Returns {module: seconds} for those that were not loaded yet.
+    """
+    timings = {}
+    for module in (grpc, exceptions, speech, pyaudio):
+        if module._module is None:
+            started = time.perf_counter()
+            module.load()
+            timings[module._name] = time.perf_counter() - started
+    return timings
+
+
+class LatencyHistogram:
+    """HDR-style histogram of non-negative integers, such as microseconds.
+
+    Buckets are log-linear: every power of two is split into SUB_BUCKETS
+    linear buckets, so a recorded value is off by less than 1/SUB_BUCKETS
+    and recording is a few integer operations on a fixed array.
+    """
+
+    SUB_BITS = 5
+    SUB_BUCKETS = 1 << SUB_BITS
+
+    def __init__(self, max_value=60_000_000):
+        self.max_value = max_value
+        self.counts = array("q", bytes(8 * (self._index(max_value) + 1)))
+        self.count = 0
+        self.total = 0
+        self._lock = threading.Lock()
+
+    def _index(self, value):
+        if value < 2 * self.SUB_BUCKETS:
+            return value
+        shift = value.bit_length() - self.SUB_BITS - 1
+        return shift * self.SUB_BUCKETS + (value >> shift)
+
+    def _value(self, index):
+        """Highest value that lands in bucket `index`."""
+        if index < 2 * self.SUB_BUCKETS:
+            return index
+        shift = index // self.SUB_BUCKETS - 1
+        return ((index - shift * self.SUB_BUCKETS + 1) << shift) - 1
+
+    def record(self, value):
+        value = min(max(0, int(value)), self.max_value)
+        with self._lock:
+            self.counts[self._index(value)] += 1
+            self.count += 1
+            self.total += value
+
+    def percentile(self, pct):
+        target = max(1, math.ceil(pct / 100 * self.count))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return self._value(index)
+        return 0
+
+
+class ChunkTimeline:
+    """When each captured chunk arrived, looked up by capture sample position.
+
+    The capture callback timestamps each chunk and the reader records it
+    against the chunk's position in coalesced(). Only the last `keep` chunks
+    are remembered.
+    """
+
+    def __init__(self, keep=4096):
+        self.keep = keep
+        self._starts = array("q")
+        self._times = array("q")
+
+    def coalesced(self, start, arrived):
+        """Record that the chunk at sample `start` arrived at `arrived` ns."""
+        if len(self._starts) >= 2 * self.keep:
+            del self._starts[:self.keep]
+            del self._times[:self.keep]
+        self._starts.append(start)
+        self._times.append(arrived)
+
+    def capture_ns(self, sample):
+        """Arrival time of the chunk holding `sample`, or None if forgotten."""
+        run = bisect.bisect_right(self._starts, sample) - 1
+        if run < 0:
+            return None
+        return self._times[run]
+
+
+class PipelineMetrics:
+    """Latency histograms and counters for the streaming pipeline.
+
+    Each captured chunk is timed from the capture callback to when the
+    reader coalesced it, when it went out in a request, and when the first
+    interim or final result covering it came back. Nothing is created or
+    called while metrics are off: the pipeline only checks for None.
+    """
+
+    LATENCIES = {
+        "coalesce": "capture callback to the stream reader",
+        "send": "capture callback to the request carrying it",
+        "interim": "capture callback to an interim result covering it",
+        "final": "capture callback to a final result covering it",
+    }
+
+    def __init__(self, rate=SAMPLE_RATE):
+        self.rate = rate
+        self.latencies = {name: LatencyHistogram() for name in self.LATENCIES}
+        self.bridge_bytes = LatencyHistogram(max_value=1 << 32)
+        self.queue_depth = LatencyHistogram(max_value=1 << 20)
+        self.last_queue_depth = 0
+        self.chunks = 0
+        self.restarts = 0
+        self.overloads = collections.Counter()
+
+    def _since(self, name, arrived):
+        if arrived is not None:
+            self.latencies[name].record((time.perf_counter_ns() - arrived) // 1000)
+
+    def coalesced(self, timeline, start, arrived, queue_depth):
+        timeline.coalesced(start, arrived)
+        self._since("coalesce", arrived)
+        self.queue_depth.record(queue_depth)
+        self.last_queue_depth = queue_depth
+        self.chunks += 1
+
+    def sent(self, timeline, end):
+        self._since("send", timeline.capture_ns(end - 1))
+
+    def result(self, timeline, end_ms, is_final):
+        sample = end_ms * self.rate // 1000 - 1
+        self._since("final" if is_final else "interim", timeline.capture_ns(sample))
+
+    def overloaded(self, kind):
+        self.overloads[kind] += 1
+
+    def restarted(self, bridge_bytes):
+        self.restarts += 1
+        self.bridge_bytes.record(bridge_bytes)
+
+    def render(self):
+        """The metrics in the Prometheus text exposition format."""
+        lines = []
+
+        def summary(name, help_text, histogram, scale=1):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} summary")
+            for quantile in (0.5, 0.9, 0.99, 0.999):
+                value = histogram.percentile(quantile * 100) * scale
+                lines.append(f'{name}{{quantile="{quantile}"}} {value:g}')
+            lines.append(f"{name}_sum {histogram.total * scale:g}")
+            lines.append(f"{name}_count {histogram.count}")
+
+        for stage, help_text in self.LATENCIES.items():
+            summary(f"stt_{stage}_latency_seconds", help_text,
+                    self.latencies[stage], scale=1e-6)
+        summary("stt_bridge_bytes", "audio replayed into a new stream at rollover",
+                self.bridge_bytes)
+        summary("stt_capture_queue_chunks", "chunks waiting for the stream reader",
+                self.queue_depth)
+        lines += [
+            "# HELP stt_capture_queue_depth chunks waiting at the last read",
+            "# TYPE stt_capture_queue_depth gauge",
+            f"stt_capture_queue_depth {self.last_queue_depth}",
+            "# HELP stt_chunks_total captured chunks",
+            "# TYPE stt_chunks_total counter",
+            f"stt_chunks_total {self.chunks}",
+            "# HELP stt_restarts_total recognizer stream rollovers",
+            "# TYPE stt_restarts_total counter",
+            f"stt_restarts_total {self.restarts}",
+            "# HELP stt_capture_overload_total capture buffer overload events by kind",
+            "# TYPE stt_capture_overload_total counter",
+        ]
+        for kind in ("dropped", "downsampled", "lagging"):
+            lines.append(f'stt_capture_overload_total{{kind="{kind}"}} {self.overloads[kind]}')
+        return "\n".join(lines) + "\n"
+
+
+def enable_metrics(port=None, path=None, interval=10):
+    """Start collecting metrics for streams opened from now on.
+
+    They are served at http://localhost:<port>/metrics and/or rewritten to
+    `path` every `interval` seconds, for a textfile collector.
+    """
+    global METRICS
+    metrics = METRICS = PipelineMetrics()
+
+    if port:
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = http.server.ThreadingHTTPServer(("localhost", int(port)), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    if path:
+        def write_file():
+            while True:
+                with open(path + ".tmp", "w") as f:
+                    f.write(metrics.render())
+                os.replace(path + ".tmp", path)
+                time.sleep(interval)
+
+        threading.Thread(target=write_file, daemon=True).start()
+    return metrics
+
+
+class AudioRingBuffer:
+    """Fixed-capacity history of the most recent 16-bit audio, indexed by sample.
+
+    Positions are absolute sample counts since the buffer was created, so a
+    caller can remember where a stream started and ask for that range later
+    for as long as it is still inside the window.
+    """
+
+    def __init__(self, capacity, sample_width=2):
+        self.capacity = capacity
+        self._width = sample_width
+        self._buf = bytearray(capacity * sample_width)
+        self._view = memoryview(self._buf)
+        self.write_pos = 0
+
+    @property
+    def oldest(self):
+        """First sample position that is still held in the buffer."""
+        return max(0, self.write_pos - self.capacity)
+
+    def write(self, data):
+        """Copy a chunk of audio into the buffer, overwriting the oldest samples."""
+        data = memoryview(data).cast("B")
+        samples = len(data) // self._width
+        if samples > self.capacity:
+            # Only the tail survives, so skip straight to where it lands.
+            self.write_pos += samples - self.capacity
+            samples = self.capacity
+            data = data[-self.capacity * self._width:]
+
+        offset = (self.write_pos % self.capacity) * self._width
+        first = min(len(data), len(self._buf) - offset)
+        self._view[offset:offset + first] = data[:first]
+        self._view[:len(data) - first] = data[first:]
+        self.write_pos += samples
+
+    def skip(self, samples):
+        """Advance past `samples` lost samples, which read back as silence."""
+        lost = min(samples, self.capacity)
+        self.write_pos += samples - lost
+        self.write(bytes(lost * self._width))
+
+    def view(self, start, end):
+        """Return zero-copy memoryviews covering samples [start, end).
+
+        The range is clipped to what the buffer still holds. A range that
+        wraps around the end of the storage comes back as two views.
+        """
+        start = max(start, self.oldest)
+        end = min(end, self.write_pos)
+        if start >= end:
+            return []
+
+        first = (start % self.capacity) * self._width
+        last = first + (end - start) * self._width
+        if last <= len(self._buf):
+            return [self._view[first:last]]
+        return [self._view[first:], self._view[:last - len(self._buf)]]
+
+
+class AudioArchive:
+    """Captured audio kept on disk and addressed by meeting time.
+
+    PCM goes into preallocated segment files of `segment_seconds` each,
+    written through mmap. The index maps the capture clock, the one
+    corrected_time is on, to archive positions. It has one entry per
+    contiguous run of capture, so reading any span is a seek into one or
+    two segments. write() only queues the chunk and a writer thread copies
+    it to disk, so capture never waits on the file system.
+    """
+
+    INDEX = struct.Struct("<qq")  # capture sample, archive sample
+
+    def __init__(self, directory, rate, segment_seconds=ARCHIVE_SEGMENT,
+                 sample_width=2, meeting=None):
+        self.directory = directory
+        self.rate = rate
+        self.segment_seconds = segment_seconds
+        self.sample_width = sample_width
+        self.meeting = meeting
+        self.segment_samples = rate * segment_seconds
+        self.samples = 0  # archive samples queued for writing
+        self.written = 0  # archive samples copied into the segment files
+        self._capture_at = array("q")
+        self._archived_at = array("q")
+        self._next_capture = None
+        self._pending = collections.deque()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._writer = None
+        self._segments = {}
+        self._readers = {}
+
+    @classmethod
+    def open(cls, directory):
+        """Open an archive written earlier, for reading."""
+        with open(os.path.join(directory, "archive.json")) as f:
+            meta = json.load(f)
+        archive = cls(directory, meta["rate"], meta["segment_seconds"],
+                      meta["sample_width"], meta.get("meeting"))
+        archive._closed = True
+        with open(os.path.join(directory, "index"), "rb") as f:
+            for capture, archived in AudioArchive.INDEX.iter_unpack(f.read()):
+                archive._capture_at.append(capture)
+                archive._archived_at.append(archived)
+        # An archive cut short by a crash has no length; its segments are
+        # preallocated, so the tail of the last one reads as silence.
+        segments = len([name for name in os.listdir(directory) if name.endswith(".pcm")])
+        archive.samples = archive.written = meta.get(
+            "samples", segments * archive.segment_samples)
+        return archive
+
+    def _write_meta(self, **extra):
+        meta = {"rate": self.rate, "segment_seconds": self.segment_seconds,
+                "sample_width": self.sample_width, "meeting": self.meeting}
+        meta.update(extra)
+        with open(os.path.join(self.directory, "archive.json"), "w") as f:
+            json.dump(meta, f)
+
+    def write(self, start, data):
+        """Queue a captured chunk; `start` is its capture position in samples."""
+        if self._writer is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self._write_meta()
+            self._index = open(os.path.join(self.directory, "index"), "ab")
+            self._writer = threading.Thread(target=self._run, daemon=True)
+            self._writer.start()
+
+        entry = None
+        if start != self._next_capture:
+            entry = self.INDEX.pack(start, self.samples)
+            self._capture_at.append(start)
+            self._archived_at.append(self.samples)
+        samples = len(data) // self.sample_width
+        self._next_capture = start + samples
+        self._pending.append((self.samples, data, entry))
+        self.samples += samples
+        self._wakeup.set()
+
+    def close(self):
+        if self._writer is None:
+            return
+        self._closed = True
+        self._wakeup.set()
+        self._writer.join()
+        self._writer = None
+        self._index.close()
+        self._write_meta(samples=self.samples)
+        for reader in self._readers.values():
+            reader.close()
+        self._readers = {}
+
+    def _run(self):
+        while not self._closed or self._pending:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            while self._pending:
+                position, data, entry = self._pending.popleft()
+                if entry is not None:
+                    self._index.write(entry)
+                    self._index.flush()
+                self._copy(position, data)
+                self.written = position + len(data) // self.sample_width
+
+        for segment in self._segments.values():
+            segment.flush()
+            segment.close()
+        self._segments = {}
+
+    def _copy(self, position, data):
+        data = memoryview(data)
+        while data:
+            number, offset = divmod(position, self.segment_samples)
+            segment = self._segments.get(number)
+            if segment is None:
+                for old in self._segments.values():
+                    old.flush()
+                    old.close()
+                segment = self._create_segment(number)
+                self._segments = {number: segment}
+            count = min(len(data) // self.sample_width, self.segment_samples - offset)
+            start = offset * self.sample_width
+            segment[start:start + count * self.sample_width] = data[:count * self.sample_width]
+            data = data[count * self.sample_width:]
+            position += count
+
+    def _segment_path(self, number):
+        return os.path.join(self.directory, f"{number:05d}.pcm")
+
+    def _create_segment(self, number):
+        size = self.segment_samples * self.sample_width
+        with open(self._segment_path(number), "wb+") as f:
+            f.truncate(size)
+            try:
+                os.posix_fallocate(f.fileno(), 0, size)
+            except (AttributeError, OSError):
+                pass  # sparse is fine, just slower to fill
+            return mmap.mmap(f.fileno(), size)
+
+    def _reader(self, number):
+        reader = self._readers.get(number)
+        if reader is None:
+            with open(self._segment_path(number), "rb") as f:
+                reader = self._readers[number] = mmap.mmap(
+                    f.fileno(), 0, access=mmap.ACCESS_READ)
+        return reader
+
+    def read(self, start_ms, end_ms):
+        """Return the audio captured between two meeting times, in ms.
+
+        Spans the capture did not record, and audio still queued for the
+        writer, are left out.
+        """
+        start = start_ms * self.rate // 1000
+        end = end_ms * self.rate // 1000
+        pieces = []
+        run = max(0, bisect.bisect_right(self._capture_at, start) - 1)
+        while run < len(self._capture_at):
+            capture = self._capture_at[run]
+            if capture >= end:
+                break
+            run_end = (self._archived_at[run + 1] if run + 1 < len(self._archived_at)
+                       else self.written)
+            first = self._archived_at[run] + max(0, start - capture)
+            last = min(run_end, self._archived_at[run] + end - capture, self.written)
+            while first < last:
+                number, offset = divmod(first, self.segment_samples)
+                count = min(last - first, self.segment_samples - offset)
+                reader = self._reader(number)
+                pieces.append(reader[offset * self.sample_width:
+                                     (offset + count) * self.sample_width])
+                first += count
+            run += 1
+        return b"".join(pieces)
+
+
+class AudioSource:
+    """Pushes raw 16-bit PCM chunks to a callback.
+
+    The callback is called with each chunk as bytes, and with None once the
+    source has nothing more to deliver.
+    """
+
+    def __init__(self, rate, chunk_size, channels=1):
+        self.rate = rate
+        self.chunk_size = chunk_size
+        self.channels = channels
+        self._callback = None
+
+    def start(self, callback):
+        self._callback = callback
+
+    def close(self):
+        pass
+
+
+class Resampler:
+    """Downmixes interleaved 16-bit PCM to mono and resamples it.
+
+    Resampling by out_rate/in_rate = up/down uses a polyphase windowed-sinc
+    filter: each output sample is one dot product of the input samples under
+    the filter with the filter phase it falls on, computed for a whole chunk
+    at once, phase by phase. The filter's input history and the position of the next output
+    carry over between calls, so feeding a stream chunk by chunk gives the
+    same samples as feeding it whole. Output is aligned with the input; the
+    last few samples of a stream stay in the filter.
+    """
+
+    def __init__(self, in_rate, out_rate, channels=1,
+                 zero_crossings=RESAMPLE_ZERO_CROSSINGS):
+        self.in_rate = in_rate
+        self.out_rate = out_rate
+        self.channels = channels
+        self._downmix = np.full(channels, 1 / channels, np.float32)
+        divisor = math.gcd(in_rate, out_rate)
+        self.up = out_rate // divisor
+        self.down = in_rate // divisor
+        if self.up == self.down:
+            self._bank = None
+            return
+
+        # Low-pass at the lower of the two Nyquist rates, in cycles per
+        # sample of the input upsampled by `up`.
+        factor = max(self.up, self.down)
+        cutoff = 0.5 / factor * 0.9
+        half = zero_crossings * factor
+        n = np.arange(-half, half + 1)
+        h = 2 * cutoff * np.sinc(2 * cutoff * n) * np.kaiser(len(n), 8.0) * self.up
+        # Phase p holds taps p, p + up, p + 2 up, ..., reversed to line up
+        # with the input samples in time order.
+        self._taps = -(-len(h) // self.up)
+        h = np.concatenate([h, np.zeros(self._taps * self.up - len(h))])
+        self._bank = h.reshape(self._taps, self.up).T[:, ::-1].astype(np.float32)
+        self._history = np.zeros(self._taps - 1, np.float32)
+        # Position of the next output in the upsampled input, counted from
+        # the start of the history; the filter's delay is skipped.
+        self._next = (self._taps - 1) * self.up + half
+
+    def process(self, data):
+        """Resample one chunk of interleaved PCM and return the mono PCM ready."""
+        pcm = np.frombuffer(data, "<i2")
+        if self.channels > 1:
+            mono = pcm.reshape(-1, self.channels).astype(np.float32) @ self._downmix
+        else:
+            mono = pcm.astype(np.float32)
+        if self._bank is None:
+            return np.rint(mono).astype("<i2").tobytes()
+        if not len(mono):
+            return b""
+
+        x = np.concatenate([self._history, mono])
+        up, down, held = self.up, self.down, self._taps - 1
+        count = max(0, -(-(len(x) * up - self._next) // down))
+        windows = np.lib.stride_tricks.sliding_window_view(x, self._taps)
+        out = np.empty(count, np.float32)
+        # Every up-th output uses the same phase, with its window `down`
+        # samples further on: one matrix-vector product per phase.
+        for first in range(min(up, count)):
+            position = self._next + first * down
+            start = position // up - held
+            rows = len(range(first, count, up))
+            out[first::up] = windows[start:start + (rows - 1) * down + 1:down] @ \
+                self._bank[position % up]
+
+        self._next += count * down - (len(x) - held) * up
+        self._history = x[len(x) - held:]
+        return np.clip(np.rint(out), -32768, 32767).astype("<i2").tobytes()
+
+
+class PyAudioSource(AudioSource):
+    """Live capture from a PyAudio input device.
+
+    With `native` set, the device is opened at its default rate and with up
+    to CAPTURE_MAX_CHANNELS of its channels, and a Resampler turns that into
+    `rate` mono before the chunks are passed on, rather than asking the
+    host audio stack for 16 kHz mono, which many array mics cannot do.
+    """
+
+    def __init__(self, rate, chunk_size, channels=1, device_index=None,
+                 native=CAPTURE_NATIVE_FORMAT):
+        super().__init__(rate, chunk_size, channels)
+        self.device_index = device_index
+        self.native = native and channels == 1
+        self.resampler = None
+        self._pending = bytearray()
+        self._audio_interface = None
+        self._audio_stream = None
+
+    def start(self, callback):
+        super().start(callback)
+        self._audio_interface = pyaudio.PyAudio()
+        try:
+            self._open()
+        except Exception:
+            self.close()
+            raise
+
+    def _open(self):
+        rate, channels = self.rate, self.channels
+        if self.native:
+            if self.device_index is None:
+                info = self._audio_interface.get_default_input_device_info()
+            else:
+                info = self._audio_interface.get_device_info_by_index(self.device_index)
+            rate = int(info["defaultSampleRate"])
+            channels = max(1, min(int(info["maxInputChannels"]), CAPTURE_MAX_CHANNELS))
+            if (rate, channels) != (self.rate, self.channels):
+                self.resampler = Resampler(rate, self.rate, channels)
+        self._audio_stream = self._audio_interface.open(
+            format=pyaudio.paInt16,
+            channels=channels,
+            rate=rate,
+            input=True,
+            input_device_index=self.device_index,
+            frames_per_buffer=self.chunk_size * rate // self.rate,
+            stream_callback=self._on_audio,
+        )
+
+    def _on_audio(self, in_data, *args, **kwargs):
+        if self.resampler is None:
+            self._callback(in_data)
+            return None, pyaudio.paContinue
+
+        # The resampler's output drifts around chunk_size a call; pass it on
+        # in whole chunks, as the rest of the pipeline expects.
+        self._pending += self.resampler.process(in_data)
+        chunk_bytes = self.chunk_size * 2
+        while len(self._pending) >= chunk_bytes:
+            self._callback(bytes(self._pending[:chunk_bytes]))
+            del self._pending[:chunk_bytes]
+        return None, pyaudio.paContinue
+
+    def close(self):
+        if self._audio_stream is not None:
+            self._audio_stream.stop_stream()
+            self._audio_stream.close()
+            self._audio_stream = None
+        if self._audio_interface is not None:
+            self._audio_interface.terminate()
+            self._audio_interface = None
+
+
+def list_input_devices():
+    """Return {name: device_index} for the PyAudio input devices."""
+    audio_interface = pyaudio.PyAudio()
+    try:
+        devices = {}
+        for index in range(audio_interface.get_device_count()):
+            info = audio_interface.get_device_info_by_index(index)
+            if info.get("maxInputChannels", 0) > 0:
+                devices[f'{index}: {info["name"]}'] = index
+        return devices
+    finally:
+        audio_interface.terminate()
+
+
+class _PacedAudioSource(AudioSource):
+    """Delivers chunks from a background thread at `speed` times real time.
+
+    A speed of 0 delivers chunks as fast as the callback accepts them.
+    """
+
+    def __init__(self, rate, chunk_size, channels=1, speed=1.0):
+        super().__init__(rate, chunk_size, channels)
+        self.speed = speed
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self, callback):
+        super().start(callback)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _read_chunk(self):
+        raise NotImplementedError
+
+    def _run(self):
+        interval = self.chunk_size / self.rate / self.speed if self.speed else 0
+        deadline = time.monotonic()
+
+        while not self._stopped.is_set():
+            chunk = self._read_chunk()
+            if not chunk:
+                self._callback(None)
+                return
+            self._callback(chunk)
+
+            if interval:
+                deadline += interval
+                self._stopped.wait(max(0, deadline - time.monotonic()))
+
+    def close(self):
+        self._stopped.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+
+class FileAudioSource(_PacedAudioSource):
+    """Replays a WAV file or headerless 16-bit PCM through a memory map."""
+
+    def __init__(self, path, rate, chunk_size, channels=1, speed=1.0, loop=False):
+        super().__init__(rate, chunk_size, channels, speed)
+        self.path = path
+        self.loop = loop
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._start, self._end = self._locate_pcm()
+        self._pos = self._start
+
+    def _locate_pcm(self):
+        """Return the byte range of the samples, checking the WAV format if any."""
+        if self._map[:4] != b"RIFF" or self._map[8:12] != b"WAVE":
+            return 0, len(self._map)
+
+        pos = 12
+        while pos + 8 <= len(self._map):
+            chunk_id = self._map[pos:pos + 4]
+            size = struct.unpack_from("<I", self._map, pos + 4)[0]
+            body = pos + 8
+
+            if chunk_id == b"fmt ":
+                audio_format, channels, rate = struct.unpack_from("<HHI", self._map, body)
+                bits = struct.unpack_from("<H", self._map, body + 14)[0]
+                if (audio_format not in (1, 0xFFFE) or channels != self.channels
+                        or rate != self.rate or bits != 16):
+                    raise ValueError(
+                        f"{self.path}: expected 16-bit PCM, {self.channels} "
+                        f"channel(s) at {self.rate} Hz")
+            elif chunk_id == b"data":
+                return body, min(body + size, len(self._map))
+
+            pos = body + size + (size & 1)
+
+        raise ValueError(f"{self.path}: no data chunk")
+
+    def _read_chunk(self):
+        if self._pos >= self._end and self.loop:
+            self._pos = self._start
+
+        chunk = self._map[self._pos:min(self._pos + self.chunk_size * self.channels * 2, self._end)]
+        self._pos += len(chunk)
+        return chunk
+
+    def close(self):
+        super().close()
+        self._map.close()
+        self._file.close()
+
+
+class SyntheticAudioSource(_PacedAudioSource):
+    """Generates a sine tone, white noise or silence.
+
+    `duration` is in seconds; None keeps generating until the source is closed.
+    """
+
+    KINDS = ("tone", "noise", "silence")
+
+    def __init__(self, rate, chunk_size, kind="tone", frequency=440.0,
+                 amplitude=0.3, duration=None, channels=1, speed=1.0, seed=None):
+        super().__init__(rate, chunk_size, channels, speed)
+        if kind not in self.KINDS:
+            raise ValueError(f"unknown synthetic source kind: {kind}")
+        self.kind = kind
+        self.frequency = frequency
+        self.amplitude = amplitude
+        self._remaining = None if duration is None else int(duration * rate)
+        self._rng = np.random.default_rng(seed)
+        self._phase = 0.0
+
+    def _read_chunk(self):
+        frames = self.chunk_size
+        if self._remaining is not None:
+            frames = min(frames, self._remaining)
+            self._remaining -= frames
+        if frames <= 0:
+            return b""
+
+        if self.kind == "tone":
+            step = 2 * np.pi * self.frequency / self.rate
+            samples = np.sin(self._phase + step * np.arange(frames))
+            self._phase = (self._phase + step * frames) % (2 * np.pi)
+        elif self.kind == "noise":
+            samples = self._rng.uniform(-1.0, 1.0, frames)
+        else:
+            samples = np.zeros(frames)
+
+        pcm = (samples * (self.amplitude * 32767)).astype(np.int16)
+        if self.channels > 1:
+            pcm = np.repeat(pcm, self.channels)
+        return pcm.tobytes()
+
+
+class PushAudioSource(AudioSource):
+    """Audio handed in by the caller, such as a network client.
+
+    push() takes PCM in pieces of any size and passes it on in chunks of
+    `chunk_size` frames, holding it until the source is started; end()
+    flushes the rest and ends the audio.
+    """
+
+    def __init__(self, rate, chunk_size, channels=1):
+        super().__init__(rate, chunk_size, channels)
+        self._pending = bytearray()
+        self._chunk_bytes = chunk_size * channels * 2
+
+    def push(self, data):
+        self._pending += data
+        while self._callback is not None and len(self._pending) >= self._chunk_bytes:
+            self._callback(bytes(self._pending[:self._chunk_bytes]))
+            del self._pending[:self._chunk_bytes]
+
+    def end(self):
+        tail = len(self._pending) - len(self._pending) % (self.channels * 2)
+        if tail:
+            self._callback(bytes(self._pending[:tail]))
+        self._pending.clear()
+        self._callback(None)
+
+
+class SharedAudioSource:
+    """Fans one capture source out to several streams.
+
+    Each stream takes its own handle(). The underlying source runs while at
+    least one handle is started, so sessions on the same device share it.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def handle(self):
+        return _SharedAudioHandle(self)
+
+    @property
+    def users(self):
+        return len(self._callbacks)
+
+    def _attach(self, callback):
+        with self._lock:
+            # A source that fails to start leaves no user behind.
+            if not self._callbacks:
+                self.source.start(self._dispatch)
+            self._callbacks.append(callback)
+
+    def _detach(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+                if not self._callbacks:
+                    self.source.close()
+
+    def _dispatch(self, in_data):
+        for callback in list(self._callbacks):
+            callback(in_data)
+
+
+class _SharedAudioHandle(AudioSource):
+
+    def __init__(self, shared):
+        source = shared.source
+        super().__init__(source.rate, source.chunk_size, source.channels)
+        self._shared = shared
+
+    def start(self, callback):
+        super().start(callback)
+        self._shared._attach(callback)
+
+    def close(self):
+        self._shared._detach(self._callback)
+
+
+class VoiceActivityDetector:
+    """Energy and zero-crossing voice activity detection on 16-bit chunks.
+
+    Each chunk is split into VAD_FRAME frames and scored in one vectorized
+    pass. A frame is speech when it is loud enough and does not cross zero as
+    often as broadband noise does, or when it is very loud. Silent chunks are
+    held back as pre-roll and dropped once they fall out of it; the first
+    chunk in every VAD_KEEPALIVE stretch of silence still goes out so the API
+    does not time the stream out for lack of audio.
+    """
+
+    def __init__(self, rate, energy_threshold=500, max_zero_crossings=0.35,
+                 hangover=VAD_HANGOVER, preroll=VAD_PREROLL, keepalive=VAD_KEEPALIVE):
+        self._rate = rate
+        self._frame = rate * VAD_FRAME // 1000
+        self.energy_threshold = energy_threshold
+        self.max_zero_crossings = max_zero_crossings
+        self._hangover = rate * hangover // 1000
+        self._preroll_limit = rate * preroll // 1000
+        self._keepalive = rate * keepalive // 1000
+        self._preroll = collections.deque()
+        self._preroll_samples = 0
+        self._hang_left = 0
+        self._silent_run = 0
+        self.suppressed_samples = 0
+
+    @property
+    def suppressed_seconds(self):
+        return self.suppressed_samples / self._rate
+
+    def is_speech(self, chunk):
+        samples = np.frombuffer(chunk, dtype=np.int16)
+        frames = len(samples) // self._frame
+        if frames == 0:
+            frames, frame = 1, len(samples)
+        else:
+            frame = self._frame
+        x = samples[:frames * frame].reshape(frames, frame).astype(np.float32)
+
+        energy = np.sqrt(np.mean(x * x, axis=1))
+        crossings = np.count_nonzero(np.diff(np.signbit(x), axis=1), axis=1) / frame
+        speech = ((energy > self.energy_threshold) & (crossings < self.max_zero_crossings)) \
+            | (energy > 4 * self.energy_threshold)
+        return bool(speech.any())
+
+    def process(self, chunk):
+        """Gate one chunk.
+
+        Returns (skipped, chunks): the number of samples dropped, followed by
+        the chunks to send. The dropped audio always precedes the sent audio.
+        """
+        samples = len(chunk) // 2
+
+        if self.is_speech(chunk):
+            self._hang_left = self._hangover
+        elif self._hang_left > 0:
+            self._hang_left -= samples
+        else:
+            self._silent_run += samples
+            if self._silent_run >= self._keepalive:
+                skipped = self._drop_preroll(0)
+                self._silent_run = 0
+                return skipped, [chunk]
+
+            self._preroll.append(chunk)
+            self._preroll_samples += samples
+            return self._drop_preroll(self._preroll_limit), []
+
+        self._silent_run = 0
+        chunks = list(self._preroll)
+        chunks.append(chunk)
+        self._preroll.clear()
+        self._preroll_samples = 0
+        return 0, chunks
+
+    def _drop_preroll(self, keep):
+        skipped = 0
+        while self._preroll and self._preroll_samples - len(self._preroll[0]) // 2 >= keep:
+            dropped = len(self._preroll.popleft()) // 2
+            self._preroll_samples -= dropped
+            skipped += dropped
+        self.suppressed_samples += skipped
+        return skipped
+
+
+class StreamTimeMap:
+    """Maps time in the audio sent on one recognizer stream to the capture clock.
+
+    Every run of audio sent is recorded with the capture position, in samples,
+    it came from. A result_end_time can then be placed in the meeting even
+    when the stream began with replayed audio or the VAD left silence out.
+    """
+
+    def __init__(self, rate):
+        self._rate = rate
+        self.sent = 0
+        self._sent_at = array("q")
+        self._capture_at = array("q")
+
+    def add(self, start, samples):
+        """Record `samples` sent from capture position `start`."""
+        if not self._capture_at or \
+                self._capture_at[-1] + self.sent - self._sent_at[-1] != start:
+            # Readers bisect _sent_at, so it is extended last.
+            self._capture_at.append(start)
+            self._sent_at.append(self.sent)
+        self.sent += samples
+
+    def to_capture(self, sent_ms):
+        """Capture position, in samples, of the audio sent `sent_ms` into the stream."""
+        if not self._sent_at:
+            return 0
+        pos = round(sent_ms * self._rate / 1000)
+        run = max(0, bisect.bisect_left(self._sent_at, pos) - 1)
+        return self._capture_at[run] + pos - self._sent_at[run]
+
+    def to_capture_ms(self, sent_ms):
+        """Capture time in ms of the audio sent `sent_ms` into the stream."""
+        return self.to_capture(sent_ms) * 1000 // self._rate
+
+    def age_ms(self, position):
+        """Capture time in ms from the stream's first audio to sample `position`."""
+        if not self._capture_at:
+            return 0
+        return (position - self._capture_at[0]) * 1000 // self._rate
+
+
+class CaptureBuffer:
+    """Bounded queue between the capture callback and the stream reader.
+
+    put() never blocks the capture callback. Once `capacity` bytes of audio
+    are waiting, the overload policy makes room:
+
+    - "drop_oldest" drops the oldest chunk;
+    - "drop_silence" drops the oldest chunk without speech, or the oldest
+      chunk when every waiting chunk has speech;
+    - "downsample" keeps the oldest full-rate chunk at half the sample rate,
+      restoring its length when read, and drops the oldest chunk once all
+      of them are downsampled.
+
+    The buffer keeps the capture clock: `captured` counts every sample put,
+    dropped ones included, and each chunk is read with its position on
+    that clock. `lag_ms` is how far the reader is behind real time;
+    crossing `lag_warning` ms is counted in lag_events.
+    """
+
+    POLICIES = ("drop_oldest", "drop_silence", "downsample")
+
+    def __init__(self, rate, capacity, policy=CAPTURE_POLICY, is_speech=None,
+                 lag_warning=CAPTURE_LAG_WARNING, metrics=None, sample_width=2):
+        if policy not in self.POLICIES:
+            raise ValueError(f"unknown overload policy {policy!r}")
+        self.rate = rate
+        self.capacity = capacity
+        self.policy = policy
+        self.is_speech = is_speech or VoiceActivityDetector(rate).is_speech
+        self.lag_warning = lag_warning
+        self.metrics = metrics
+        self._width = sample_width
+        # Entries are [data, samples, position, arrived, downsampled, speech];
+        # None marks the end of the audio.
+        self._entries = collections.deque()
+        self._bytes = 0
+        self._samples = 0
+        self.captured = 0
+        self._cond = threading.Condition()
+        self.dropped_chunks = 0
+        self.dropped_samples = 0
+        self.downsampled_chunks = 0
+        self.max_bytes = 0
+        self.max_lag_ms = 0
+        self.lag_events = 0
+        self._lagging = False
+
+    @property
+    def lag_ms(self):
+        return self._samples * 1000 // self.rate
+
+    def qsize(self):
+        return len(self._entries)
+
+    def empty(self):
+        return not self._entries
+
+    def put(self, data, arrived=None):
+        """Queue a captured chunk, or None to mark the end of the audio."""
+        with self._cond:
+            if data is None:
+                self._entries.append(None)
+            else:
+                samples = len(data) // self._width
+                self._entries.append([data, samples, self.captured, arrived, False, None])
+                self.captured += samples
+                self._bytes += len(data)
+                self._samples += samples
+                while self._bytes > self.capacity and self._make_room():
+                    pass
+                self._track_lag()
+            self._cond.notify()
+
+    def get(self, block=True):
+        """Return (data, position, arrived) for the oldest chunk, or None at the end.
+
+        Raises queue.Empty when nothing is waiting and `block` is false.
+        """
+        with self._cond:
+            if block:
+                self._cond.wait_for(lambda: self._entries)
+            elif not self._entries:
+                raise queue.Empty
+            entry = self._entries.popleft()
+            if entry is None:
+                return None
+            data, samples, position, arrived, downsampled, speech = entry
+            self._bytes -= len(data)
+            self._samples -= samples
+            self._track_lag()
+
+        if downsampled:
+            half = np.frombuffer(data, dtype="<i2")
+            data = np.interp(np.arange(samples), np.arange(len(half)) * 2 + 0.5,
+                             half).astype("<i2").tobytes()
+        return data, position, arrived
+
+    def _track_lag(self):
+        lag = self.lag_ms
+        self.max_lag_ms = max(self.max_lag_ms, lag)
+        self.max_bytes = max(self.max_bytes, self._bytes)
+        if lag > self.lag_warning and not self._lagging:
+            self._lagging = True
+            self.lag_events += 1
+            if self.metrics is not None:
+                self.metrics.overloaded("lagging")
+        elif lag <= self.lag_warning // 2:
+            self._lagging = False
+
+    def _make_room(self):
+        """Apply the overload policy once; return False if nothing can go."""
+        chunks = [(i, e) for i, e in enumerate(self._entries) if e is not None]
+        if len(chunks) <= 1:
+            return False
+
+        if self.policy == "downsample":
+            for index, entry in chunks[:-1]:
+                if not entry[4]:
+                    self._downsample(entry)
+                    return True
+        elif self.policy == "drop_silence":
+            for index, entry in chunks[:-1]:
+                if entry[5] is None:
+                    entry[5] = self.is_speech(self._pcm(entry))
+                if not entry[5]:
+                    self._drop(index)
+                    return True
+
+        self._drop(chunks[0][0])
+        return True
+
+    def _pcm(self, entry):
+        if entry[4]:
+            return np.repeat(np.frombuffer(entry[0], dtype="<i2"), 2)[:entry[1]].tobytes()
+        return entry[0]
+
+    def _downsample(self, entry):
+        pcm = np.frombuffer(entry[0], dtype="<i2").astype(np.int32)
+        if len(pcm) % 2:
+            pcm = np.append(pcm, pcm[-1])
+        half = ((pcm[0::2] + pcm[1::2]) // 2).astype("<i2").tobytes()
+        self._bytes -= len(entry[0]) - len(half)
+        entry[0] = half
+        entry[4] = True
+        self.downsampled_chunks += 1
+        if self.metrics is not None:
+            self.metrics.overloaded("downsampled")
+
+    def _drop(self, index):
+        data, samples, position, arrived, downsampled, speech = self._entries[index]
+        del self._entries[index]
+        self._bytes -= len(data)
+        self._samples -= samples
+        self.dropped_chunks += 1
+        self.dropped_samples += samples
+        if self.metrics is not None:
+            self.metrics.overloaded("dropped")
+
+
+class ResumableMicrophoneStream:  # this class will generate microphone voice in real time
+    """Opens a recording stream as a generator yielding the audio chunks."""
+
+    def __init__(self, rate, chunk_size, source=None, vad=None, archive=None,
+                 policy=CAPTURE_POLICY):
+        self._rate = rate
+        self.chunk_size = chunk_size
+        self._num_channels = 1
+        self.metrics = METRICS
+        self.timeline = ChunkTimeline() if self.metrics is not None else None
+        self._buff = CaptureBuffer(
+            rate, rate * self._num_channels * 2 * CAPTURE_BUFFER // 1000, policy,
+            vad.is_speech if vad is not None else None, metrics=self.metrics)
+        self.closed = True
+        self.audio_history = AudioRingBuffer(
+            self._rate * self._num_channels * BRIDGING_WINDOW // 1000)
+        self.vad = vad
+        self.archive = archive
+        self.wakeup = None  # threading.Event set whenever audio arrives
+        self.muted = False  # capture goes on as silence, keeping the meeting clock
+        self._audio_source = source or PyAudioSource(
+            rate, chunk_size, self._num_channels)
+
+    def __enter__(self):
+
+        self.closed = False
+        # Run the audio source asynchronously to fill the buffer object.
+        # This is necessary so that the input device's buffer doesn't
+        # overflow while the calling thread makes network requests, etc.
+        self._audio_source.start(self._fill_buffer)
+        return self
+
+    def __exit__(self, type, value, traceback):
+
+        self._audio_source.close()
+        if self.archive is not None:
+            self.archive.close()
+        self.closed = True
+        # Signal the generator to terminate so that the client's
+        # streaming_recognize method will not block the process termination.
+        self._buff.put(None)
+
+    def _fill_buffer(self, in_data):
+        """Continuously collect data from the audio source, into the buffer."""
+
+        arrived = None
+        if self.timeline is not None and in_data is not None:
+            arrived = time.perf_counter_ns()
+        self._buff.put(in_data, arrived)
+        self._notify()
+
+    def _notify(self):
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+    def stop(self):
+        """Ask readers to finish; the source is closed on exit."""
+        self.closed = True
+        self._buff.put(None)
+        self._notify()
+
+    def read_runs(self, block=True, max_chunks=None, join=True):
+        """Return the captured audio that passed the VAD as (start, data) runs.
+
+        `start` is the capture position, in samples, of the first sample of
+        `data`; each run is contiguous audio. With `block` set, wait for the
+        first chunk; read at most `max_chunks` chunks. With `join` false,
+        `data` is the list of captured chunks rather than one bytes object.
+        """
+
+        runs = []
+        count = 0
+        while max_chunks is None or count < max_chunks:
+            try:
+                entry = self._buff.get(block=block and count == 0)
+            except queue.Empty:
+                break
+
+            if entry is None:
+                # Either we are shutting down or the source ran dry (end of
+                # a file or synthetic clip); no restart can bring more audio.
+                # What we already have is still returned.
+                self.closed = True
+                break
+            self._add_chunk(entry, runs)
+            count += 1
+
+        return self._finish_runs(runs, join)
+
+    def generator(self):
+        """Stream Audio from microphone, for a single request"""
+
+        coalescer = RequestCoalescer(self._rate, adaptive=False)
+        while not self.closed:
+            for start, chunks in self.read_runs(join=False):
+                for data, end in coalescer.add(chunks, None):
+                    yield data
+            if coalescer.due() or self.closed and coalescer.pending:
+                yield coalescer.cut()[0]
+
+    def _add_chunk(self, entry, runs):
+        """Record a captured chunk and queue whatever the VAD lets through."""
+        chunk, position, arrived = entry
+        if self.muted:
+            chunk = bytes(len(chunk))
+        if position > self.audio_history.write_pos:
+            # Audio the capture buffer dropped still takes up meeting time.
+            self.audio_history.skip(position - self.audio_history.write_pos)
+        if self.archive is not None:
+            self.archive.write(self.audio_history.write_pos, chunk)
+        if self.metrics is not None:
+            self.metrics.coalesced(self.timeline, self.audio_history.write_pos,
+                                   arrived, self._buff.qsize())
+        self.audio_history.write(chunk)
+
+        if self.vad is None:
+            sent = [chunk]
+        else:
+            skipped, sent = self.vad.process(chunk)
+
+        # What the VAD lets through always ends with the newest chunk.
+        samples = sum(len(piece) for piece in sent) // 2
+        start = self.audio_history.write_pos - samples
+        if not samples:
+            return
+        if runs and runs[-1][0] + runs[-1][1] == start:
+            runs[-1][1] += samples
+            runs[-1][2].extend(sent)
+        else:
+            runs.append([start, samples, list(sent)])
+
+    @staticmethod
+    def _finish_runs(runs, join):
+        if join:
+            return [(start, b"".join(data)) for start, samples, data in runs]
+        return [(start, data) for start, samples, data in runs]
+
+
+class AsyncMicrophoneStream(ResumableMicrophoneStream):
+    """ResumableMicrophoneStream read by a coroutine instead of a thread.
+
+    The capture callback runs on the source's own thread and only fills the
+    capture buffer; the event loop is woken with call_soon_threadsafe. Enter
+    the stream from a coroutine on that loop.
+    """
+
+    def __enter__(self):
+        self._loop = asyncio.get_running_loop()
+        self._ready = asyncio.Event()
+        return super().__enter__()
+
+    def _notify(self):
+        super()._notify()
+        try:
+            self._loop.call_soon_threadsafe(self._ready.set)
+        except RuntimeError:
+            pass  # the loop has already closed
+
+    async def runs(self, join=True):
+        """Yield lists of (start, data) runs, as read_runs() returns them."""
+        while True:
+            await self._ready.wait()
+            self._ready.clear()
+            runs = []
+            ended = False
+            while True:
+                try:
+                    entry = self._buff.get(block=False)
+                except queue.Empty:
+                    break
+                if entry is None:
+                    ended = True
+                    break
+                self._add_chunk(entry, runs)
+
+            if runs:
+                yield self._finish_runs(runs, join)
+            if ended:
+                # Either we are shutting down or the source ran dry.
+                self.closed = True
+                return
+
+
+class RequestCoalescer:
+    """Packs queued audio into streaming requests of a steady size.
+
+    Chunks are copied into one preallocated buffer. A request is cut once
+    it holds `target_ms` of audio and nothing more is waiting, once its
+    oldest audio has waited `target_ms`, or once it reaches `max_bytes`,
+    so a backlog goes out in full requests. The target follows the round
+    trip measured from each request to the first result that covers it:
+    half of it, between `min_ms` and `max_ms`, since on a slow link bigger
+    requests cost no visible latency.
+    """
+
+    def __init__(self, rate, min_ms=REQUEST_DURATION, max_ms=REQUEST_MAX_DURATION,
+                 max_bytes=REQUEST_MAX_BYTES, adaptive=True):
+        self.rate = rate
+        self.max_bytes = max_bytes
+        self.min_ms = min_ms
+        self.max_ms = min(max_ms, max_bytes // 2 * 1000 // rate)
+        self.target_ms = min_ms
+        self.adaptive = adaptive
+        self.rtt = None  # smoothed round trip, in seconds
+        self.requests = 0
+        self._buffer = memoryview(bytearray(max_bytes))
+        self._used = 0
+        self._first = None  # when the oldest buffered audio was queued
+        self._end = None  # capture end of the newest live audio buffered
+        self.sent_ms = 0  # stream time of the audio cut so far
+        self._in_flight = collections.deque(maxlen=256)
+
+    @property
+    def pending(self):
+        return self._used
+
+    def due(self):
+        return self._used * 500 >= self.target_ms * self.rate
+
+    def timeout(self):
+        """Seconds until the buffered audio must go out, None if there is none."""
+        if not self._used:
+            return None
+        return max(0.0, self._first + self.target_ms / 1000 - time.perf_counter())
+
+    def add(self, chunks, end):
+        """Copy in chunks that end at capture sample `end`; yield full requests."""
+        for chunk in chunks:
+            if not self._used:
+                self._first = time.perf_counter()
+            if len(chunk) < self.max_bytes - self._used:
+                self._buffer[self._used:self._used + len(chunk)] = chunk
+                self._used += len(chunk)
+                continue
+            chunk = memoryview(chunk)
+            while chunk:
+                if not self._used:
+                    self._first = time.perf_counter()
+                count = min(len(chunk), self.max_bytes - self._used)
+                self._buffer[self._used:self._used + count] = chunk[:count]
+                self._used += count
+                chunk = chunk[count:]
+                if self._used == self.max_bytes:
+                    yield self.cut()
+        if end is not None:
+            self._end = end
+
+    def cut(self):
+        """Return (payload, end) for the buffered audio and empty the buffer."""
+        payload = bytes(self._buffer[:self._used])
+        end, self._end = self._end, None
+        self.sent_ms += self._used * 500 / self.rate
+        self._in_flight.append((self.sent_ms, time.perf_counter()))
+        self._used = 0
+        self.requests += 1
+        return payload, end
+
+    def acknowledged(self, stream_ms):
+        """Note a result covering the audio up to `stream_ms`."""
+        sent = None
+        while self._in_flight and self._in_flight[0][0] <= stream_ms:
+            sent = self._in_flight.popleft()[1]
+        if sent is None:
+            return
+        rtt = time.perf_counter() - sent
+        self.rtt = rtt if self.rtt is None else 0.8 * self.rtt + 0.2 * rtt
+        if self.adaptive:
+            self.target_ms = min(self.max_ms, max(self.min_ms, self.rtt * 500))
+
+
+class RecognizerStream:
+    """One streaming_recognize call within a transcription session.
+
+    Runs of captured audio are queued with send() and pulled through the
+    coalescer and the encoder by requests(). The time map remembers where
+    each run was captured, so results can be placed on the meeting clock.
+    """
+
+    def __init__(self, index, rate, encoder, metrics=None, timeline=None):
+        self.index = index
+        self.encoder = encoder
+        self.coalescer = RequestCoalescer(rate)
+        self.time_map = StreamTimeMap(rate)
+        self.last_final = None  # capture position where the last final ended
+        self.failed = False  # the call ended with an error; the session replaces it
+        self.metrics = metrics
+        self.timeline = timeline
+        self._queue = queue.Queue()
+
+    def send(self, start, chunks, replay=False):
+        """Queue a run of audio chunks captured from sample `start` on.
+
+        `replay` marks a bridge, whose audio was already sent once.
+        """
+        samples = sum(len(chunk) for chunk in chunks) // 2
+        self.time_map.add(start, samples)
+        self._queue.put_nowait((chunks, None if replay else start + samples))
+
+    @property
+    def backlog_ms(self):
+        """Audio queued on this stream but not yet sent, in ms."""
+        return self.time_map.sent * 1000 / self.coalescer.rate - self.coalescer.sent_ms
+
+    def _sending(self, request):
+        data, end = request
+        if self.metrics is not None and end is not None:
+            self.metrics.sent(self.timeline, end)
+        return data
+
+    def close(self):
+        """Half-close the call; the API still returns its pending finals."""
+        self._queue.put_nowait(None)
+
+    def _audio(self):
+        coalescer = self.coalescer
+        while True:
+            if coalescer.due() and self._queue.empty():
+                yield self._sending(coalescer.cut())
+            try:
+                item = self._queue.get(timeout=coalescer.timeout())
+            except queue.Empty:
+                yield self._sending(coalescer.cut())
+                continue
+            if item is None:
+                break
+            for request in coalescer.add(*item):
+                yield self._sending(request)
+
+        if coalescer.pending:
+            yield self._sending(coalescer.cut())
+
+    def requests(self):
+        return (
+            speech.StreamingRecognizeRequest(audio_content=content)
+            for content in self.encoder.encode_stream(self._audio())
+        )
+
+
+class AsyncRecognizerStream(RecognizerStream):
+    """RecognizerStream whose audio is queued and read on an event loop."""
+
+    def __init__(self, index, rate, encoder, metrics=None, timeline=None):
+        super().__init__(index, rate, encoder, metrics, timeline)
+        self._queue = asyncio.Queue()
+
+    async def requests(self, streaming_config):
+        # SpeechAsyncClient has no helper that sends the config first.
+        yield speech.StreamingRecognizeRequest(streaming_config=streaming_config)
+        coalescer = self.coalescer
+        while True:
+            cuts = []
+            if coalescer.due() and self._queue.empty():
+                cuts.append(coalescer.cut())
+            try:
+                item = await asyncio.wait_for(self._queue.get(), coalescer.timeout())
+            except asyncio.TimeoutError:
+                cuts.append(coalescer.cut())
+            else:
+                if item is None:
+                    break
+                cuts.extend(coalescer.add(*item))
+
+            for request in cuts:
+                payload = self.encoder.encode(self._sending(request))
+                if payload:
+                    yield speech.StreamingRecognizeRequest(audio_content=payload)
+
+        if coalescer.pending:
+            payload = self.encoder.encode(self._sending(coalescer.cut()))
+            if payload:
+                yield speech.StreamingRecognizeRequest(audio_content=payload)
+        payload = self.encoder.finish()
+        if payload:
+            yield speech.StreamingRecognizeRequest(audio_content=payload)
+
+
+class FinalMerger:
+    """Stitches final results from overlapping recognizer streams together.
+
+    Streams are merged in order of their index. Finals from a newer stream
+    wait until every older stream has finished. A newer stream begins with
+    audio the older one already transcribed, so a final that starts before
+    the older streams' transcript ends is aligned, word by word, with the
+    transcript's last `window` words, and only the words past the overlap
+    are passed on. When no alignment is convincing, the words are placed by
+    time instead: by their time offsets if the final has them, else spread
+    evenly over it. A segment starts where its final did, or where the
+    previous segment ended if that is later, so times never go backwards
+    and pauses keep their length.
+    """
+
+    WORD = re.compile(r"\w+(?:'\w+)*")
+    MIN_SCORE = 4  # alignment score that counts as an overlap: two words more or less
+
+    def __init__(self, emit, window=STITCH_WINDOW):
+        self._emit = emit
+        self.window = window
+        self._lock = threading.Lock()
+        self._pending = collections.defaultdict(list)
+        self._finished = set()
+        self._tail = collections.deque(maxlen=window)
+        self.head = 0
+        self.last_end = 0
+        self._stream = None  # index of the stream the last segment came from
+        self._seam = 0  # where the transcript of older streams ends
+        self.dropped = 0
+        self.trimmed = 0
+
+    def is_primary(self, index):
+        """Whether the stream's interim results are the ones to show."""
+        return index == self.head
+
+    def add(self, index, start_ms, end_ms, transcript, confidence=0.0, word_starts=None):
+        """Add a final spanning `start_ms` to `end_ms` on the meeting clock.
+
+        `word_starts` holds when each word began, from the word time offsets.
+        """
+        with self._lock:
+            if index == self.head:
+                self._accept(index, start_ms, end_ms, transcript, confidence, word_starts)
+            else:
+                self._pending[index].append(
+                    (start_ms, end_ms, transcript, confidence, word_starts))
+
+    def finish(self, index):
+        with self._lock:
+            self._finished.add(index)
+            while self.head in self._finished:
+                self._finished.discard(self.head)
+                self.head += 1
+                for final in self._pending.pop(self.head, ()):
+                    self._accept(self.head, *final)
+
+    def _accept(self, index, start_ms, end_ms, transcript, confidence, word_starts):
+        if index != self._stream:
+            self._stream = index
+            self._seam = self.last_end
+        words = list(self.WORD.finditer(transcript))
+        repeated = 0
+        if start_ms < self._seam and words:
+            repeated = self._overlap(words, start_ms, end_ms, word_starts)
+        if repeated == len(words):
+            self.dropped += 1
+            return
+        if repeated:
+            self.trimmed += repeated
+            lead = transcript[:len(transcript) - len(transcript.lstrip())]
+            transcript = lead + transcript[words[repeated].start():]
+
+        end_ms = max(end_ms, self.last_end)
+        self._emit(index, max(start_ms, self.last_end), end_ms, transcript, confidence)
+        self.last_end = end_ms
+        self._tail.extend(word.group().casefold() for word in words[repeated:])
+
+    def _overlap(self, words, start_ms, end_ms, word_starts=None):
+        """How many of the leading `words` the transcript already has."""
+        if word_starts is None or len(word_starts) != len(words):
+            # Spread evenly, with each word placed at its centre.
+            word_ms = max(1, end_ms - start_ms) / len(words)
+            word_starts = [start_ms + (i + 0.5) * word_ms for i in range(len(words))]
+        # By time, the words begun before the older streams' transcript ends
+        # are repeats.
+        by_time = sum(start < self._seam for start in word_starts)
+
+        keys = [word.group().casefold() for word in words[:self.window]]
+        count, score = _align_overlap(self._tail, keys)
+        if not (score >= self.MIN_SCORE or score > 0 and abs(count - by_time) <= 1):
+            count = by_time
+        # A last repeat that runs past the seam and disagrees with the
+        # transcript's last word was likely cut short when the older stream
+        # ended: keep the newer stream's copy.
+        if 0 < count <= len(keys) and self._tail and keys[count - 1] != self._tail[-1]:
+            if (word_starts[count] if count < len(words) else end_ms) > self._seam:
+                count -= 1
+        return count
+
+
+def _align_overlap(tail, words):
+    """Align the end of `tail` with the start of `words`.
+
+    Scores 2 for each matching word and -1 for each mismatch or word left
+    out on either side. Returns (count, score) for the best alignment of a
+    suffix of `tail` with the first `count` of `words`, preferring the
+    shortest on a tie. Takes len(tail) * len(words) steps.
+    """
+    row = [-b for b in range(len(words) + 1)]
+    for word in tail:
+        # Any suffix may start here for free.
+        previous, row = row, [0]
+        for b, candidate in enumerate(words, 1):
+            row.append(max(previous[b - 1] + (2 if word == candidate else -1),
+                           previous[b] - 1, row[b - 1] - 1))
+    best = max(range(len(row)), key=lambda b: (row[b], -b))
+    return best, row[best]
+
+
+class EncoderStats:
+    """Upstream byte and CPU counters shared by the encoders of a session."""
+
+    def __init__(self):
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.cpu_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, bytes_in, bytes_out, cpu_seconds=0.0):
+        with self._lock:
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+            self.cpu_seconds += cpu_seconds
+
+    @property
+    def ratio(self):
+        return self.bytes_in / self.bytes_out if self.bytes_out else 0.0
+
+    def __str__(self):
+        return (f"{self.bytes_out} bytes sent for {self.bytes_in} bytes of audio "
+                f"({self.ratio:.1f}:1), {self.cpu_seconds:.2f} s CPU")
+
+
+class AudioEncoder:
+    """Sends LINEAR16 audio as is; the base for the compressed encodings.
+
+    One encoder serves one recognizer stream, since compressed streams start
+    with their own headers.
+    """
+
+    encoding = "LINEAR16"
+
+    def __init__(self, rate, stats=None):
+        self.rate = rate
+        self.stats = stats or EncoderStats()
+
+    @classmethod
+    def load(cls):
+        """Import the encoder's library; RuntimeError if it is not installed."""
+        return None
+
+    def encode(self, chunk):
+        """Return the payload for one audio chunk, possibly empty."""
+        started = time.thread_time()
+        payload = self._encode(chunk)
+        self.stats.add(len(chunk), len(payload), time.thread_time() - started)
+        return payload
+
+    def finish(self):
+        """Return whatever the encoder still holds at the end of the stream."""
+        payload = self._finish()
+        self.stats.add(0, len(payload))
+        return payload
+
+    def encode_stream(self, audio_generator):
+        """Yield the encoded payloads for a stream's audio chunks."""
+        for chunk in audio_generator:
+            payload = self.encode(chunk)
+            if payload:
+                yield payload
+
+        payload = self.finish()
+        if payload:
+            yield payload
+
+    def _encode(self, chunk):
+        return chunk
+
+    def _finish(self):
+        return b""
+
+
+class FlacEncoder(AudioEncoder):
+    """Streams FLAC frames, lossless at roughly half the LINEAR16 bitrate."""
+
+    encoding = "FLAC"
+
+    def __init__(self, rate, stats=None, compression_level=5):
+        super().__init__(rate, stats)
+        pyflac = self.load()
+
+        self._frames = []
+        self._encoder = pyflac.StreamEncoder(
+            sample_rate=rate,
+            write_callback=self._on_frame,
+            compression_level=compression_level,
+            blocksize=CHUNK_SIZE,
+        )
+
+    @classmethod
+    def load(cls):
+        try:
+            import pyflac
+        except ImportError as e:
+            raise RuntimeError(f"{cls.encoding} needs pyflac: {e}") from e
+        return pyflac
+
+    def _on_frame(self, buffer, num_bytes, num_samples, current_frame):
+        self._frames.append(bytes(buffer))
+
+    def _take_frames(self):
+        payload = b"".join(self._frames)
+        self._frames.clear()
+        return payload
+
+    def _encode(self, chunk):
+        self._encoder.process(np.frombuffer(chunk, dtype=np.int16))
+        return self._take_frames()
+
+    def _finish(self):
+        self._encoder.finish()
+        return self._take_frames()
+
+
+class OggOpusEncoder(AudioEncoder):
+    """Streams 20 ms Opus frames in an Ogg container, one page per chunk."""
+
+    encoding = "OGG_OPUS"
+    PRE_SKIP = 312  # encoder lookahead, in 48 kHz samples
+    _CRC_TABLE = None
+
+    def __init__(self, rate, stats=None, bitrate=24000):
+        super().__init__(rate, stats)
+        opuslib = self.load()
+
+        self._opus = opuslib.Encoder(rate, 1, opuslib.APPLICATION_VOIP)
+        self._opus.bitrate = bitrate
+        self._frame_bytes = rate // 50 * 2
+        self._pending = bytearray()
+        self._serial = random.getrandbits(32)
+        self._sequence = 0
+        self._granule = self.PRE_SKIP
+        self._headers_sent = False
+
+    @classmethod
+    def load(cls):
+        try:
+            import opuslib
+        except Exception as e:
+            # opuslib raises a bare Exception when libopus itself is missing.
+            raise RuntimeError(f"{cls.encoding} needs opuslib and libopus: {e}") from e
+        return opuslib
+
+    @classmethod
+    def _crc(cls, data):
+        if cls._CRC_TABLE is None:
+            table = []
+            for i in range(256):
+                crc = i << 24
+                for _ in range(8):
+                    crc = ((crc << 1) ^ 0x04C11DB7 if crc & 0x80000000 else crc << 1) & 0xFFFFFFFF
+                table.append(crc)
+            cls._CRC_TABLE = table
+
+        crc = 0
+        table = cls._CRC_TABLE
+        for byte in data:
+            crc = ((crc << 8) & 0xFFFFFFFF) ^ table[(crc >> 24) ^ byte]
+        return crc
+
+    def _page(self, packets, header_type=0):
+        lacing = bytearray()
+        for packet in packets:
+            lacing += b"\xff" * (len(packet) // 255) + bytes((len(packet) % 255,))
+        page = bytearray(struct.pack(
+            "<4sBBqIIIB", b"OggS", 0, header_type, self._granule,
+            self._serial, self._sequence, 0, len(lacing)))
+        page += lacing
+        for packet in packets:
+            page += packet
+        struct.pack_into("<I", page, 22, self._crc(page))
+        self._sequence += 1
+        return bytes(page)
+
+    def _headers(self):
+        self._headers_sent = True
+        head = struct.pack("<8sBBHIhB", b"OpusHead", 1, 1, self.PRE_SKIP, self.rate, 0, 0)
+        vendor = b"stt-app"
+        tags = struct.pack("<8sI", b"OpusTags", len(vendor)) + vendor + struct.pack("<I", 0)
+        granule, self._granule = self._granule, 0
+        pages = self._page([head], header_type=0x02) + self._page([tags])
+        self._granule = granule
+        return pages
+
+    def _encode_frames(self):
+        packets = []
+        while len(self._pending) >= self._frame_bytes:
+            frame = bytes(self._pending[:self._frame_bytes])
+            del self._pending[:self._frame_bytes]
+            packets.append(self._opus.encode(frame, self._frame_bytes // 2))
+            self._granule += 960  # 20 ms at 48 kHz
+        return packets
+
+    def _encode(self, chunk):
+        payload = b"" if self._headers_sent else self._headers()
+        self._pending += chunk
+        packets = self._encode_frames()
+        if packets:
+            payload += self._page(packets)
+        return payload
+
+    def _finish(self):
+        if not self._headers_sent:
+            return b""
+        if self._pending:
+            self._pending += bytes(self._frame_bytes - len(self._pending))
+        return self._page(self._encode_frames(), header_type=0x04)
+
+
+AUDIO_ENCODERS = {
+    encoder.encoding: encoder
+    for encoder in (AudioEncoder, FlacEncoder, OggOpusEncoder)
+}
+
+
+def unavailable_encoders():
+    """Return {encoding: reason} for the encodings whose libraries do not load."""
+    unavailable = {}
+    for encoding, encoder in AUDIO_ENCODERS.items():
+        try:
+            encoder.load()
+        except RuntimeError as e:
+            unavailable[encoding] = str(e)
+    return unavailable
+
+
+def available_encoders():
+    """Return the encodings whose libraries can be loaded here."""
+    unavailable = unavailable_encoders()
+    return [encoding for encoding in AUDIO_ENCODERS if encoding not in unavailable]
+
+
+def create_speech_client(endpoint=None):
+    """Return a SpeechClient, using plaintext gRPC when a local endpoint is set."""
+    endpoint = endpoint or SPEECH_ENDPOINT
+    if not endpoint:
+        return speech.SpeechClient()
+
+    from google.cloud.speech_v1.services.speech.transports import SpeechGrpcTransport
+
+    channel = grpc.insecure_channel(endpoint)
+    return speech.SpeechClient(transport=SpeechGrpcTransport(channel=channel))
+
+
+def create_speech_async_client(endpoint=None):
+    """Like create_speech_client(), for the running event loop."""
+    endpoint = endpoint or SPEECH_ENDPOINT
+    if not endpoint:
+        return speech.SpeechAsyncClient()
+
+    from google.cloud.speech_v1.services.speech.transports import (
+        SpeechGrpcAsyncIOTransport)
+
+    channel = grpc.aio.insecure_channel(endpoint)
+    return speech.SpeechAsyncClient(transport=SpeechGrpcAsyncIOTransport(channel=channel))
+
+
+class _PooledClient:
+
+    def __init__(self, client):
+        self.client = client
+        self.users = 0
+        self.last_used = time.monotonic()
+        self.state = grpc.ChannelConnectivity.IDLE
+        client.transport.grpc_channel.subscribe(self._on_state, try_to_connect=True)
+
+    def _on_state(self, state):
+        self.state = state
+
+    @property
+    def healthy(self):
+        return self.state not in (grpc.ChannelConnectivity.TRANSIENT_FAILURE,
+                                  grpc.ChannelConnectivity.SHUTDOWN)
+
+    def close(self):
+        self.client.transport.grpc_channel.unsubscribe(self._on_state)
+        self.client.transport.close()
+
+
+class SpeechClientPool:
+    """SpeechClients whose gRPC channels are connected before they are needed.
+
+    warm() loads credentials and opens the channels on a background thread,
+    so no session pays for that on its critical path. One channel carries
+    many concurrent streams, so sessions and stream restarts share clients:
+    acquire() hands out the healthy client with the fewest users, replacing
+    any whose channel has failed. Clients unused for `idle_timeout` seconds
+    are closed, except for the last `keep_warm` of them.
+    """
+
+    def __init__(self, endpoint=None, size=CLIENT_POOL_SIZE,
+                 idle_timeout=CLIENT_IDLE_TIMEOUT, keep_warm=1, connect_timeout=10):
+        self.endpoint = endpoint
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.keep_warm = keep_warm
+        self.connect_timeout = connect_timeout
+        self._clients = []
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+
+    def warm(self):
+        threading.Thread(target=self._warm, daemon=True).start()
+        threading.Thread(target=self._evict_idle, daemon=True).start()
+
+    def _connect(self):
+        client = create_speech_client(self.endpoint)
+        grpc.channel_ready_future(client.transport.grpc_channel).result(
+            timeout=self.connect_timeout)
+        return _PooledClient(client)
+
+    def _warm(self):
+        while len(self._clients) < self.size and not self._closed.is_set():
+            try:
+                pooled = self._connect()
+            except grpc.FutureTimeoutError:
+                print('Speech client pool - could not connect, will connect on demand')
+                return
+            with self._lock:
+                self._clients.append(pooled)
+
+    def acquire(self):
+        with self._lock:
+            for pooled in [c for c in self._clients if not c.healthy and not c.users]:
+                self._clients.remove(pooled)
+                pooled.close()
+
+            healthy = [c for c in self._clients if c.healthy]
+            if healthy and (len(self._clients) >= self.size or not all(c.users for c in healthy)):
+                pooled = min(healthy, key=lambda c: c.users)
+                pooled.users += 1
+                return pooled.client
+
+        # Nothing warm is free; connect here rather than holding the lock.
+        pooled = self._connect()
+        pooled.users += 1
+        with self._lock:
+            self._clients.append(pooled)
+        return pooled.client
+
+    def release(self, client):
+        with self._lock:
+            for pooled in self._clients:
+                if pooled.client is client:
+                    pooled.users -= 1
+                    pooled.last_used = time.monotonic()
+
+    def _evict_idle(self):
+        while not self._closed.wait(min(60, self.idle_timeout)):
+            now = time.monotonic()
+            with self._lock:
+                idle = [c for c in self._clients
+                        if not c.users and now - c.last_used > self.idle_timeout]
+                for pooled in idle[:max(0, len(self._clients) - self.keep_warm)]:
+                    self._clients.remove(pooled)
+                    pooled.close()
+
+    def close(self):
+        self._closed.set()
+        with self._lock:
+            for pooled in self._clients:
+                pooled.close()
+            self._clients = []
+
+
+class TranscriptJournal:
+    """Append-only JSONL file of final results that survives a crash.
+
+    append() only queues a record, so recognizer threads never wait on the
+    disk. A writer thread group-commits the queue: one write and one fsync
+    per batch, every `flush_interval` ms or as soon as `max_batch` records
+    are waiting. A crash loses at most the records of the last interval.
+    close() writes what is queued; appending after it raises RuntimeError.
+    Before its first write the writer repairs a line torn by a crash and
+    reads the records back into `recovered`, then sets `loaded`, so opening
+    a long journal costs the caller nothing.
+    """
+
+    def __init__(self, path, flush_interval=JOURNAL_FLUSH_INTERVAL, max_batch=256):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.recovered = []
+        self.loaded = threading.Event()
+        self.appended = 0
+        self.committed = 0
+        self.syncs = 0
+        self._file = open(path, "ab")
+        self._pending = collections.deque()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._committed = threading.Condition()
+        self._closed = False
+        self._writer = threading.Thread(target=self._run, daemon=True)
+        self._writer.start()
+
+    def append(self, record):
+        with self._lock:
+            if self._closed:
+                raise RuntimeError(f"journal {self.path} is closed")
+            self._pending.append(record)
+            self.appended += 1
+        if len(self._pending) >= self.max_batch:
+            self._wakeup.set()
+
+    def flush(self):
+        """Wait until everything appended so far is on disk."""
+        target = self.appended
+        self._wakeup.set()
+        with self._committed:
+            self._committed.wait_for(lambda: self.committed >= target)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+        self._wakeup.set()
+        self._writer.join()
+        self._file.close()
+
+    def _run(self):
+        # The file is open for appending, so writes follow the repaired end.
+        self.recovered = self.recover(self.path, repair=True)
+        self.loaded.set()
+        while not self._closed or self._pending:
+            self._wakeup.wait(self.flush_interval / 1000)
+            self._wakeup.clear()
+            batch = []
+            while self._pending:
+                batch.append(self._pending.popleft())
+            if batch:
+                self._commit(batch)
+
+    def _commit(self, batch):
+        self._file.write(b"".join(
+            json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n"
+            for record in batch))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        with self._committed:
+            self.committed += len(batch)
+            self.syncs += 1
+            self._committed.notify_all()
+
+    @staticmethod
+    def recover(path, repair=False):
+        """Return the records in the journal at `path`, oldest first.
+
+        Reading stops at the first line that is cut short or does not parse,
+        which only a crash during a write leaves behind. With `repair` set,
+        the file is truncated there so new records follow intact ones.
+        """
+        records = []
+        good = 0
+        try:
+            with open(path, "rb") as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        break
+                    good += len(line)
+                torn = f.seek(0, os.SEEK_END) > good
+        except FileNotFoundError:
+            return records
+
+        if torn and repair:
+            print(f'Journal - dropped a torn record at byte {good} of {path}')
+            with open(path, "r+b") as f:
+                f.truncate(good)
+        return records
+
+    def adopt(self, meeting, sessions):
+        """Close recovered sessions whose transcript a new session carries on."""
+        for session, started in sessions:
+            self.append({"meeting": meeting, "session": session, "started": started,
+                         "finished": time.time(), "adopted": True})
+
+    @staticmethod
+    def rebuild(records):
+        """Return {meeting name: (TranscriptStore, sessions)} of the sessions cut short.
+
+        A session that finished, or was adopted, wrote a closing record with
+        a "finished" time; its finals are left out. `sessions` holds the
+        (session, started) keys a store was rebuilt from, for adopt().
+        """
+        sessions = {}
+        for record in records:
+            key = (record["session"], record.get("started"))
+            if "finished" in record:
+                sessions.pop(key, None)
+            else:
+                sessions.setdefault(key, []).append(record)
+
+        transcripts = {}
+        for key, session in sessions.items():
+            for record in session:
+                store, keys = transcripts.setdefault(record["meeting"], (TranscriptStore(), []))
+                if key not in keys:
+                    keys.append(key)
+                store.append(record["transcript"], record["start_ms"],
+                             record["end_ms"], record["restart"])
+        return transcripts
+
+
+class KeywordMatch:
+    """A keyword phrase found in one session's transcript.
+
+    `start` and `end` are character offsets into `transcript`; `end_ms` is
+    where the result carrying it ends on the capture clock.
+    """
+
+    def __init__(self, session, phrase, action, transcript, start, end, is_final, end_ms):
+        self.session = session
+        self.phrase = phrase
+        self.action = action
+        self.transcript = transcript
+        self.start = start
+        self.end = end
+        self.is_final = is_final
+        self.end_ms = end_ms
+
 
+class KeywordSpotter:
+    """Finds configured phrases in transcripts with an Aho-Corasick automaton.
 
-os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = "./gcp.json"
+    `phrases` maps each phrase to the action it triggers. The automaton
+    runs over words, so phrases only match whole words, and both sides are
+    casefolded. Each session scans its results through a scanner(), which
+    picks up where the previous interim result left off. Matches are handed
+    to the callbacks registered with on() on a dispatcher thread, so a slow
+    action never holds up recognition.
+    """
 
-def get_current_time():
-    """Return Current Time in MS."""
-    return int(round(time.time() * 1000))
+    WORD = re.compile(r"\w+(?:'\w+)*")
 
+    def __init__(self, phrases):
+        self.phrases = []
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [()]
+        for phrase, action in phrases.items():
+            words = [word.casefold() for word in self.WORD.findall(phrase)]
+            if not words:
+                continue
+            state = 0
+            for word in words:
+                if word not in self._goto[state]:
+                    self._goto[state][word] = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(())
+                state = self._goto[state][word]
+            self._out[state] += (len(self.phrases),)
+            self.phrases.append((phrase, action, len(words)))
 
-class ResumableMicrophoneStream:  # this class will generate microphone voice in real time
-    """Opens a recording stream as a generator yielding the audio chunks."""
+        # Breadth first, so every fail target is complete before it is used.
+        pending = collections.deque(self._goto[0].values())
+        while pending:
+            state = pending.popleft()
+            for word, child in self._goto[state].items():
+                self._fail[child] = self.step(self._fail[state], word)
+                self._out[child] += self._out[self._fail[child]]
+                pending.append(child)
 
-    def __init__(self, rate, chunk_size):
-        self._rate = rate
-        self.chunk_size = chunk_size
-        self._num_channels = 1
-        self._buff = queue.Queue()
-        self.closed = True
-        self.start_time = get_current_time()
-        self.restart_counter = 0
-        self.audio_input = []
-        self.last_audio_input = []
-        self.result_end_time = 0
-        self.is_final_end_time = 0
-        self.final_request_end_time = 0
-        self.bridging_offset = 0
-        self.last_transcript_was_final = False
-        self.new_stream = True
-        self._audio_interface = pyaudio.PyAudio()
-        self._audio_stream = self._audio_interface.open(
-            format=pyaudio.paInt16,
-            channels=self._num_channels,
-            rate=self._rate,
-            input=True,
-            frames_per_buffer=self.chunk_size,
-            # Run the audio stream asynchronously to fill the buffer object.
-            # This is necessary so that the input device's buffer doesn't
-            # overflow while the calling thread makes network requests, etc.
-            stream_callback=self._fill_buffer,
+        self._callbacks = collections.defaultdict(list)
+        self._matches = queue.Queue()
+        self._dispatcher = None
+        self._lock = threading.Lock()
+        self.dispatched = 0
+
+    @classmethod
+    def load(cls, path, phrases=EXIT_KEYWORDS):
+        """Spot `phrases` and those of a JSON {"phrase": "action"} file."""
+        with open(path, encoding="utf-8") as f:
+            return cls({**phrases, **json.load(f)})
+
+    def step(self, state, word):
+        """The state after `word`, which must be casefolded."""
+        goto = self._goto
+        while state and word not in goto[state]:
+            state = self._fail[state]
+        return goto[state].get(word, 0)
+
+    def on(self, action, callback):
+        """Call `callback(match)` for every KeywordMatch of `action`."""
+        self._callbacks[action].append(callback)
+
+    def scanner(self, session):
+        return KeywordScanner(self, session)
+
+    def dispatch(self, matches):
+        for match in matches:
+            self._matches.put(match)
+        with self._lock:
+            if self._dispatcher is None:
+                self._dispatcher = threading.Thread(target=self._dispatch, daemon=True)
+                self._dispatcher.start()
+
+    def _dispatch(self):
+        while True:
+            match = self._matches.get()
+            for callback in list(self._callbacks[match.action]):
+                try:
+                    callback(match)
+                except Exception as e:
+                    print(f'{match.session.name} - {match.action} on '
+                          f'"{match.phrase}" failed - {e}')
+            self.dispatched += 1
+
+
+class KeywordScanner:
+    """Incremental keyword matching over one session's results.
+
+    Interim results mostly extend the previous one, so only the words after
+    the first change are scanned again, resuming from the automaton state
+    saved after the last unchanged word. A match is reported once while
+    the result is interim; the final result reports every match in it, and
+    the next result resumes from the state after the final's last word, so
+    a phrase the recognizer split over two results still matches, with a
+    `start` of 0. Around a stream handover, finals and interims arrive from
+    different recognizer threads, so results are scanned one at a time.
+    """
+
+    def __init__(self, spotter, session):
+        self.spotter = spotter
+        self.session = session
+        self.words_scanned = 0
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self, carry=0):
+        self._carry = carry  # automaton state the result starts from
+        self._text = ""
+        self._starts = []  # offset of each scanned word
+        self._ends = []
+        self._states = []  # automaton state after each word
+        self._found = []  # (last word, phrase) of each match, in word order
+        self._reported = set()
+
+    def feed(self, transcript, is_final, end_ms=None):
+        """Scan a result and dispatch what it matches; return the matches."""
+        with self._lock:
+            matches = self._scan(transcript, is_final, end_ms)
+        if matches:
+            self.spotter.dispatch(matches)
+        return matches
+
+    def _scan(self, transcript, is_final, end_ms):
+        previous = self._text
+        if transcript.startswith(previous):
+            common = len(previous)
+        else:
+            common = _common_prefix(previous, transcript)
+        # A word touching the end of the common part may have changed.
+        kept = bisect.bisect_left(self._ends, common)
+        del self._starts[kept:], self._ends[kept:], self._states[kept:]
+        while self._found and self._found[-1][0] >= kept:
+            self._found.pop()
+
+        spotter = self.spotter
+        state = self._states[-1] if kept else self._carry
+        new = []
+        for word in spotter.WORD.finditer(transcript, self._ends[-1] if kept else 0):
+            state = spotter.step(state, word.group().casefold())
+            self._starts.append(word.start())
+            self._ends.append(word.end())
+            self._states.append(state)
+            for phrase in spotter._out[state]:
+                found = (len(self._ends) - 1, phrase)
+                self._found.append(found)
+                if found not in self._reported:
+                    new.append(found)
+        self.words_scanned += len(self._ends) - kept
+        self._text = transcript
+
+        if is_final:
+            new = self._found
+        else:
+            self._reported.update(new)
+        matches = []
+        for last, phrase in new:
+            text, action, length = spotter.phrases[phrase]
+            # A phrase begun in the previous result starts this one.
+            start = self._starts[last - length + 1] if last >= length - 1 else 0
+            matches.append(KeywordMatch(
+                self.session, text, action, transcript, start,
+                self._ends[last], is_final, end_ms))
+        if is_final:
+            self._reset(self._states[-1] if self._states else self._carry)
+        return matches
+
+
+def _common_prefix(a, b):
+    """Length of the longest common prefix of two strings."""
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[:middle] == b[:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+class TranscriptionSession:
+    """One meeting: a capture stream and the recognizer streams it feeds.
+
+    The session runs no capture loop of its own. Whoever owns it, normally a
+    SessionManager, hands it captured audio through pump(), which sends it
+    on and rolls the recognizer streams over as they age. Transcript lines
+    and interim results are posted to `updates`, a UIUpdateQueue or anything
+    with the same post_text/post_final/post_interim methods, and final
+    results also to `journal` if one is given. Once finish() has closed the
+    capture and every recognizer has delivered its last result, `finished`
+    is set and `on_finished(session)` called.
+    """
+
+    def __init__(self, session_id, name, stream, client, updates,
+                 encoding=AudioEncoder.encoding, journal=None, keywords=None):
+        self.id = session_id
+        self.name = name
+        self.stream = stream
+        self.client = client
+        self.updates = updates
+        self.encoding = encoding
+        self.journal = journal
+        self.state = "new"
+        self.started = time.time()  # with the id, tells the session's journal records apart
+        self.finals = 0
+        self.encoder_stats = EncoderStats()
+        self.merger = FinalMerger(self._post_merged_final)
+        self.keywords = keywords.scanner(self) if keywords is not None else None
+        self.streaming_config = speech.StreamingRecognitionConfig(
+            config=speech.RecognitionConfig(
+                encoding=speech.RecognitionConfig.AudioEncoding[encoding],
+                sample_rate_hertz=SAMPLE_RATE,
+                language_code="en-US",
+                max_alternatives=1,
+                enable_word_time_offsets=True,
+            ),
+            interim_results=True,
         )
+        self._current = None
+        self._upcoming = None
+        self._next_index = 0
+        self._retry_at = 0.0
+        self._listening = 0
+        self._lock = threading.Lock()
+        self.finished = threading.Event()
+        self.on_finished = None
 
-    def __enter__(self):
+    def start(self):
+        self.updates.post_text(f'{self.name} - Start recording.')
+        # self.updates.post_text("End (ms)       Transcript Results/Status")
+        self.updates.post_text(
+            "=====================================================")
+        self.stream.__enter__()
+        try:
+            self._current = self._open_recognizer()
+        except Exception:
+            # Nothing will read the capture, so close it again.
+            self.stream.__exit__(None, None, None)
+            raise
+        self.state = "running"
 
-        self.closed = False
-        return self
+    def stop(self):
+        """Stop capturing; the owner calls finish() once the audio is drained."""
+        if self.state == "running":
+            self.state = "stopping"
+        self.stream.stop()
 
-    def __exit__(self, type, value, traceback):
+    def pump(self, runs):
+        """Send (start, data) runs of captured audio to the recognizers."""
+        for start, data in runs:
+            if self._upcoming is not None and self._upcoming.failed:
+                # It is opened again on a later run, after the retry delay.
+                self._upcoming.close()
+                self._upcoming = None
+                self._retry_at = time.monotonic() + STREAM_RETRY_DELAY / 1000
+            if self._current.failed:
+                self._replace_failed(start)
+            current = self._current
+            # Streams are timed on the capture clock from their first audio,
+            # the replayed bridge included, so neither uneven runs nor a late
+            # reader stretch them.
+            age = current.time_map.age_ms(start)
 
-        self._audio_stream.stop_stream()
-        self._audio_stream.close()
-        self.closed = True
-        # Signal the generator to terminate so that the client's
-        # streaming_recognize method will not block the process termination.
-        self._buff.put(None)
-        self._audio_interface.terminate()
+            if (self._upcoming is None and age > STREAMING_LIMIT - STREAM_OVERLAP
+                    and time.monotonic() >= self._retry_at):
+                # Warm the next stream up before this one expires, starting
+                # with a replay of what followed its last final result.
+                self._upcoming = self._open_recognizer()
+                self._bridge(current, self._upcoming, start)
 
-    def _fill_buffer(self, in_data, *args, **kwargs):
-        """Continuously collect data from the audio stream, into the buffer."""
+            elif self._upcoming is not None and age > STREAMING_LIMIT:
+                print(f'{self.name} - stream {current.index} handed over to '
+                      f'{self._upcoming.index}')
+                current.close()
+                self._current, self._upcoming = self._upcoming, None
 
-        self._buff.put(in_data)
-        return None, pyaudio.paContinue
+            self._current.send(start, data)
+            if self._upcoming is not None:
+                self._upcoming.send(start, data)
 
-    def generator(self):
-        """Stream Audio from microphone to API and to local buffer"""
+    def _replace_failed(self, start):
+        """Take over from a failed current stream before `start` is sent."""
+        failed = self._current
+        failed.close()
+        if self._upcoming is not None:
+            # It already has the bridge and everything since.
+            print(f'{self.name} - stream {failed.index} handed over to '
+                  f'{self._upcoming.index} early')
+            self._current, self._upcoming = self._upcoming, None
+        elif time.monotonic() >= self._retry_at:
+            self._retry_at = time.monotonic() + STREAM_RETRY_DELAY / 1000
+            self._current = self._open_recognizer()
+            print(f'{self.name} - stream {failed.index} replaced by '
+                  f'{self._current.index}')
+            self._bridge(failed, self._current, start)
 
-        while not self.closed:
-            data = []
+    def _bridge(self, previous, recognizer, start):
+        """Replay to `recognizer` what followed the last final of `previous`."""
+        if previous.last_final is None:
+            bridge_start = previous.time_map.to_capture(0)
+        else:
+            bridge_start = previous.last_final
+        bridge_start = max(bridge_start, self.stream.audio_history.oldest)
+        bridge = self.stream.audio_history.view(bridge_start, start)
+        if bridge:
+            # The ring buffer is overwritten as capture goes on,
+            # so the bridge is copied out before it is queued.
+            recognizer.send(bridge_start, [b"".join(bridge)], replay=True)
+        if self.stream.metrics is not None:
+            self.stream.metrics.restarted(sum(len(piece) for piece in bridge))
 
-            if self.new_stream and self.last_audio_input:
+    def finish(self):
+        """Close the capture stream and end the recognizers' audio."""
+        self.stream.__exit__(None, None, None)
+        with self._lock:
+            self.state = "draining"
+            done = not self._listening
+        for recognizer in (self._current, self._upcoming):
+            if recognizer is not None:
+                recognizer.close()
+        if done:
+            self._finished()
 
-                chunk_time = STREAMING_LIMIT / len(self.last_audio_input)
+    def _finished(self):
+        self.state = "finished"
+        if self.stream.vad is not None:
+            print(f'{self.name} - VAD suppressed '
+                  f'{self.stream.vad.suppressed_seconds:.1f} s of silence')
+        buff = self.stream._buff
+        if buff.dropped_chunks or buff.downsampled_chunks or buff.lag_events:
+            print(f'{self.name} - capture overloaded: dropped '
+                  f'{buff.dropped_samples / SAMPLE_RATE:.1f} s, downsampled '
+                  f'{buff.downsampled_chunks} chunks, fell behind {buff.lag_events} '
+                  f'times, up to {buff.max_lag_ms} ms')
+        print(f'{self.name} - {self.encoding} - {self.encoder_stats}')
+        print(f'{self.name} - stitched streams dropped {self.merger.dropped} '
+              f'overlapping finals and {self.merger.trimmed} repeated words')
+        if self.journal is not None:
+            # Recovery skips the sessions that got this far.
+            self._journal({"finished": time.time()})
+        self.finished.set()
+        if self.on_finished is not None:
+            self.on_finished(self)
 
-                if chunk_time != 0:
+    def trigger(self, trigger, note=""):
+        """Act on a hardware button: "start" or "stop" talking, or "mark" now."""
+        if trigger == "start":
+            self.stream.muted = False
+        elif trigger == "stop":
+            self.stream.muted = True
+        elif trigger == "mark":
+            captured_ms = self.stream._buff.captured * 1000 // SAMPLE_RATE
+            self.updates.post_text(f'{captured_ms}: MARK' + (f' - {note}' if note else ''))
+        else:
+            raise ValueError(f"unknown trigger {trigger!r}")
 
-                    if self.bridging_offset < 0:
-                        self.bridging_offset = 0
+    def stalled(self):
+        """Whether the recognizer is more than the capture buffer behind.
 
-                    if self.bridging_offset > self.final_request_end_time:
-                        self.bridging_offset = self.final_request_end_time
+        The owner then stops pumping, and the audio waits in the capture
+        buffer, whose policy decides what to drop.
+        """
+        current = self._current
+        return current is not None and not current.failed and current.backlog_ms > CAPTURE_BUFFER
 
-                    chunks_from_ms = round(
-                        (self.final_request_end_time - self.bridging_offset)
-                        / chunk_time
-                    )
+    def backlog_ms(self):
+        """Captured audio not yet sent to the recognizer, in ms."""
+        backlog = self.stream._buff.lag_ms
+        if self._current is not None:
+            backlog += self._current.backlog_ms
+        return backlog
 
-                    self.bridging_offset = round(
-                        (len(self.last_audio_input) - chunks_from_ms) * chunk_time
-                    )
+    def status(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "state": self.state,
+            "stream": self._current.index if self._current is not None else None,
+            "audio_seconds": self.stream.audio_history.write_pos / SAMPLE_RATE,
+            "backlog": self.stream._buff.qsize(),
+            "lag_ms": self.stream._buff.lag_ms,
+            "dropped_seconds": self.stream._buff.dropped_samples / SAMPLE_RATE,
+            "finals": self.finals,
+        }
 
-                    for i in range(chunks_from_ms, len(self.last_audio_input)):
-                        data.append(self.last_audio_input[i])
+    def _open_recognizer(self):
+        index, self._next_index = self._next_index, self._next_index + 1
+        recognizer = RecognizerStream(
+            index, SAMPLE_RATE,
+            AUDIO_ENCODERS[self.encoding](SAMPLE_RATE, self.encoder_stats),
+            self.stream.metrics, self.stream.timeline)
+        with self._lock:
+            self._listening += 1
+        threading.Thread(target=self._run_recognizer, args=(recognizer,),
+                         daemon=True).start()
+        return recognizer
 
-                self.new_stream = False
+    def _run_recognizer(self, recognizer):
+        try:
+            # This blocks until the first response, so it runs on its own thread.
+            responses = self.client.streaming_recognize(
+                self.streaming_config, recognizer.requests())
+            self.listen_print_loop(responses, recognizer)
+        except exceptions.GoogleAPICallError as e:
+            print(f'{self.name} - stream {recognizer.index} failed - {e}')
+            recognizer.failed = True
+        except Exception as e:
+            # gRPC, the encoder or a response handler; the stream is as dead.
+            print(f'{self.name} - stream {recognizer.index} failed - {e!r}')
+            recognizer.failed = True
+        finally:
+            self._recognizer_done(recognizer)
 
-            # Use a blocking get() to ensure there's at least one chunk of
-            # data, and stop iteration if the chunk is None, indicating the
-            # end of the audio stream.
-            chunk = self._buff.get()
-            self.audio_input.append(chunk)
+    def _recognizer_done(self, recognizer):
+        self.merger.finish(recognizer.index)
+        with self._lock:
+            self._listening -= 1
+            done = self.state == "draining" and not self._listening
+        if done:
+            self._finished()
 
-            if chunk is None:
-                return
-            data.append(chunk)
-            # Now consume whatever other data's still buffered.
-            while True:
+    def _post_merged_final(self, index, start_ms, end_ms, transcript, confidence):
+        self.finals += 1
+        self.updates.post_final(transcript, start_ms, end_ms, index)
+        if self.keywords is not None:
+            self.keywords.feed(transcript, True, end_ms)
+        if self.journal is not None:
+            self._journal({
+                "restart": index,
+                "start_ms": start_ms,
+                "end_ms": end_ms,
+                "transcript": transcript,
+                "confidence": confidence,
+                "time": time.time(),
+                "archive": self.stream.archive and self.stream.archive.directory,
+            })
+
+    def _journal(self, record):
+        record = dict(meeting=self.name, session=self.id, started=self.started, **record)
+        try:
+            self.journal.append(record)
+        except RuntimeError as e:
+            print(f'{self.name} - not journaled - {e}')
+
+    def listen_print_loop(self, responses, recognizer):  # convert voice into text print the data
+        """Iterates through server responses and prints them.
+        The responses passed is a generator that will block until a response
+        is provided by the server.
+        Each response may contain multiple results, and each result may contain
+        multiple alternatives; for details, see https://goo.gl/tjCPAU.  Here we
+        print only the transcription for the top alternative of the top result.
+        In this case, responses are provided for interim results as well. Interim
+        results are shown while this recognizer is the oldest one still running;
+        final results go through the merger, which drops the ones a previous,
+        overlapping recognizer already produced.
+        """
+        for response in responses:
+            self._handle_response(response, recognizer)
+
+    def _handle_response(self, response, recognizer):
+        """Show one response and look for keywords in it."""
+        merger = self.merger
+
+        if not response.results:
+            return
+
+        result = response.results[0]
+
+        if not result.alternatives:
+            return
+
+        transcript = result.alternatives[0].transcript
+
+        result_seconds = 0
+        result_micros = 0
+
+        if result.result_end_time.seconds:
+            result_seconds = result.result_end_time.seconds
+
+        if result.result_end_time.microseconds:
+            result_micros = result.result_end_time.microseconds
+
+        # Place the result on the capture clock, which accounts for the
+        # replayed bridge and any silence the VAD kept out.
+        stream_time = (result_seconds * 1000) + (result_micros / 1000)
+        recognizer.coalescer.acknowledged(stream_time)
+        result_end = recognizer.time_map.to_capture(stream_time)
+        corrected_time = result_end * 1000 // SAMPLE_RATE
+        if recognizer.metrics is not None:
+            recognizer.metrics.result(recognizer.timeline, corrected_time, result.is_final)
+
+        if result.is_final:
+            print(f'{self.name} - FINAL - ', transcript)
+            # The word time offsets say where the final's speech began.
+            word_starts = [
+                recognizer.time_map.to_capture_ms(
+                    word.start_time.seconds * 1000 + word.start_time.microseconds / 1000)
+                for word in result.alternatives[0].words]
+            if word_starts:
+                started = word_starts[0]
+            elif recognizer.last_final is None:
+                started = recognizer.time_map.to_capture_ms(0)
+            else:
+                started = recognizer.last_final * 1000 // SAMPLE_RATE
+            merger.add(recognizer.index, started, corrected_time, transcript,
+                       result.alternatives[0].confidence, word_starts or None)
+            recognizer.last_final = result_end
+
+        elif merger.is_primary(recognizer.index):
+            # The API splits a hypothesis into results, most stable first.
+            parts = [(result.alternatives[0].transcript, result.stability)
+                     for result in response.results if result.alternatives]
+            hypothesis = "".join(transcript for transcript, stability in parts)
+            stable = 0
+            for transcript, stability in parts:
+                if stability < INTERIM_STABILITY:
+                    break
+                stable += len(transcript)
+            self.updates.post_interim(hypothesis, stable)
+            if self.keywords is not None:
+                self.keywords.feed(hypothesis, False, corrected_time)
+
+
+class SessionManager:
+    """Runs up to `max_sessions` transcription sessions side by side.
+
+    Sessions on the same capture device share one SharedAudioSource, and
+    each takes a client from `client_pool`. A single scheduler thread, not
+    one per session, moves captured audio into the sessions: it wakes when
+    any of them has audio and serves them round robin, at most `fair_share`
+    chunks each per turn, so a busy room cannot hold the others up and the
+    number of threads competing with Tk for the GIL stays flat. A session
+    whose recognizer has fallen behind is skipped until it catches up.
+    """
+
+    stream_class = ResumableMicrophoneStream
+    session_class = TranscriptionSession
+
+    def __init__(self, client_pool, max_sessions=MAX_SESSIONS,
+                 fair_share=SESSION_FAIR_SHARE, journal=None, archive_dir=None,
+                 keywords=None):
+        self.client_pool = client_pool
+        self.max_sessions = max_sessions
+        self.fair_share = fair_share
+        self.journal = journal
+        self.archive_dir = archive_dir
+        self.keywords = keywords if keywords is not None else KeywordSpotter(EXIT_KEYWORDS)
+        self.keywords.on("exit", self._exit_requested)
+        self.sessions = {}
+        self._devices = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._scheduler = None
+
+    def start_session(self, name, updates, device_index=None, source=None,
+                      encoding=AudioEncoder.encoding, vad=True):
+        """Start transcribing a meeting and return its session id.
+
+        Audio comes from `source` if given, otherwise from input device
+        `device_index`, shared with any other session capturing it.
+        """
+        session = self._create_session(name, updates, device_index, source,
+                                       encoding, vad)
+        session.stream.wakeup = self._wakeup
+
+        try:
+            session.client = self.client_pool.acquire()
+            session.start()
+        except Exception:
+            self._remove(session)
+            raise
+
+        with self._lock:
+            if self._scheduler is None:
+                self._scheduler = threading.Thread(target=self._schedule, daemon=True)
+                self._scheduler.start()
+        # Audio that arrived while the session was starting was skipped.
+        self._wakeup.set()
+        return session.id
+
+    def _create_session(self, name, updates, device_index, source, encoding, vad):
+        with self._lock:
+            if len(self.sessions) >= self.max_sessions:
+                raise RuntimeError(f'Already running {self.max_sessions} sessions')
+            device = None
+            if source is None:
+                device = device_index
+                shared = self._devices.get(device)
+                if shared is None:
+                    shared = self._devices[device] = SharedAudioSource(
+                        PyAudioSource(SAMPLE_RATE, CHUNK_SIZE, device_index=device_index))
+                source = shared.handle()
+            session_id = next(self._ids)
+            archive = None
+            if self.archive_dir is not None:
+                archive = AudioArchive(
+                    os.path.join(self.archive_dir,
+                                 time.strftime("%Y%m%d-%H%M%S-") + str(session_id)),
+                    SAMPLE_RATE, meeting=name)
+            stream = self.stream_class(
+                SAMPLE_RATE, CHUNK_SIZE, source,
+                VoiceActivityDetector(SAMPLE_RATE) if vad else None, archive)
+            session = self.session_class(session_id, name, stream, None, updates,
+                                         encoding, self.journal, self.keywords)
+            session.device = device
+            session.on_finished = self._remove
+            self.sessions[session.id] = session
+        return session
+
+    def stop_session(self, session_id):
+        session = self.sessions.get(session_id)
+        if session is not None:
+            session.stop()
+
+    def stop_all(self):
+        for session in list(self.sessions.values()):
+            session.stop()
+
+    def trigger(self, trigger, note="", session_id=None):
+        """Pass a hardware trigger to one session, or to all running ones."""
+        if session_id is not None:
+            sessions = [self.sessions[session_id]]
+        else:
+            sessions = list(self.sessions.values())
+        for session in sessions:
+            if session.state == "running":
+                session.trigger(trigger, note)
+
+    def _exit_requested(self, match):
+        if match.is_final:
+            match.session.updates.post_text("Exiting...")
+            match.session.stop()
+
+    def status(self):
+        return [session.status() for session in list(self.sessions.values())]
+
+    def _remove(self, session):
+        with self._lock:
+            self.sessions.pop(session.id, None)
+            shared = self._devices.get(session.device)
+            if shared is not None and not shared.users:
+                del self._devices[session.device]
+        if session.client is not None and self.client_pool is not None:
+            self.client_pool.release(session.client)
+
+    def _schedule(self):
+        stalled = False
+        while True:
+            # A stalled session is looked at again once a chunk's time has passed.
+            self._wakeup.wait(CHUNK_SIZE / SAMPLE_RATE if stalled else None)
+            self._wakeup.clear()
+            stalled = False
+            for session in list(self.sessions.values()):
+                if session.state in ("new", "draining", "finished"):
+                    continue
+                if session.stalled():
+                    stalled = True
+                    continue
                 try:
-                    chunk = self._buff.get(block=False)
+                    self._serve(session)
+                except Exception as e:
+                    # Only this session ends; the others keep the scheduler.
+                    self._abandon(session, e)
+
+    def _serve(self, session):
+        stream = session.stream
+        runs = stream.read_runs(block=False, max_chunks=self.fair_share, join=False)
+        if runs:
+            session.pump(runs)
+        if not stream._buff.empty():
+            # More than its share is waiting; come back after the others.
+            self._wakeup.set()
+        elif stream.closed:
+            session.finish()
+
+    def _abandon(self, session, error):
+        print(f'{session.name} - stopped after an error - {error!r}')
+        session.updates.post_text(f'{session.name} - Stopped: {error}')
+        try:
+            session.stop()
+            session.finish()
+        except Exception as e:
+            print(f'{session.name} - could not finish - {e!r}')
+            session.state = "finished"
+            self._remove(session)
+
+
+class AsyncTranscriptionSession(TranscriptionSession):
+    """TranscriptionSession run by coroutines on one event loop.
+
+    Once started, run() reads the capture stream and pumps it; each
+    recognizer stream is a task that produces its requests and consumes its
+    responses. stop() lets the audio drain and the finals arrive, while
+    cancelling run() abandons the session and its recognizers at once.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._tasks = set()
 
-                    if chunk is None:
+    async def run(self):
+        try:
+            async for runs in self.stream.runs(join=False):
+                self.pump(runs)
+                while self.stalled():
+                    await asyncio.sleep(CHUNK_SIZE / SAMPLE_RATE)
+        except asyncio.CancelledError:
+            for task in self._tasks:
+                task.cancel()
+            raise
+        finally:
+            self.finish()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def _open_recognizer(self):
+        index, self._next_index = self._next_index, self._next_index + 1
+        recognizer = AsyncRecognizerStream(
+            index, SAMPLE_RATE,
+            AUDIO_ENCODERS[self.encoding](SAMPLE_RATE, self.encoder_stats),
+            self.stream.metrics, self.stream.timeline)
+        with self._lock:
+            self._listening += 1
+        task = asyncio.get_running_loop().create_task(self._run_recognizer(recognizer))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return recognizer
+
+    async def _run_recognizer(self, recognizer):
+        try:
+            responses = await self.client.streaming_recognize(
+                requests=recognizer.requests(self.streaming_config))
+            async for response in responses:
+                self._handle_response(response, recognizer)
+        except exceptions.GoogleAPICallError as e:
+            print(f'{self.name} - stream {recognizer.index} failed - {e}')
+            recognizer.failed = True
+        except Exception as e:
+            # Cancellation is not an Exception, so it still goes through.
+            print(f'{self.name} - stream {recognizer.index} failed - {e!r}')
+            recognizer.failed = True
+        finally:
+            self._recognizer_done(recognizer)
+
+
+class AsyncSessionManager(SessionManager):
+    """SessionManager whose sessions all run on one asyncio event loop.
+
+    Given no `loop`, the manager runs one on a thread of its own, and the
+    methods may be called from any other thread, such as Tk's. Coroutines
+    already on the loop call open_session() and aclose() instead. All
+    sessions share one SpeechAsyncClient, since a channel carries many
+    concurrent streams.
+    """
+
+    stream_class = AsyncMicrophoneStream
+    session_class = AsyncTranscriptionSession
+
+    def __init__(self, endpoint=None, max_sessions=MAX_SESSIONS, journal=None,
+                 archive_dir=None, keywords=None, loop=None):
+        super().__init__(None, max_sessions, journal=journal, archive_dir=archive_dir,
+                         keywords=keywords)
+        self.endpoint = endpoint
+        self.client = None
+        self._running = {}
+        self._loop = loop
+        if loop is None:
+            self._loop = asyncio.new_event_loop()
+            threading.Thread(target=self._loop.run_forever, daemon=True).start()
+
+    def start_session(self, name, updates, device_index=None, source=None,
+                      encoding=AudioEncoder.encoding, vad=True):
+        session = asyncio.run_coroutine_threadsafe(
+            self.open_session(name, updates, device_index, source, encoding, vad),
+            self._loop).result()
+        return session.id
+
+    async def open_session(self, name, updates, device_index=None, source=None,
+                           encoding=AudioEncoder.encoding, vad=True):
+        """Start a session on the running loop and return it.
+
+        Its run() task is `session.task`.
+        """
+        if self.client is None:
+            self.client = create_speech_async_client(self.endpoint)
+        session = self._create_session(name, updates, device_index, source,
+                                       encoding, vad)
+        session.client = self.client
+        try:
+            session.start()
+        except Exception:
+            self._remove(session)
+            raise
+        session.task = self._loop.create_task(session.run())
+        self._running[session.id] = session.task
+        session.task.add_done_callback(lambda task: self._running.pop(session.id, None))
+        return session
+
+    def cancel_session(self, session_id):
+        """Abandon a session without waiting for its pending results."""
+        task = self._running.get(session_id)
+        if task is not None:
+            self._loop.call_soon_threadsafe(task.cancel)
+
+    async def aclose(self):
+        """Cancel every session and close the client."""
+        tasks = list(self._running.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self.client is not None:
+            await self.client.transport.close()
+            self.client = None
+
+    def close(self):
+        asyncio.run_coroutine_threadsafe(self.aclose(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+class _ClientEvents:
+    """Transcript updates for one server client, as JSON messages.
+
+    Stands in for UIUpdateQueue: sessions post from the event loop or from
+    the keyword dispatcher thread, and send_to() writes the messages to the
+    client's socket in order. Like the GUI, a slow client only gets the
+    latest interim result, and a final drops any interim still pending.
+    """
+
+    def __init__(self, loop):
+        self._loop = loop
+        self._messages = collections.deque()
+        self._interim = None
+        self._lock = threading.Lock()
+        self._ready = asyncio.Event()
+        self.coalesced = 0
+
+    def _post(self, message):
+        with self._lock:
+            if message["type"] == "interim":
+                if self._interim is not None:
+                    self.coalesced += 1
+                self._interim = message
+            else:
+                if message["type"] == "final" and self._interim is not None:
+                    self._interim = None
+                    self.coalesced += 1
+                self._messages.append(message)
+        self._loop.call_soon_threadsafe(self._ready.set)
+
+    def post_text(self, text):
+        self._post({"type": "status", "text": text})
+
+    def post_final(self, text, start_ms, end_ms, restart):
+        self._post({"type": "final", "text": text, "start_ms": start_ms,
+                    "end_ms": end_ms, "restart": restart})
+
+    def post_interim(self, text, stable=0):
+        self._post({"type": "interim", "text": text, "stable": stable})
+
+    def close(self):
+        """Send what is pending, then the end of the transcript."""
+        self._post({"type": "end"})
+
+    async def send_to(self, websocket):
+        from websockets.exceptions import ConnectionClosed
+
+        while True:
+            await self._ready.wait()
+            self._ready.clear()
+            with self._lock:
+                messages = list(self._messages)
+                self._messages.clear()
+                if self._interim is not None:
+                    # The interim was posted after any queued final.
+                    messages.append(self._interim)
+                    self._interim = None
+            try:
+                for message in messages:
+                    await websocket.send(json.dumps(message))
+                    if message["type"] == "end":
                         return
-                    data.append(chunk)
-                    self.audio_input.append(chunk)
+            except ConnectionClosed:
+                return
 
-                except queue.Empty:
-                    break
 
-            yield b"".join(data)
+class TranscriptionServer:
+    """Serves live transcription to network clients over WebSocket.
+
+    A client connects to /stream?name=<meeting>&vad=<0|1>, sends 16-bit
+    mono PCM at SAMPLE_RATE as binary messages of any size, and the text
+    message "end" once its audio is over. It receives JSON messages:
+    {"type": "interim", "text", "stable"} for the live hypothesis,
+    {"type": "final", "text", "start_ms", "end_ms", "restart"} for each
+    final result, {"type": "status", "text"} for session notices and
+    {"type": "end"} once the last final is in, after which the server
+    closes the connection. GET /status returns the sessions as JSON.
+
+    Each client is an AsyncTranscriptionSession on the server's event loop.
+    Audio is read from a client only while its session has less than
+    `max_backlog` ms waiting to be sent, so a client sending faster than
+    the recognizer takes it is slowed down by TCP flow control rather than
+    buffered. Clients beyond `max_streams` are turned away with HTTP 503.
+    """
+
+    def __init__(self, host="localhost", port=SERVER_PORT, endpoint=None,
+                 max_streams=SERVER_MAX_STREAMS, max_backlog=SERVER_MAX_BACKLOG,
+                 journal=None, keywords=None):
+        self.host = host
+        self.port = port
+        self.endpoint = endpoint
+        self.max_streams = max_streams
+        self.max_backlog = max_backlog
+        self.journal = journal
+        self.keywords = keywords
+        self.manager = None
+        self.rejected = 0
+        self._server = None
+
+    async def start(self):
+        from websockets.asyncio.server import serve
+
+        self.manager = AsyncSessionManager(
+            self.endpoint, self.max_streams, journal=self.journal,
+            keywords=self.keywords, loop=asyncio.get_running_loop())
+        self._server = await serve(self._handle, self.host, self.port,
+                                   process_request=self._process_request)
+        # Port 0 picks a free one.
+        self.port = self._server.sockets[0].getsockname()[1]
+        print(f'Serving transcription on ws://{self.host}:{self.port}/stream')
+
+    async def close(self):
+        self._server.close()
+        await self._server.wait_closed()
+        await self.manager.aclose()
+
+    async def run(self):
+        await self.start()
+        try:
+            await self._server.serve_forever()
+        finally:
+            await self.close()
+
+    def _process_request(self, connection, request):
+        path = urllib.parse.urlsplit(request.path).path
+        if path == "/status":
+            response = connection.respond(200, json.dumps(self.manager.status()) + "\n")
+            del response.headers["Content-Type"]
+            response.headers["Content-Type"] = "application/json"
+            return response
+        if path != "/stream":
+            return connection.respond(404, "Not found\n")
+        if len(self.manager.sessions) >= self.max_streams:
+            self.rejected += 1
+            return connection.respond(503, f"Already serving {self.max_streams} streams\n")
+        return None
+
+    async def _handle(self, websocket):
+        from websockets.exceptions import ConnectionClosed
+
+        query = urllib.parse.parse_qs(urllib.parse.urlsplit(websocket.request.path).query)
+        name = query.get("name", [f"client {websocket.id.hex[:8]}"])[0]
+        vad = query.get("vad", ["1"])[0] not in ("0", "false", "no")
+
+        source = PushAudioSource(SAMPLE_RATE, CHUNK_SIZE)
+        events = _ClientEvents(asyncio.get_running_loop())
+        try:
+            session = await self.manager.open_session(name, events, source=source, vad=vad)
+        except RuntimeError as e:
+            # Another client took the last stream after the handshake.
+            self.rejected += 1
+            await websocket.close(1013, str(e))
+            return
+        sender = asyncio.create_task(events.send_to(websocket))
+
+        try:
+            async for message in websocket:
+                if isinstance(message, str):
+                    if message == "end":
+                        break
+                    continue
+                source.push(message)
+                while session.backlog_ms() > self.max_backlog and session.state == "running":
+                    await asyncio.sleep(0.02)
+                if session.state != "running":
+                    break  # ended by a keyword
+            if session.state == "running":
+                source.end()
+            await session.task
+        except ConnectionClosed:
+            # The client is gone; nobody is waiting for its finals.
+            session.task.cancel()
+            await asyncio.gather(session.task, return_exceptions=True)
+        except asyncio.CancelledError:
+            session.task.cancel()
+            raise
+        finally:
+            events.close()
+            await asyncio.gather(sender, return_exceptions=True)
+        await websocket.close()
+
+
+def read_audio_file(path, rate=SAMPLE_RATE):
+    """Return the 16-bit mono PCM of a WAV or FLAC file recorded at `rate`.
+
+    WAV samples are a view into a memory map rather than a copy.
+    """
+    if path.lower().endswith(".flac"):
+        import pyflac  # optional, only needed for FLAC input
+
+        data, file_rate = pyflac.FileDecoder(path).process()
+        if file_rate != rate or (data.ndim > 1 and data.shape[1] != 1):
+            raise ValueError(f"{path}: expected mono audio at {rate} Hz")
+        return data.astype("<i2").tobytes()
+
+    source = FileAudioSource(path, rate, CHUNK_SIZE)
+    return memoryview(source._map)[source._start:source._end]
+
+
+def audio_file_samples(path, rate=SAMPLE_RATE):
+    """Return the length in samples of a file read_audio_file() accepts.
+
+    Only the header is read, unless a FLAC file leaves its length out.
+    """
+    if path.lower().endswith(".flac"):
+        with open(path, "rb") as f:
+            header = f.read(26)
+        # "fLaC", then the STREAMINFO block: its rate, channels, sample size
+        # and sample count share 8 bytes after the block and frame sizes.
+        if len(header) < 26 or header[:4] != b"fLaC" or header[4] & 0x7F != 0:
+            raise ValueError(f"{path}: not a FLAC file")
+        info = int.from_bytes(header[18:26], "big")
+        if info >> 44 != rate or info >> 41 & 0x7 != 0 or info >> 36 & 0x1F != 15:
+            raise ValueError(f"{path}: expected 16-bit mono audio at {rate} Hz")
+        samples = info & 0xFFFFFFFFF
+        return samples or len(read_audio_file(path, rate)) // 2
+
+    source = FileAudioSource(path, rate, CHUNK_SIZE)
+    samples = (source._end - source._start) // 2
+    source.close()
+    return samples
+
+
+class _BatchFile:
+    """Progress of one file through BatchTranscriber.
+
+    The audio is read when the first window needs it and let go once the
+    file is done or has failed, so only the files in progress are held.
+    """
+
+    def __init__(self, path, output, windows):
+        self.path = path
+        self.output = output
+        self.partial = output + ".partial"
+        self.pcm = None
+        self.windows = windows
+        self.name = os.path.splitext(os.path.basename(path))[0]
+        self.records = []
+        self.remaining = set(range(len(windows)))
+        self.failed = False
+        self.merger = FinalMerger(self._add_record)
+        self._lock = threading.Lock()
+
+    def _add_record(self, index, start_ms, end_ms, transcript, confidence):
+        self.records.append({
+            "meeting": self.name,
+            "session": None,
+            "restart": index,
+            "start_ms": start_ms,
+            "end_ms": end_ms,
+            "transcript": transcript,
+            "confidence": confidence,
+        })
+
+    def audio(self):
+        """Return the file's PCM, reading it on first use."""
+        with self._lock:
+            if self.pcm is None:
+                self.pcm = read_audio_file(self.path)
+            return self.pcm
+
+    def resume(self):
+        """Replay the windows a previous run finished; return how many."""
+        for record in TranscriptJournal.recover(self.partial, repair=True):
+            self.window_done(record["window"], record["finals"], save=False)
+        return len(self.windows) - len(self.remaining)
+
+    def window_done(self, index, finals, save=True):
+        """Merge a window's finals; return True once the whole file is done."""
+        with self._lock:
+            if index not in self.remaining:
+                return False
+            if save:
+                with open(self.partial, "a", encoding="utf-8") as f:
+                    f.write(json.dumps({"window": index, "finals": finals}) + "\n")
+            start_ms = self.windows[index][0] * 1000 // SAMPLE_RATE
+            for end_ms, transcript, confidence in finals:
+                self.merger.add(index, start_ms, end_ms, transcript, confidence)
+                start_ms = end_ms
+            self.merger.finish(index)
+            self.remaining.discard(index)
+            if self.remaining:
+                return False
+
+        # Publish the transcript in one step, so an output file is complete.
+        with open(self.output + ".tmp", "w", encoding="utf-8") as f:
+            for record in self.records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        os.replace(self.output + ".tmp", self.output)
+        os.remove(self.partial)
+        self.pcm = None
+        return True
+
+
+class BatchTranscriber:
+    """Transcribes recorded meetings with a bounded pool of workers.
+
+    Each file is cut into windows of `window` ms that overlap by `overlap`
+    ms, which keeps every request under the streaming limit. Up to
+    `workers` windows are transcribed at the same time, across all files.
+    Each window gets a StreamTimeMap, and the windows of a file go through
+    a FinalMerger, exactly like the recognizer streams of a live meeting.
+    Every file's finals are written to `<output_dir>/<name>.jsonl`, in the
+    journal's record format. A file with an output is skipped, and windows
+    finished by an interrupted run are not sent again.
+    """
+
+    AUDIO_EXTENSIONS = (".wav", ".flac")
+
+    def __init__(self, client, output_dir, workers=BATCH_WORKERS,
+                 window=STREAMING_LIMIT, overlap=STREAM_OVERLAP,
+                 encoding=AudioEncoder.encoding, retries=5):
+        self.client = client
+        self.output_dir = output_dir
+        self.workers = workers
+        self.window = window * SAMPLE_RATE // 1000
+        self.overlap = overlap * SAMPLE_RATE // 1000
+        self.encoding = encoding
+        self.retries = retries
+        self.encoder_stats = EncoderStats()
+        self.streaming_config = speech.StreamingRecognitionConfig(
+            config=speech.RecognitionConfig(
+                encoding=speech.RecognitionConfig.AudioEncoding[encoding],
+                sample_rate_hertz=SAMPLE_RATE,
+                language_code="en-US",
+                max_alternatives=1,
+            ),
+        )
+        self.files_done = 0
+        self.files_failed = 0
+        self.audio_seconds = 0.0
+        self.retried = 0
+        self._lock = threading.Lock()
+
+    def find_files(self, directory):
+        return sorted(
+            os.path.join(directory, name) for name in os.listdir(directory)
+            if name.lower().endswith(self.AUDIO_EXTENSIONS))
+
+    def run(self, paths):
+        """Transcribe the files; return how many were done in this run."""
+        os.makedirs(self.output_dir, exist_ok=True)
+        jobs = []
+        for path in paths:
+            output = os.path.join(
+                self.output_dir, os.path.splitext(os.path.basename(path))[0] + ".jsonl")
+            if os.path.exists(output):
+                print(f'{path} - already transcribed')
+                continue
+            try:
+                samples = audio_file_samples(path)
+            except ValueError as e:
+                print(f'Skipping {e}')
+                self.files_failed += 1
+                continue
+            batch_file = _BatchFile(path, output, self._windows(samples))
+            resumed = batch_file.resume()
+            if resumed:
+                print(f'{path} - resuming after {resumed} of '
+                      f'{len(batch_file.windows)} windows')
+            if not batch_file.remaining:
+                self.files_done += 1
+            jobs.extend((batch_file, index) for index in sorted(batch_file.remaining))
+
+        with futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for _ in executor.map(self._run_window, jobs):
+                pass
+        return self.files_done
+
+    def _windows(self, samples):
+        """(start, end) sample ranges covering `samples` with overlap."""
+        step = self.window - self.overlap
+        windows = [(start, min(start + self.window, samples))
+                   for start in range(0, max(1, samples - self.overlap), step)]
+        return windows or [(0, samples)]
+
+    def _run_window(self, job):
+        batch_file, index = job
+        if batch_file.failed:
+            return
+        start, end = batch_file.windows[index]
+        time_map = StreamTimeMap(SAMPLE_RATE)
+        time_map.add(start, end - start)
+        try:
+            pcm = batch_file.audio()
+        except (ValueError, OSError) as e:
+            self._fail(batch_file, index, e)
+            return
+
+        for attempt in range(self.retries + 1):
+            try:
+                finals = self._recognize(pcm, start, end, time_map)
+                break
+            except (exceptions.ResourceExhausted, exceptions.ServiceUnavailable) as e:
+                if attempt == self.retries:
+                    self._fail(batch_file, index, e)
+                    return
+                # Over the concurrency quota; back off and try again.
+                with self._lock:
+                    self.retried += 1
+                time.sleep(min(30, 2 ** attempt) * (0.5 + random.random()))
+            except Exception as e:
+                # An API error, or an encoder that cannot run: only this file fails.
+                self._fail(batch_file, index, e)
+                return
+
+        with self._lock:
+            self.audio_seconds += (end - start) / SAMPLE_RATE
+        if batch_file.window_done(index, finals):
+            with self._lock:
+                self.files_done += 1
+            print(f'{batch_file.path} - {len(batch_file.records)} finals')
+
+    def _fail(self, batch_file, index, error):
+        print(f'{batch_file.path} - window {index} failed - {error}')
+        with self._lock:
+            if not batch_file.failed:
+                batch_file.failed = True
+                self.files_failed += 1
+        # Windows still in flight keep their own reference.
+        batch_file.pcm = None
+
+    def _recognize(self, pcm, start, end, time_map):
+        def chunks():
+            for pos in range(start, end, CHUNK_SIZE):
+                yield bytes(pcm[pos * 2:min(pos + CHUNK_SIZE, end) * 2])
+
+        encoder = AUDIO_ENCODERS[self.encoding](SAMPLE_RATE, self.encoder_stats)
+        requests = (
+            speech.StreamingRecognizeRequest(audio_content=content)
+            for content in encoder.encode_stream(chunks())
+        )
+        finals = []
+        for response in self.client.streaming_recognize(self.streaming_config, requests):
+            for result in response.results:
+                if result.is_final and result.alternatives:
+                    alternative = result.alternatives[0]
+                    end_ms = time_map.to_capture_ms(
+                        result.result_end_time.total_seconds() * 1000)
+                    finals.append([end_ms, alternative.transcript, alternative.confidence])
+        return finals
 
 
 # class BackgroundTask():
@@ -167,22 +3559,298 @@ class ResumableMicrophoneStream:  # this class will generate microphone voice in
 
 
 class SerialThread(threading.Thread):
+    """Reads trigger lines from a serial device into the transcription sessions.
 
-    def __init__(self, queue, sp):
-        threading.Thread.__init__(self)
-        self.queue = queue
-        self.event = threading.Event() # An event object.
-        self.ser_handle = sp;
+    The device sends one line per button event: START and STOP for push to
+    talk or mute, MARK with an optional note to mark the moment. The thread
+    blocks in read() until bytes arrive, frames lines in one reused buffer
+    and calls `sessions.trigger()` as soon as a line is complete, so nothing
+    runs while the buttons are idle. stop() cancels the pending read.
+    """
+
+    def __init__(self, ser_handle, sessions, triggers=SERIAL_TRIGGERS,
+                 max_line=SERIAL_MAX_LINE):
+        super().__init__(daemon=True)
+        self.ser_handle = ser_handle
+        self.sessions = sessions
+        self.triggers = triggers
+        self.max_line = max_line
+        self.event = threading.Event()
+        self.reads = 0
+        self.ignored = 0
+        self._line = bytearray()
 
     def stop(self):
         self.event.set()
+        self.ser_handle.cancel_read()
 
     def run(self):
-        while not self.event.isSet():
-            if self.ser_handle.inWaiting():
-                text = self.ser_handle.readline(self.ser_handle.inWaiting())
-                self.queue.put(text)
-            time.sleep(0.2) 
+        # No timeout: read() returns with the first byte, or when cancelled.
+        self.ser_handle.timeout = None
+        while not self.event.is_set():
+            data = self.ser_handle.read(max(1, self.ser_handle.in_waiting))
+            self.reads += 1
+            if data:
+                self._received(data)
+
+    def _received(self, data):
+        line = self._line
+        line += data
+        start = 0
+        while True:
+            end = line.find(b"\n", start)
+            if end < 0:
+                break
+            self._dispatch(line[start:end])
+            start = end + 1
+        del line[:start]
+        if len(line) > self.max_line:
+            # No newline in sight; drop the noise rather than grow.
+            self.ignored += 1
+            line.clear()
+
+    def _dispatch(self, raw):
+        command, _, note = raw.decode("ascii", "replace").strip().partition(" ")
+        trigger = self.triggers.get(command.upper())
+        if trigger is None:
+            if command:
+                self.ignored += 1
+            return
+        try:
+            self.sessions.trigger(trigger, note.strip())
+        except Exception as e:
+            print(f'Serial trigger {command} failed - {e}')
+
+
+def open_serial_port(port, baudrate=9600):
+    """Open the serial device of the trigger buttons; needs pyserial."""
+    import serial
+
+    return serial.Serial(port, baudrate)
+
+
+class TranscriptStore:
+    """Append-only transcript held in compact parallel arrays.
+
+    Each entry is one transcript line: its start and end meeting time in ms,
+    the stream restart it came from and its text. Status lines that are not
+    recognition results use -1 for the numbers.
+    """
+
+    def __init__(self):
+        self.start_ms = array("q")
+        self.end_ms = array("q")
+        self.restart = array("i")
+        self.texts = []
+
+    def __len__(self):
+        return len(self.texts)
+
+    def append(self, text, start_ms=-1, end_ms=-1, restart=-1):
+        self.start_ms.append(start_ms)
+        self.end_ms.append(end_ms)
+        self.restart.append(restart)
+        self.texts.append(text)
+
+    def line(self, index):
+        """The line as it is displayed in the transcript."""
+        if self.restart[index] < 0:
+            return self.texts[index]
+        return f"{self.end_ms[index]}: {self.texts[index]}"
+
+    def lines(self, start, end):
+        return "\n".join(self.line(i) for i in range(start, end))
+
+
+class TranscriptView:
+    """Shows a sliding window of a TranscriptStore in a Tk Text widget.
+
+    The widget never holds more than `window` lines. While the view follows
+    the end of the transcript, new lines are appended and the oldest ones
+    dropped, so an insert costs the same however long the meeting runs.
+    Scrolling past either edge of the window pages lines back in from the
+    store, and the scrollbar spans the whole store rather than the widget.
+    """
+
+    def __init__(self, text, scrollbar, store, window=TRANSCRIPT_WINDOW):
+        self.text = text
+        self.scrollbar = scrollbar
+        self.store = store
+        self.window = window
+        self.first = 0  # store index of the first line in the widget
+        self.last = 0  # store index one past the last line in the widget
+        self._known = 0  # store length at the previous refresh
+        text.configure(yscrollcommand=self._on_text_scroll)
+        scrollbar.configure(command=self._on_scrollbar)
+
+    def show(self, store):
+        """Switch to another transcript, following its end."""
+        self.store = store
+        self.first = self.last = self._known = 0
+        self.text.delete("1.0", END)
+        self.refresh()
+
+    def refresh(self):
+        """Show lines added to the store since the previous refresh."""
+        following = self.last == self._known
+        self._known = len(self.store)
+        if not following or self.last == self._known:
+            self._update_scrollbar()
+            return
+
+        prefix = "\n" if self.last > self.first else ""
+        self.text.insert("end-1c", prefix + self.store.lines(self.last, self._known))
+        self.last = self._known
+
+        overflow = self.last - self.first - self.window
+        if overflow > 0:
+            self.text.delete("1.0", f"{overflow + 1}.0")
+            self.first += overflow
+        self.text.see(END)
+
+    def _render(self, first, top):
+        """Fill the widget from store line `first` and scroll `top` to the top."""
+        first = max(0, min(first, len(self.store) - self.window))
+        self.first = first
+        self.last = min(len(self.store), first + self.window)
+        self.text.delete("1.0", END)
+        self.text.insert("1.0", self.store.lines(self.first, self.last))
+        self.text.yview(f"{top - self.first + 1}.0")
+
+    def _update_scrollbar(self, lo=None, hi=None):
+        if lo is None:
+            lo, hi = self.text.yview()
+        total = max(1, len(self.store))
+        shown = self.last - self.first
+        self.scrollbar.set((self.first + float(lo) * shown) / total,
+                           (self.first + float(hi) * shown) / total)
+
+    def _on_text_scroll(self, lo, hi):
+        lo, hi = float(lo), float(hi)
+        top = self.first + int(lo * (self.last - self.first))
+        if lo <= 0 and self.first > 0:
+            self._render(self.first - self.window // 2, top)
+        elif hi >= 1 and self.last < len(self.store):
+            self._render(self.first + self.window // 2, top)
+        else:
+            self._update_scrollbar(lo, hi)
+
+    def _on_scrollbar(self, action, amount, what=None):
+        if action == "moveto":
+            top = int(float(amount) * len(self.store))
+            self._render(top - self.window // 4, top)
+        else:
+            self.text.yview_scroll(int(amount), what)
+
+
+class InterimView:
+    """Shows the live interim result in a Tk Text widget, redrawing only changes.
+
+    An update keeps the longest common prefix with the hypothesis already
+    shown and rewrites only the tail after it, in a single insert or
+    replace. The leading `stable` characters, which the recognizer is
+    unlikely to revise, carry the "stable" tag and the rest the "unstable"
+    one. When the boundary moves, the tail is rewritten from where it was
+    or where it is, whichever comes first, so retagging never takes calls
+    of its own.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.shown = ""
+        self.stable = 0
+        text.tag_configure("stable", foreground="black")
+        text.tag_configure("unstable", foreground="gray50")
+
+    def clear(self):
+        self.text.delete("1.0", END)
+        self.shown = ""
+        self.stable = 0
+
+    def show(self, hypothesis, stable=0):
+        shown = self.shown
+        if hypothesis.startswith(shown):
+            common = len(shown)
+        else:
+            common = _common_prefix(shown, hypothesis)
+        start = common
+        if stable != self.stable:
+            start = min(start, self.stable, stable)
+        split = min(max(stable, start), len(hypothesis))
+        chars = (hypothesis[start:split], "stable", hypothesis[split:], "unstable")
+
+        if start < len(shown):
+            self.text.replace(f"1.0+{start}c", "end-1c", *chars)
+        elif start < len(hypothesis):
+            self.text.insert("end-1c", *chars)
+        self.shown = hypothesis
+        self.stable = stable
+
+
+class UIUpdateQueue:
+    """Hands transcript updates from worker threads to the Tk main loop.
+
+    Workers only post to the queue and never touch Tk or wait on it. The
+    main loop drains it every `interval` ms: new transcript lines are passed
+    on in order in a single call, as (text, start_ms, end_ms, restart)
+    tuples, while interim results keep only the latest one posted since the
+    previous frame, as (text, stable) where the first `stable` characters
+    are settled. After close() it drains what is left once and stops.
+    """
+
+    def __init__(self, root, on_append, on_interim, interval=UI_FRAME_INTERVAL):
+        self._root = root
+        self._on_append = on_append
+        self._on_interim = on_interim
+        self.interval = interval
+        self._appends = collections.deque()
+        self._interim = None
+        self._lock = threading.Lock()
+        self._closed = False
+        self.coalesced = 0
+
+    def post_text(self, text):
+        """Append a status line to the transcript."""
+        self._appends.append((text, -1, -1, -1))
+
+    def post_final(self, text, start_ms, end_ms, restart):
+        """Append a final result, which supersedes any pending interim one."""
+        with self._lock:
+            if self._interim is not None:
+                self._interim = None
+                self.coalesced += 1
+            self._appends.append((text, start_ms, end_ms, restart))
+
+    def post_interim(self, text, stable=0):
+        """Replace the live interim result."""
+        with self._lock:
+            if self._interim is not None:
+                self.coalesced += 1
+            self._interim = (text, stable)
+
+    def start(self):
+        self._root.after(self.interval, self._drain)
+
+    def close(self):
+        """The session has finished; stop once its last updates are shown."""
+        with self._lock:
+            self._closed = True
+
+    def _drain(self):
+        with self._lock:
+            interim, self._interim = self._interim, None
+            appends = []
+            while self._appends:
+                appends.append(self._appends.popleft())
+            closed = self._closed
+
+        if appends:
+            self._on_append(appends)
+        if interim is not None:
+            self._on_interim(*interim)
+
+        if not closed:
+            self._root.after(self.interval, self._drain)
 
 
 class GUI:
@@ -202,9 +3870,36 @@ class GUI:
         self.meeting_name_inp = Entry(self.input_fr, width=50, textvariable=self.meeting_name)
         self.meeting_name_inp.pack(side=TOP)
 
+        # The compressed encodings are offered once their libraries load.
+        self.encoding = StringVar(value=AudioEncoder.encoding)
+        self.encoding_opt = OptionMenu(self.input_fr, self.encoding, AudioEncoder.encoding)
+        self.encoding_opt.pack(side=TOP)
+
+        # The devices are listed once PyAudio is loaded; see _load_backends().
+        self.devices = {"Default input device": None}
+        self.device = StringVar(value="Default input device")
+        self.device_opt = OptionMenu(self.input_fr, self.device, *self.devices)
+        self.device_opt.pack(side=TOP)
+
         self.start_btn = Button(self.input_fr, text='Start transcribe',
                                 command=self.start_transcribe)
-        self.start_btn.pack(side=BOTTOM)
+        self.start_btn.pack(side=LEFT)
+
+        self.stop_btn = Button(self.input_fr, text='Stop transcribe',
+                               command=self.stop_transcribe)
+        self.stop_btn.pack(side=LEFT)
+
+        # session frame
+        self.session_fr = Frame(self.master)
+        self.session_fr.pack(side=TOP)
+
+        self.session_lbl = Label(self.session_fr, text='Sessions')
+        self.session_lbl.pack(side=TOP)
+
+        self.session_lst = Listbox(self.session_fr, width=100, height=4,
+                                   exportselection=False)
+        self.session_lst.pack(side=TOP)
+        self.session_lst.bind("<<ListboxSelect>>", self._on_select_session)
 
         # result frame
         self.result_fr = Frame(self.master)
@@ -217,169 +3912,225 @@ class GUI:
                                     width=100, height=5,
                                     wrap=WORD)
         self.live_trans_txt.pack(side=TOP)
+        self.interim_view = InterimView(self.live_trans_txt)
 
         self.transcript_lbl = Label(self.result_fr, text='Meeting content')
         self.transcript_lbl.pack(side=TOP)
 
-        self.transcript_txt = Text(self.result_fr,
+        self.transcript_fr = Frame(self.result_fr)
+        self.transcript_fr.pack(side=TOP)
+
+        self.transcript_txt = Text(self.transcript_fr,
                                     width=100, height=20,
                                     wrap=WORD)
-        self.transcript_txt.pack(side=TOP)
-
-
-    def start_transcribe(self):
-        threading.Thread(target=self.audio_transcribe, daemon=True).start()
+        self.transcript_txt.pack(side=LEFT)
 
+        self.transcript_scroll = Scrollbar(self.transcript_fr)
+        self.transcript_scroll.pack(side=RIGHT, fill=Y)
 
-    def audio_transcribe(self):
-        """start bidirectional streaming from microphone input to speech API"""
-        mtg_name = self.meeting_name_inp.get()
-
-        # self.transcript_txt.configure(state=NORMAL)
-        client = speech.SpeechClient()
-        config = speech.RecognitionConfig(
-            encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
-            sample_rate_hertz=SAMPLE_RATE,
-            language_code="en-US",
-            max_alternatives=1,
-        )
+        # Each session keeps its own transcript; the view shows the selected one.
+        self.transcripts = {}
+        self.updates = {}
+        self.selected = None
+        self._session_ids = []
+        self.transcript_view = TranscriptView(
+            self.transcript_txt, self.transcript_scroll, TranscriptStore())
 
-        streaming_config = speech.StreamingRecognitionConfig(
-            config=config, interim_results=True
-        )
-
-        mic_manager = ResumableMicrophoneStream(
-            SAMPLE_RATE, CHUNK_SIZE)  # real time voice
+        # Finals of meetings cut short by a crash are picked up again when a
+        # meeting of the same name starts, once _load_backends() read them.
+        self.journal = TranscriptJournal(JOURNAL_PATH)
+        self.recovered = {}
 
-        self.transcript_txt.insert(
-            END, f'\n{mtg_name} - Start recording.\n')
-        # self.transcript_txt.insert(END, "End (ms)       Transcript Results/Status\n")
-        self.transcript_txt.insert(
-            END, "=====================================================")
-        self.transcript_txt.update_idletasks()
-        self.live_trans_txt.update_idletasks()
+        if KEYWORDS_FILE:
+            keywords = KeywordSpotter.load(KEYWORDS_FILE)
+        else:
+            keywords = KeywordSpotter(EXIT_KEYWORDS)
+        keywords.on("bookmark", self._keyword_noted)
+        keywords.on("alert", self._keyword_noted)
 
-        with mic_manager as stream:
+        if ENGINE == "asyncio":
+            self.client_pool = None
+            self.sessions = AsyncSessionManager(journal=self.journal,
+                                                archive_dir=ARCHIVE_DIR,
+                                                keywords=keywords)
+        else:
+            self.client_pool = SpeechClientPool()
+            self.sessions = SessionManager(self.client_pool, journal=self.journal,
+                                           archive_dir=ARCHIVE_DIR, keywords=keywords)
+        self.ready = threading.Event()
+        self.serial = None
+        self.master.after(1000, self._refresh_sessions)
+        self.master.protocol("WM_DELETE_WINDOW", self._on_close)
 
-            while not stream.closed:
 
-                self.transcript_txt.insert(
-                    END, "\n" + str(STREAMING_LIMIT * stream.restart_counter) + f"{mtg_name} contents\n")
-                self.transcript_txt.update_idletasks()
+    def load_backends(self):
+        """Load the speech and audio stacks on a background thread.
 
-                stream.audio_input = []
-                audio_generator = stream.generator()
-
-                requests = (
-                    speech.StreamingRecognizeRequest(audio_content=content)
-                    for content in audio_generator
-                )
+        Call once the window is painted. Sessions started before they are
+        ready load what they need on their own thread.
+        """
+        threading.Thread(target=self._load_backends, daemon=True).start()
+        self.master.after(50, self._check_ready)
 
-                responses = client.streaming_recognize(streaming_config, requests)
 
-                # Now, put the transcription responses to use.
-                a = self.listen_print_loop(responses, stream)
-                self.transcript_txt.insert(END, str(a))
-                self.transcript_txt.update_idletasks()
-                # self.transcript_txt.configure(state=DISABLED)
-                if stream.result_end_time > 0:
-                    stream.final_request_end_time = stream.is_final_end_time
-                stream.result_end_time = 0
-                stream.last_audio_input = []
-                stream.last_audio_input = stream.audio_input
-                stream.audio_input = []
-                stream.restart_counter = stream.restart_counter + 1
+    def _load_backends(self):
+        try:
+            timings = preload()
+            devices = list_input_devices()
+        except (ImportError, OSError) as e:
+            print(f'Could not load the audio stack - {e}')
+            timings, devices = {}, {}
+        if self.client_pool is not None:
+            self.client_pool.warm()
+        if SERIAL_PORT:
+            try:
+                self.serial = SerialThread(open_serial_port(SERIAL_PORT), self.sessions)
+                self.serial.start()
+            except (ImportError, OSError) as e:
+                print(f'Could not open the trigger buttons on {SERIAL_PORT} - {e}')
+        self._listed_devices = devices
+        unavailable = unavailable_encoders()
+        for encoding, reason in unavailable.items():
+            print(f'{encoding} is not available - {reason}')
+        self._encodings = [encoding for encoding in AUDIO_ENCODERS
+                           if encoding not in unavailable]
+        self.journal.loaded.wait()
+        self._recovered = TranscriptJournal.rebuild(self.journal.recovered)
+        self.ready.set()
+        print('Loaded ' + ', '.join(f'{name} in {seconds * 1000:.0f} ms'
+                                    for name, seconds in timings.items()))
 
-                if not stream.last_transcript_was_final:
 
-                    self.transcript_txt.insert(END, "\n")
-                    self.transcript_txt.update_idletasks()
+    def _check_ready(self):
+        if not self.ready.is_set():
+            self.master.after(50, self._check_ready)
+            return
+        self.devices.update(self._listed_devices)
+        self.recovered.update(self._recovered)
+        menu = self.device_opt["menu"]
+        menu.delete(0, END)
+        for name in self.devices:
+            menu.add_command(label=name, command=tk._setit(self.device, name))
+        menu = self.encoding_opt["menu"]
+        menu.delete(0, END)
+        for encoding in self._encodings:
+            menu.add_command(label=encoding, command=tk._setit(self.encoding, encoding))
 
-                stream.new_stream = True
 
+    def _keyword_noted(self, match):
+        if match.is_final:
+            match.session.updates.post_text(
+                f'{match.end_ms}: {match.action.upper()} - {match.phrase}')
 
-    def listen_print_loop(self, responses, stream):  # convert voice into text print the data
-        """Iterates through server responses and prints them.
-        The responses passed is a generator that will block until a response
-        is provided by the server.
-        Each response may contain multiple results, and each result may contain
-        multiple alternatives; for details, see https://goo.gl/tjCPAU.  Here we
-        print only the transcription for the top alternative of the top result.
-        In this case, responses are provided for interim results as well. If the
-        response is an interim one, print a line feed at the end of it, to allow
-        the next result to overwrite it, until the response is a final one. For the
-        final one, print a newline to preserve the finalized transcription.
-        """
-        for response in responses:
 
-            if get_current_time() - stream.start_time > STREAMING_LIMIT:
-                stream.start_time = get_current_time()
-                break
+    def _on_close(self):
+        if self.serial is not None:
+            self.serial.stop()
+        sessions = list(self.sessions.sessions.values())
+        self.sessions.stop_all()
+        # The audio still queued is drained before the journal is closed, so
+        # its finals are kept.
+        deadline = time.monotonic() + SHUTDOWN_TIMEOUT / 1000
+        for session in sessions:
+            if not session.finished.wait(max(0, deadline - time.monotonic())):
+                print(f'{session.name} - closed before its last finals arrived')
+        self.journal.close()
+        self.master.destroy()
 
-            if not response.results:
-                continue
 
-            result = response.results[0]
+    def _append_transcript(self, store, lines):
+        for line in lines:
+            store.append(*line)
+        if store is self.transcript_view.store:
+            self.transcript_view.refresh()
 
-            if not result.alternatives:
-                continue
 
-            transcript = result.alternatives[0].transcript
+    def _show_interim(self, store, text, stable):
+        if store is self.transcript_view.store:
+            self.interim_view.show(text, stable)
 
-            result_seconds = 0
-            result_micros = 0
 
-            if result.result_end_time.seconds:
-                result_seconds = result.result_end_time.seconds
+    def start_transcribe(self):
+        recovered = self.recovered.pop(self.meeting_name_inp.get(), None)
+        if recovered is None:
+            store = TranscriptStore()
+        else:
+            store, sessions = recovered
+            # This meeting carries the transcript on; later starts must not
+            # be offered it again.
+            self.journal.adopt(self.meeting_name_inp.get(), sessions)
+        ui_updates = UIUpdateQueue(
+            self.master,
+            lambda lines: self._append_transcript(store, lines),
+            lambda text, stable: self._show_interim(store, text, stable))
+        ui_updates.start()
+        self.transcript_view.show(store)
+        self.interim_view.clear()
 
-            if result.result_end_time.microseconds:
-                result_micros = result.result_end_time.microseconds
+        # Connecting a client may block, so keep it off the Tk thread.
+        threading.Thread(target=self.audio_transcribe,
+                         args=(self.meeting_name_inp.get(), store, ui_updates,
+                               self.devices[self.device.get()], self.encoding.get()),
+                         daemon=True).start()
 
-            stream.result_end_time = int(
-                (result_seconds * 1000) + (result_micros / 1000))
 
-            corrected_time = (
-                stream.result_end_time
-                - stream.bridging_offset
-                + (STREAMING_LIMIT * stream.restart_counter)
-            )
-            # Display interim results, but with a carriage return at the end of the
-            # line, so subsequent lines will overwrite them.
+    def audio_transcribe(self, mtg_name, store, ui_updates, device_index=None,
+                         encoding=AudioEncoder.encoding):
+        """start bidirectional streaming from microphone input to speech API"""
 
-            if result.is_final:
-                print('FINAL - ', transcript)
-                self.transcript_txt.insert(
-                    END, "\n" + str(corrected_time) + ": " + transcript)
-                self.transcript_txt.see(END)
-                self.live_trans_txt.update_idletasks()
+        # self.transcript_txt.configure(state=NORMAL)
+        try:
+            session_id = self.sessions.start_session(
+                mtg_name, ui_updates, device_index=device_index, encoding=encoding)
+        except (RuntimeError, OSError, grpc.FutureTimeoutError) as e:
+            ui_updates.post_text(f'{mtg_name} - Could not start: {e}')
+            ui_updates.close()
+            return
+        self.transcripts[session_id] = store
+        self.updates[session_id] = ui_updates
+        self.selected = session_id
 
-                self.transcript_txt.update_idletasks()
 
-                stream.is_final_end_time = stream.result_end_time
-                stream.last_transcript_was_final = True
+    def stop_transcribe(self):
+        if self.selected is not None:
+            self.sessions.stop_session(self.selected)
 
-                # Exit recognition if any of the transcribed phrases could be
-                # one of our keywords.
-                if re.search(r"\b(exit|quit)\b", transcript, re.I):
-                    self.transcript_txt.insert(END, "\nExiting...\n")
-                    self.transcript_txt.update_idletasks()
 
-                    stream.closed = True
-                    break
+    def _on_select_session(self, event):
+        selection = self.session_lst.curselection()
+        if not selection:
+            return
+        session_id = self._session_ids[selection[0]]
+        self.selected = session_id
+        self.transcript_view.show(self.transcripts[session_id])
+        self.interim_view.clear()
 
-            else:
-                self.live_trans_txt.delete("1.0", "end")
-                self.live_trans_txt.insert(
-                    END, "\033" + str(corrected_time) + ": " + transcript + "\r")
-                self.live_trans_txt.update_idletasks()
-                self.transcript_txt.update_idletasks()
 
-                stream.last_transcript_was_final = False
+    def _refresh_sessions(self):
+        status = self.sessions.status()
+        self._session_ids = [session["id"] for session in status]
+        for session_id in list(self.updates):
+            if session_id not in self.sessions.sessions:
+                # Finished; its queue only has to show what is left.
+                self.updates.pop(session_id).close()
+        self.session_lst.delete(0, END)
+        for session in status:
+            self.session_lst.insert(
+                END, f'{session["name"]} - {session["state"]}, '
+                     f'{session["audio_seconds"]:.0f} s, {session["finals"]} finals')
+            if session["id"] == self.selected:
+                self.session_lst.selection_set(END)
+        self.master.after(1000, self._refresh_sessions)
 
 
 def main():
+    if METRICS_PORT or METRICS_FILE:
+        enable_metrics(METRICS_PORT, METRICS_FILE)
     root = Tk()
     main_ui = GUI(root)
+    # Paint the window before the heavy imports compete with Tk for the GIL.
+    root.update()
+    main_ui.load_backends()
     root.mainloop()
 
 